@@ -4,6 +4,9 @@ import cv2
 import numpy as np
 import requests
 
+# import our basic, light-weight png reader library
+import imageIO.png
+
 # THE FOLLOWING METHODS ARE PART OF THE ASSIGNMENT EXTENSION
 
 # Save the plate image
@@ -17,6 +20,32 @@ def SaveLicensePlateImage(px_array, min_x, min_y, max_x, max_y):
 
     cv2.imwrite("current_plate.png", plate_array)
 
+# Save the plate image straight from the png file, for a second pass over an archived frame
+# Only the plate rectangle gets decoded, and nothing after its last row is read from the file
+# The plate goes through the same greyscale rule as computeRGBToGreyscale, round(0.299*r + 0.587*g + 0.114*b) in
+# floating point with halves to even, so it holds the pixels the detector saw. Only straightlaced 8-bit greyscale
+# or RGB files, with or without alpha, can be cropped like this; anything else raises a ValueError, and has to be
+# read whole with readRGBImageToSeparatePixelArrays and saved with SaveLicensePlateImage instead
+def SaveLicensePlateImageFromFile(input_filename, min_x, min_y, max_x, max_y):
+
+    image_reader = imageIO.png.Reader(filename=input_filename)
+    image_reader.preamble()
+    if image_reader.bitdepth != 8 or image_reader.colormap or image_reader.interlace:
+        raise ValueError("{}: only straightlaced 8-bit greyscale or RGB pngs can be cropped from the file, not a "
+                         "{}-bit{}{} one".format(input_filename, image_reader.bitdepth,
+                                                 " palette" if image_reader.colormap else "",
+                                                 " interlaced" if image_reader.interlace else ""))
+    (plate_width, plate_height, plate_rows, plate_info) = image_reader.read_region(min_x, max_y, max_x, min_y)
+
+    plate_pixels = np.array(plate_rows, dtype=np.float64).reshape(plate_height, plate_width, plate_info["planes"])
+    if plate_info["greyscale"]:
+        (red, green, blue) = (plate_pixels[:, :, 0],) * 3
+    else:
+        (red, green, blue) = (plate_pixels[:, :, 0], plate_pixels[:, :, 1], plate_pixels[:, :, 2])
+    plate_array = np.rint(0.299*red + 0.587*green + 0.114*blue)
+
+    cv2.imwrite("current_plate.png", plate_array.astype(np.uint8))
+
 # Compress the plate image to a smaller file size
 def CompressImage(image_name="current_plate.png"):
     picture = Image.open(image_name)
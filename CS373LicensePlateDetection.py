@@ -1,5 +1,10 @@
 # jwel929
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
 import math
+import os
 import sys
 from pathlib import Path
 
@@ -12,67 +17,67 @@ import imageIO.png
 # import for the assignment extension
 #import CS373Extension
 
+# turns one channel plane from imageIO.png.split_planes into a list of rows
+# with NumPy the plane is a height x width array, without it a flat memoryview of width * height values in row order
+def planeToRows(plane, image_width, image_height):
+
+    if plane.ndim == 2:
+        return plane.tolist()
+    return [plane[y * image_width:(y + 1) * image_width].tolist() for y in range(image_height)]
+
+
 # this function reads an RGB color png file and returns width, height, as well as pixel arrays for r,g,b
 def readRGBImageToSeparatePixelArrays(input_filename):
 
     image_reader = imageIO.png.Reader(filename=input_filename)
-    # png reader gives us width and height, as well as RGB data in image_rows (a list of rows of RGB triplets)
-    (image_width, image_height, rgb_image_rows, rgb_image_info) = image_reader.read()
+    # png reader decodes straight into one height x width x 3 buffer of RGB triplets
+    (image_width, image_height, rgb_pixels, rgb_image_info) = image_reader.read_ndarray()
 
     print("read image width={}, height={}".format(image_width, image_height))
 
     # our pixel arrays are lists of lists, where each inner list stores one row of greyscale pixels
-    pixel_array_r = []
-    pixel_array_g = []
-    pixel_array_b = []
-
-    for row in rgb_image_rows:
-        pixel_row_r = []
-        pixel_row_g = []
-        pixel_row_b = []
-        r = 0
-        g = 0
-        b = 0
-        for elem in range(len(row)):
-            # RGB triplets are stored consecutively in image_rows
-            if elem % 3 == 0:
-                r = row[elem]
-            elif elem % 3 == 1:
-                g = row[elem]
-            else:
-                b = row[elem]
-                pixel_row_r.append(r)
-                pixel_row_g.append(g)
-                pixel_row_b.append(b)
-
-        pixel_array_r.append(pixel_row_r)
-        pixel_array_g.append(pixel_row_g)
-        pixel_array_b.append(pixel_row_b)
+    # the channel planes are views into the decoded buffer, so only the final lists get built
+    (plane_r, plane_g, plane_b) = imageIO.png.split_planes(rgb_pixels)[:3]
+    pixel_array_r = planeToRows(plane_r, image_width, image_height)
+    pixel_array_g = planeToRows(plane_g, image_width, image_height)
+    pixel_array_b = planeToRows(plane_b, image_width, image_height)
 
     return (image_width, image_height, pixel_array_r, pixel_array_g, pixel_array_b)
 
 
-# a useful shortcut method to create a list of lists based array representation for an image, initialized with a value
-def createInitializedGreyscalePixelArray(image_width, image_height, initValue = 0):
+# this function reads a png file straight to greyscale and returns width, height, as well as a single pixel array
+# the png reader converts each row to greyscale as it is decoded, so the r,g,b pixel arrays never exist
+def readGreyscaleImageToPixelArray(input_filename):
 
-    new_array = [[initValue for x in range(image_width)] for y in range(image_height)]
-    return new_array
+    image_reader = imageIO.png.Reader(filename=input_filename)
+    (image_width, image_height, grey_image_rows, grey_image_info) = image_reader.asGrey8(weights=(0.299, 0.587, 0.114), exact=True)
 
-class Queue:
-    def __init__(self):
-        self.items = []
+    print("read image width={}, height={}".format(image_width, image_height))
+
+    pixel_array = [list(row) for row in grey_image_rows]
+
+    return (image_width, image_height, pixel_array)
 
-    def isEmpty(self):
-        return self.items == []
 
-    def enqueue(self, item):
-        self.items.insert(0,item)
+# The greyscale rows of a png file, decoded again every time they are iterated over, so a stage that needs
+# two passes over the image can stream it twice instead of holding it in memory
+class GreyscaleRowsFromFile:
+    def __init__(self, input_filename):
+        self.input_filename = input_filename
+        (self.image_width, self.image_height) = imageIO.png.probe(input_filename)[:2]
 
-    def dequeue(self):
-        return self.items.pop()
+    def __iter__(self):
+        image_reader = imageIO.png.Reader(filename=self.input_filename)
+        (image_width, image_height, grey_image_rows, grey_image_info) = image_reader.asGrey8(weights=(0.299, 0.587, 0.114), exact=True)
+        for row in grey_image_rows:
+            yield list(row)
 
-    def size(self):
-        return len(self.items)
+
+# a useful shortcut method to create a list of lists based array representation for an image, initialized with a value
+def createInitializedGreyscalePixelArray(image_width, image_height, initValue = 0):
+
+    new_array = [[initValue for x in range(image_width)] for y in range(image_height)]
+    return new_array
 
 def computeRGBToGreyscale(pixel_array_r, pixel_array_g, pixel_array_b, image_width, image_height):
     
@@ -133,6 +138,71 @@ def computeStandardDeviationImage5x5(pixel_array, image_width, image_height):
     
     return end_result
 
+# The deviation of the window centred on column j of window_rows, worked out the way computeStandardDeviationImage5x5
+# does it: the mean from the integer sum, then the squared differences added up row by row
+def windowDeviation(window_rows, j):
+
+    radius = len(window_rows) // 2
+    window = [row[j-radius:j+radius+1] for row in window_rows]
+    count = len(window_rows) * len(window_rows)
+    mean = (1/count) * sum(sum(row) for row in window)
+
+    variance_sum = 0
+    for row in window:
+        for value in row:
+            variance_sum = variance_sum + (value - mean)**2
+
+    return (variance_sum/count)**0.5
+
+# Standard deviation over a (2*radius+1) x (2*radius+1) window, radius 2 being the 5x5 one above.
+# Uses summed-area tables of the pixels and of their squares, so every pixel costs the same whatever the window size.
+# On integer pixels the sums are exact, and the variance is count*sum_of_squares - sum*sum over count*count,
+# so the only rounding is the final division and square root. The radius pixels around the edge stay 0.0.
+# Adding up the squared differences one by one rounds a little differently, so radius 2 is left to
+# computeStandardDeviationImage5x5, to give exactly its floats
+def computeStandardDeviationImage(pixel_array, image_width, image_height, radius=2):
+
+    if radius == 2:
+        return computeStandardDeviationImage5x5(pixel_array, image_width, image_height)
+
+    end_result = createInitializedGreyscalePixelArray(image_width, image_height, 0.0)
+
+    size = 2*radius + 1
+    count = size*size
+
+    # sums[i][j] is the sum of all pixels above row i and left of column j, same for squares
+    sums = [[0] * (image_width+1)]
+    squares = [[0] * (image_width+1)]
+    for row in pixel_array:
+        above_sums = sums[-1]
+        above_squares = squares[-1]
+        row_sums = [0]
+        row_squares = [0]
+        running_sum = 0
+        running_square = 0
+        for j in range(image_width):
+            running_sum = running_sum + row[j]
+            running_square = running_square + row[j]*row[j]
+            row_sums.append(above_sums[j+1] + running_sum)
+            row_squares.append(above_squares[j+1] + running_square)
+        sums.append(row_sums)
+        squares.append(row_squares)
+
+    for i in range(radius, image_height-radius):
+        top_sums = sums[i-radius]
+        bottom_sums = sums[i+radius+1]
+        top_squares = squares[i-radius]
+        bottom_squares = squares[i+radius+1]
+        for j in range(radius, image_width-radius):
+            left = j-radius
+            right = j+radius+1
+            pixel_sum = bottom_sums[right] - bottom_sums[left] - top_sums[right] + top_sums[left]
+            square_sum = bottom_squares[right] - bottom_squares[left] - top_squares[right] + top_squares[left]
+
+            end_result[i][j] = math.sqrt((count*square_sum - pixel_sum*pixel_sum) / (count*count))
+
+    return end_result
+
 def computeThresholdGE(pixel_array, threshold_value, image_width, image_height):
     for i in range(image_height):
         for j in range(image_width):
@@ -186,68 +256,663 @@ def computeErosion8Nbh3x3FlatSE(pixel_array, image_width, image_height): # TODO
                 
     return end_array
 
-def computeConnectedComponentLabeling(pixel_array, image_width, image_height):
-
-    visited = {}
-
-    myQueue = Queue()
-
-    replace = 1
-
-    for i in range(image_height):
-        for j in range(image_width):
-            visited[i,j] = 0
-    
-    for i in range(image_height):
-        for j in range(image_width):
-
-            if (visited[i,j] == 1):
-                continue
-            
-            if (pixel_array[i][j] != 0):
-                myQueue.items.insert(0, [i,j])
-            
-            else:
-                visited[i,j] == 1
-                continue
-
-            while (myQueue.isEmpty() == False):
-                temp = myQueue.items.pop()
-
-                pixel_array[temp[0]][temp[1]] = replace
-
-                if (temp[1] - 1 >= 0 and visited[temp[0], temp[1] - 1] == 0 and pixel_array[temp[0]][temp[1]-1] != 0):
-                    myQueue.items.insert(0, [temp[0],temp[1] - 1])
-                    visited[temp[0],temp[1] - 1] = 1
-
-                if (temp[1] + 1 < image_width and visited[temp[0], temp[1]+1] == 0 and pixel_array[temp[0]][temp[1]+1] != 0):
-                    myQueue.items.insert(0, [temp[0],temp[1]+1])
-                    visited[temp[0],temp[1] + 1] = 1
-
-                if (temp[0] - 1 >= 0 and visited[temp[0]-1, temp[1]] == 0 and pixel_array[temp[0]-1][temp[1]] != 0):
-                    myQueue.items.insert(0, [temp[0]-1,temp[1]])
-                    visited[temp[0] - 1,temp[1]] = 1
-
-                if (temp[0] + 1 < image_height and visited[temp[0]+1, temp[1]] == 0 and pixel_array[temp[0]+1][temp[1]] != 0):
-                    myQueue.items.insert(0, [temp[0]+1,temp[1]])
-                    visited[temp[0] + 1,temp[1]] = 1
-        
-
+# Running max (or min) of every (2*radius+1) long window along a line, van Herk/Gil-Werman style.
+# The line is padded with zeros and cut into blocks as long as the window; any window then covers the end of one
+# block and the start of the next, so it is the extreme of a suffix and a prefix, about 3 comparisons per pixel
+# whatever the radius. The zeros make windows that stick out of the image count as 0, for max and min alike.
+def slidingWindowExtreme(line, radius, extreme):
+
+    size = 2*radius + 1
+    length = len(line)
+    padded_length = -(-(length + 2*radius) // size) * size
+
+    padded = [0] * radius + list(line)
+    padded = padded + [0] * (padded_length - len(padded))
+
+    prefix = padded[:]
+    for x in range(padded_length):
+        if x % size != 0:
+            prefix[x] = extreme(prefix[x-1], padded[x])
+
+    suffix = padded[:]
+    for x in range(padded_length-2, -1, -1):
+        if (x+1) % size != 0:
+            suffix[x] = extreme(suffix[x+1], padded[x])
+
+    return [extreme(suffix[x], prefix[x+size-1]) for x in range(length)]
+
+# Dilation with a (2*radius+1) x (2*radius+1) square, done as a pass along the rows and then along the columns.
+# Gives exactly what radius repeats of computeDilation8Nbh3x3FlatSE give, outside the image counting as 0.
+def computeDilationSquare(pixel_array, image_width, image_height, radius=1):
+
+    rows = [slidingWindowExtreme([1 if value > 0 else 0 for value in row], radius, max) for row in pixel_array]
+    columns = [slidingWindowExtreme(column, radius, max) for column in zip(*rows)]
+
+    return [list(row) for row in zip(*columns)]
+
+# Erosion with a (2*radius+1) x (2*radius+1) square, in the same two passes.
+# Gives exactly what radius repeats of computeErosion8Nbh3x3FlatSE give, including the radius pixel border of zeros.
+def computeErosionSquare(pixel_array, image_width, image_height, radius=1):
+
+    rows = [slidingWindowExtreme([1 if value > 0 else 0 for value in row], radius, min) for row in pixel_array]
+    columns = [slidingWindowExtreme(column, radius, min) for column in zip(*rows)]
+
+    return [list(row) for row in zip(*columns)]
+
+# Closing: iterations dilations then iterations erosions with a (2*radius+1) square, each done as one bigger square,
+# so main()'s 4 dilations and 4 erosions of 3x3 are radius=1, iterations=4
+def computeClosing(pixel_array, image_width, image_height, radius=1, iterations=4):
+
+    px_array = computeDilationSquare(pixel_array, image_width, image_height, radius*iterations)
+
+    return computeErosionSquare(px_array, image_width, image_height, radius*iterations)
+
+# A black and white image packed into bits, for the stages after the threshold.
+# Each row is one python int with bit j set when pixel j is white, about an eighth of a byte per pixel
+# instead of a list entry per pixel. Shifting, OR-ing and AND-ing a row works on whole machine words at a time,
+# so dilating or eroding a row costs a handful of int operations instead of one step per pixel.
+class BinaryMask:
+    def __init__(self, rows, image_width, image_height):
+        self.rows = rows
+        self.image_width = image_width
+        self.image_height = image_height
+        self.full_row = (1 << image_width) - 1
+
+    # pixels >= threshold_value become white, like computeThresholdGE
+    @classmethod
+    def fromThreshold(cls, pixel_array, threshold_value, image_width, image_height):
+        rows = []
+        for row in pixel_array:
+            # the string is written last pixel first, so pixel j ends up as bit j
+            rows.append(int("".join("1" if value >= threshold_value else "0" for value in reversed(row)) or "0", 2))
+        return cls(rows, image_width, image_height)
+
+    # pixels > 0 become white, like the morphology functions read their input
+    @classmethod
+    def fromPixelArray(cls, pixel_array, image_width, image_height):
+        rows = []
+        for row in pixel_array:
+            rows.append(int("".join("1" if value > 0 else "0" for value in reversed(row)) or "0", 2))
+        return cls(rows, image_width, image_height)
+
+    # back to a list of lists, white pixels becoming white_value
+    def toPixelArray(self, white_value=1):
+        pixel_array = []
+        for bits in self.rows:
+            text = format(bits, "0{}b".format(self.image_width))[::-1][:self.image_width]
+            pixel_array.append([white_value if bit == "1" else 0 for bit in text])
+        return pixel_array
+
+    # number of white pixels
+    def area(self):
+        return sum(bin(bits).count("1") for bits in self.rows)
+
+    # every row and every column gets the running OR (or AND) of a 2*radius+1 window, outside the image counting as 0.
+    # windows grow by doubling: after combining with copies shifted by step, a window covering reach pixels each side
+    # covers reach+step, so the radius is reached in about log2(radius) steps
+    def spread(self, radius, combine):
+        rows = self.rows
+        reach = 0
+        while reach < radius:
+            step = min(reach+1, radius-reach)
+            rows = [combine(combine(bits, (bits << step) & self.full_row), bits >> step) for bits in rows]
+            reach = reach + step
+
+        reach = 0
+        while reach < radius:
+            step = min(reach+1, radius-reach)
+            above = [0] * step + rows[:-step]
+            below = rows[step:] + [0] * step
+            rows = [combine(combine(bits, bits_above), bits_below) for bits, bits_above, bits_below in zip(rows, above, below)]
+            reach = reach + step
+
+        return BinaryMask(rows, self.image_width, self.image_height)
+
+    # same as computeDilationSquare
+    def dilate(self, radius=1):
+        return self.spread(radius, lambda first, second: first | second)
+
+    # same as computeErosionSquare, the radius pixels around the edge end up black
+    def erode(self, radius=1):
+        return self.spread(radius, lambda first, second: first & second)
+
+    # same as computeClosing
+    def close(self, radius=1, iterations=4):
+        return self.dilate(radius*iterations).erode(radius*iterations)
+
+    # same as computeConnectedComponentRegions, reading the runs straight from the bits
+    def labelRegions(self, connectivity=4):
+        return labelRowBits(self.rows, self.image_width, self.image_height, connectivity)
+
+# The first stretch of scaleTo0And255AndQuantize as a lookup table, from greyscale value - grey_min to stretched value
+def stretchTable(grey_min, grey_max):
+
+    range_vals = grey_max - grey_min
+    if range_vals == 0:
+        multiplier = 0
+    else:
+        multiplier = 255/range_vals
 
-            replace = replace + 1
+    return [round(value*multiplier) for value in range(range_vals+1)]
+
+# For radius 2 the deviations are computeStandardDeviationImage5x5's, which are within a few roundings of the square
+# root of the exact variance; far less than this share of it
+DEVIATION_TOLERANCE = 1e-9
+
+# A pixel can only end up white if deviation * 255/largest >= the threshold rounded up, less 1/2; with a bit of
+# room for rounding, that is variance * 255*255 >= (threshold - 1)**2 * largest variance. This is the share of the
+# largest variance that a pixel needs to keep its chance
+def thresholdKeepRatio(threshold_value):
+
+    return (math.ceil(threshold_value) - 1)**2 / (255*255) * 0.999
+
+# Standard deviation windows down a stream of stretched rows, the first of them being row first_row of the image.
+# Keeps a ring of the last 2*radius+1 rows with their column sums, so each window's sums (and
+# count*sum_of_squares - sum*sum, the variance times count*count) come from a few additions per pixel.
+# Gives the largest variance of all the windows, and by image row the (column, variance, window_rows) of the pixels
+# whose variance is at least keep_ratio of the largest so far; the largest can only grow, so no pixel that could pass
+# is left out. For radius 2 window_rows are the rows of the pixel's window, for windowDeviation, otherwise None
+def varianceCandidates(stretched_rows, image_width, radius, keep_ratio, first_row=0):
+
+    size = 2*radius + 1
+    count = size*size
+
+    ring = [None] * size
+    column_sums = [0] * image_width
+    column_squares = [0] * image_width
+    largest_variance = 0
+    candidates = {}
+
+    for i, stretched in enumerate(stretched_rows):
+        squared = [value*value for value in stretched]
+
+        if i >= size:
+            (old_stretched, old_squared) = ring[i % size]
+            column_sums = [total - old for total, old in zip(column_sums, old_stretched)]
+            column_squares = [total - old for total, old in zip(column_squares, old_squared)]
+        column_sums = [total + new for total, new in zip(column_sums, stretched)]
+        column_squares = [total + new for total, new in zip(column_squares, squared)]
+        ring[i % size] = (stretched, squared)
+
+        if i < size-1:
+            continue
+
+        sum_prefix = [0]
+        square_prefix = [0]
+        for total, square in zip(column_sums, column_squares):
+            sum_prefix.append(sum_prefix[-1] + total)
+            square_prefix.append(square_prefix[-1] + square)
+
+        variances = [count*(square_right - square_left) - (sum_right - sum_left)**2
+                     for sum_left, sum_right, square_left, square_right
+                     in zip(sum_prefix, sum_prefix[size:], square_prefix, square_prefix[size:])]
+
+        largest_variance = max(largest_variance, max(variances))
+        bound = keep_ratio * largest_variance
+        window_rows = [ring[k % size][0] for k in range(i+1, i+1+size)] if radius == 2 else None
+        kept = [(j + radius, variance, window_rows) for j, variance in enumerate(variances)
+                if variance >= bound and variance > 0]
+        if kept:
+            candidates[first_row + i - radius] = kept
+
+    return largest_variance, candidates
+
+# The second stretch and the threshold, once the largest variance is known: a candidate is white when its deviation
+# stretched by 255/largest deviation rounds to threshold_value or more, the smallest deviation being the border's 0.0.
+# For radius 2 the square root of the exact variance is close to, but not always the same float as, the 5x5
+# deviation; windowDeviation works out the real one only where that could change anything: for the windows that
+# could have the largest deviation, and those that stretch to within DEVIATION_TOLERANCE of where rounding tips over
+def thresholdVarianceCandidates(candidates, largest_variance, threshold_value, image_width, image_height, radius=2):
+
+    count = (2*radius + 1)**2
+
+    rows = [0] * image_height
+    largest_deviation = math.sqrt(largest_variance / (count*count))
+    if largest_deviation == 0:
+        return BinaryMask(rows, image_width, image_height)
+    if radius == 2:
+        near_largest = largest_deviation * (1 - DEVIATION_TOLERANCE)
+        largest_deviation = max(windowDeviation(window_rows, j) for kept in candidates.values()
+                                for j, variance, window_rows in kept
+                                if math.sqrt(variance / (count*count)) >= near_largest)
+    multiplier = 255/largest_deviation
+    rounding_edge = math.ceil(threshold_value) - 0.5
+
+    for i, kept in candidates.items():
+        bits = 0
+        for j, variance, window_rows in kept:
+            stretched = math.sqrt(variance / (count*count)) * multiplier
+            if radius == 2 and abs(stretched - rounding_edge) <= 255 * DEVIATION_TOLERANCE:
+                stretched = windowDeviation(window_rows, j) * multiplier
+            if round(stretched) >= threshold_value:
+                bits = bits | (1 << j)
+        rows[i] = bits
+
+    return BinaryMask(rows, image_width, image_height)
+
+# Greyscale to black and white mask in two streaming passes over the rows, giving exactly what
+# scaleTo0And255AndQuantize, computeStandardDeviationImage, scaleTo0And255AndQuantize and computeThresholdGE give
+# one after the other, but without any of the four full size images in between.
+# grey_rows has to hold integer greyscale values and be iterable twice, e.g. a list of rows or GreyscaleRowsFromFile.
+# The first pass finds the greyscale range for the first stretch. The second one stretches each row through a lookup
+# table and works out the variances with varianceCandidates.
+# The second stretch needs the largest standard deviation, known only at the end. Its smallest is always the 0.0 of
+# the border, so a pixel is white when round(deviation * 255/largest) >= threshold_value; the largest can only grow,
+# so a pixel that fails with the largest so far fails in the end too. Only the others are kept, and checked once
+# the largest is known.
+def computeThresholdMaskFused(grey_rows, image_width, image_height, threshold_value=150, radius=2):
+
+    size = 2*radius + 1
+    empty_mask = BinaryMask([0] * image_height, image_width, image_height)
+
+    if image_width == 0 or image_height == 0:
+        return empty_mask
+    if threshold_value <= 0:
+        return BinaryMask([(1 << image_width) - 1] * image_height, image_width, image_height)
+    if image_width < size or image_height < size:
+        return empty_mask
+
+    grey_min = 256
+    grey_max = -1
+    for row in grey_rows:
+        grey_min = min(grey_min, min(row))
+        grey_max = max(grey_max, max(row))
+
+    stretch = stretchTable(grey_min, grey_max)
+    stretched_rows = ([stretch[value - grey_min] for value in row] for row in grey_rows)
+
+    largest_variance, candidates = varianceCandidates(stretched_rows, image_width, radius,
+                                                      thresholdKeepRatio(threshold_value))
+
+    return thresholdVarianceCandidates(candidates, largest_variance, threshold_value, image_width, image_height, radius)
+
+# Statistics of the connected components, one list per statistic with one entry per component (index = label-1),
+# rather than one dictionary per component:
+# label, area in pixels, bbox as min_x, min_y, max_x, max_y, centroid_x, centroid_y,
+# perimeter as the number of pixel edges between the component and the black pixels or the outside of the image,
+# fill_ratio as the share of the bbox that is white, and aspect as bbox width over height measured the way
+# FindPlateCoordsWithRatio does, from first to last column over first to last row (inf for a single row)
+class RegionTable:
+    COLUMNS = ("label", "area", "min_x", "min_y", "max_x", "max_y", "centroid_x", "centroid_y", "perimeter",
+               "fill_ratio", "aspect")
 
-    dictionary_values = {}
-    
-    for i in range(image_height):
-        for j in range(image_width):
-            
-            if pixel_array[i][j] != 0:
-                if pixel_array[i][j] in dictionary_values:
-                    dictionary_values[pixel_array[i][j]] = dictionary_values[pixel_array[i][j]] + 1
-                else:
-                    dictionary_values[pixel_array[i][j]] = 1
+    def __init__(self):
+        for name in self.COLUMNS:
+            setattr(self, name, [])
+
+    def __len__(self):
+        return len(self.label)
+
+    # starts the statistics of the next label with its first run
+    def addRegion(self, i, start, end):
+        self.label.append(len(self.label) + 1)
+        self.area.append(0)
+        self.min_x.append(start)
+        self.min_y.append(i)
+        self.max_x.append(end-1)
+        self.max_y.append(i)
+        # twice the sums of the x and y of all pixels until finish(), kept whole so the centroid is rounded once
+        self.centroid_x.append(0)
+        self.centroid_y.append(0)
+        self.perimeter.append(0)
+
+    # adds a run of pixels start to end-1 in row i, of which shared_edges have a white pixel of the row above on top
+    def addRun(self, index, i, start, end, shared_edges):
+        length = end - start
+        self.area[index] = self.area[index] + length
+        self.min_x[index] = min(self.min_x[index], start)
+        self.max_x[index] = max(self.max_x[index], end-1)
+        self.max_y[index] = i
+        self.centroid_x[index] = self.centroid_x[index] + (start+end-1)*length
+        self.centroid_y[index] = self.centroid_y[index] + 2*i*length
+        # each pixel has 4 edges, minus 2 for every pair of white pixels next to each other
+        self.perimeter[index] = self.perimeter[index] + 4*length - 2*(length-1) - 2*shared_edges
+
+    # adds component other_index of another table that is not finished yet, e.g. the part of the same component in
+    # the next band of the image, to component index; the perimeter still counts the edges between the two parts
+    def mergeRegion(self, index, other, other_index):
+        self.area[index] = self.area[index] + other.area[other_index]
+        self.min_x[index] = min(self.min_x[index], other.min_x[other_index])
+        self.min_y[index] = min(self.min_y[index], other.min_y[other_index])
+        self.max_x[index] = max(self.max_x[index], other.max_x[other_index])
+        self.max_y[index] = max(self.max_y[index], other.max_y[other_index])
+        self.centroid_x[index] = self.centroid_x[index] + other.centroid_x[other_index]
+        self.centroid_y[index] = self.centroid_y[index] + other.centroid_y[other_index]
+        self.perimeter[index] = self.perimeter[index] + other.perimeter[other_index]
+
+    # works out the columns that need the whole component
+    def finish(self):
+        for index in range(len(self.label)):
+            area = self.area[index]
+            width = self.max_x[index] - self.min_x[index]
+            height = self.max_y[index] - self.min_y[index]
+            self.centroid_x[index] = self.centroid_x[index] / (2*area)
+            self.centroid_y[index] = self.centroid_y[index] / (2*area)
+            self.fill_ratio.append(area / ((width+1) * (height+1)))
+            self.aspect.append(width / height if height else float("inf"))
+
+    # all the statistics of one component, as a dictionary
+    def region(self, index):
+        return {name: getattr(self, name)[index] for name in self.COLUMNS}
+
+    def columns(self):
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    # areas by label, like computeConnectedComponentLabeling gives them
+    def areaDictionary(self):
+        return dict(zip(self.label, self.area))
+
+# The regions of finished tables one after the other in a new table, labelled on from each other, each table's moved
+# right and down by its (columns, rows) in offsets
+def joinRegionTables(tables, offsets):
+
+    joined = RegionTable()
+    for table, (column_offset, row_offset) in zip(tables, offsets):
+        for index in range(len(table)):
+            joined.label.append(len(joined.label) + 1)
+            for name in ("area", "perimeter", "fill_ratio", "aspect"):
+                getattr(joined, name).append(getattr(table, name)[index])
+            for name in ("min_x", "max_x", "centroid_x"):
+                getattr(joined, name).append(getattr(table, name)[index] + column_offset)
+            for name in ("min_y", "max_y", "centroid_y"):
+                getattr(joined, name).append(getattr(table, name)[index] + row_offset)
+
+    return joined
+
+# Splits one row's bits into its runs of white pixels, as (start, end) column pairs with end one past the run.
+# A run starts at a set bit whose left neighbour is clear and ends at a set bit whose right neighbour is clear;
+# the lowest remaining start always pairs with the lowest remaining end
+def rowRuns(bits):
+
+    starts = bits & ~(bits << 1)
+    ends = bits & ~(bits >> 1)
+    runs = []
+    while starts:
+        start_bit = starts & -starts
+        end_bit = ends & -ends
+        runs.append((start_bit.bit_length()-1, end_bit.bit_length()))
+        starts = starts ^ start_bit
+        ends = ends ^ end_bit
+    return runs
+
+# Two-pass connected component labeling over the runs of white pixels in each row, given one int of bits per row.
+# First pass: every run gets a provisional label, and is merged with the runs it touches in the row above using
+# union-find with path halving; the smaller label always becomes the root, so a root is its component's first run.
+# Second pass: roots get indexes 0, 1, ... in the order the raster scan first meets them, and each run is added to
+# its component's statistics. Memory is a few entries per run, not per pixel.
+# connectivity 4 joins runs sharing a column, 8 also joins runs touching diagonally.
+# Gives the runs as (row, start, end, index) in raster order, and the RegionTable before finish(), so the tables of
+# bands of the image can still be added together; rows are numbered from first_row
+def labelRowRuns(rows, connectivity=4, first_row=0):
+
+    if connectivity not in (4, 8):
+        raise ValueError("connectivity must be 4 or 8, not {!r}".format(connectivity))
+    reach = 1 if connectivity == 8 else 0
+
+    run_rows = []
+    run_starts = []
+    run_ends = []
+    parent = []
+    # white pixels in a run directly below a white pixel of the run above, for the perimeter
+    shared_edges = []
+
+    def find(run):
+        while parent[run] != run:
+            parent[run] = parent[parent[run]]
+            run = parent[run]
+        return run
+
+    previous_runs = []
+    for i, bits in enumerate(rows, first_row):
+        current_runs = []
+        above = 0
+        for start, end in rowRuns(bits):
+            run = len(parent)
+            run_rows.append(i)
+            run_starts.append(start)
+            run_ends.append(end)
+            parent.append(run)
+            shared = 0
+
+            # skip runs above that end before this one can touch them, the next run here starts further right
+            while above < len(previous_runs) and run_ends[previous_runs[above]] + reach <= start:
+                above = above + 1
+            touching = above
+            while touching < len(previous_runs) and run_starts[previous_runs[touching]] < end + reach:
+                other = previous_runs[touching]
+                shared = shared + max(0, min(end, run_ends[other]) - max(start, run_starts[other]))
+                root = find(other)
+                own_root = find(run)
+                if root < own_root:
+                    parent[own_root] = root
+                elif own_root < root:
+                    parent[root] = own_root
+                touching = touching + 1
+            # the last run touched may reach past this one's end and touch the next run too
+            above = max(above, touching-1)
+
+            shared_edges.append(shared)
+            current_runs.append(run)
+        previous_runs = current_runs
+
+    runs = []
+    indexes = {}
+    regions = RegionTable()
+    for run in range(len(parent)):
+        root = find(run)
+        i = run_rows[run]
+        start = run_starts[run]
+        end = run_ends[run]
+
+        if root not in indexes:
+            indexes[root] = len(indexes)
+            regions.addRegion(i, start, end)
+        index = indexes[root]
+
+        runs.append((i, start, end, index))
+        regions.addRun(index, i, start, end, shared_edges[run])
+
+    return runs, regions
+
+# Labels the components of labelRowRuns 1, 2, ... into a label image, and finishes their statistics
+def labelRowBits(rows, image_width, image_height, connectivity=4):
+
+    runs, regions = labelRowRuns(rows, connectivity)
+
+    connected_array = createInitializedGreyscalePixelArray(image_width, image_height)
+    for i, start, end, index in runs:
+        connected_array[i][start:end] = [index+1] * (end-start)
+
+    regions.finish()
+
+    return connected_array, regions
+
+# Connected components of the non-zero pixels, labelled 1, 2, ... in raster order of each one's first pixel.
+# Gives the label image and a RegionTable of their statistics
+def computeConnectedComponentRegions(pixel_array, image_width, image_height, connectivity=4):
+
+    rows = BinaryMask.fromPixelArray(pixel_array, image_width, image_height).rows
+
+    return labelRowBits(rows, image_width, image_height, connectivity)
+
+# Labels the 4-connected components and counts the pixels in each, in a dictionary from label to area
+def computeConnectedComponentLabeling(pixel_array, image_width, image_height):
 
-    return pixel_array, dictionary_values
+    connected_array, regions = computeConnectedComponentRegions(pixel_array, image_width, image_height)
+
+    return connected_array, regions.areaDictionary()
+
+# bands of rows each worker gets at least in computeRegionsTiled, so one slow band does not hold the others up long,
+# and the most rows in a band, so a band's rows stay in the cache between stages
+TILES_PER_WORKER = 2
+TILE_BAND_ROWS = 128
+
+# Cuts rows 0 to image_height-1 into band_count bands of about the same height, as (start, end) with end one past
+def tileBands(image_height, band_count):
+
+    band_count = max(1, min(band_count, image_height))
+
+    return [(image_height*band // band_count, image_height*(band+1) // band_count) for band in range(band_count)]
+
+# greyscale range of one band, for the first stretch
+def tileGreyRange(grey_rows):
+
+    return min(min(row) for row in grey_rows), max(max(row) for row in grey_rows)
+
+# varianceCandidates of one band, its greyscale rows given with up to radius rows more on each side from first_row on
+def tileVarianceCandidates(grey_rows, first_row, grey_min, grey_max, image_width, radius, keep_ratio):
+
+    stretch = stretchTable(grey_min, grey_max)
+    stretched_rows = ([stretch[value - grey_min] for value in row] for row in grey_rows)
+
+    return varianceCandidates(stretched_rows, image_width, radius, keep_ratio, first_row)
+
+# closing of one band of mask rows, given with halo rows above and below that are cut off again afterwards
+def tileClosing(rows, above, below, image_width, radius, iterations):
+
+    closed = BinaryMask(rows, image_width, len(rows)).close(radius, iterations).rows
+
+    return closed[above:len(closed)-below]
+
+# Joins the labelRowRuns of the bands of the image into the label image and the finished RegionTable of the whole.
+# Components touching across a band border are joined with union-find over their (band, index), numbered in that
+# order, the smaller becoming the root. Both bands and indexes within a band go in raster order, so a root is still
+# the part holding its component's first run, and labels come out as labelRowBits gives them
+def mergeBandRegions(band_labels, bands, image_width, image_height, connectivity=4):
+
+    reach = 1 if connectivity == 8 else 0
+
+    offsets = []
+    total = 0
+    for runs, regions in band_labels:
+        offsets.append(total)
+        total = total + len(regions)
+    parent = list(range(total))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    # white pixels on either side of a border, which the parts' perimeters both count as outside edges
+    border_edges = []
+    for band in range(len(bands)-1):
+        border = bands[band][1]
+        upper = [(start, end, offsets[band] + index) for i, start, end, index in band_labels[band][0] if i == border-1]
+        lower = [(start, end, offsets[band+1] + index) for i, start, end, index in band_labels[band+1][0] if i == border]
+
+        # the same sweep as in labelRowRuns, over the last row of one band and the first of the next
+        above = 0
+        for start, end, node in lower:
+            while above < len(upper) and upper[above][1] + reach <= start:
+                above = above + 1
+            touching = above
+            while touching < len(upper) and upper[touching][0] < end + reach:
+                (other_start, other_end, other_node) = upper[touching]
+                border_edges.append((node, max(0, min(end, other_end) - max(start, other_start))))
+                root = find(other_node)
+                own_root = find(node)
+                if root < own_root:
+                    parent[own_root] = root
+                elif own_root < root:
+                    parent[root] = own_root
+                touching = touching + 1
+            above = max(above, touching-1)
+
+    connected_array = createInitializedGreyscalePixelArray(image_width, image_height)
+    indexes = {}
+    regions = RegionTable()
+    for band, (runs, band_regions) in enumerate(band_labels):
+        labels = []
+        for index in range(len(band_regions)):
+            root = find(offsets[band] + index)
+            if root not in indexes:
+                indexes[root] = len(indexes)
+                regions.addRegion(band_regions.min_y[index], band_regions.min_x[index], band_regions.max_x[index]+1)
+            regions.mergeRegion(indexes[root], band_regions, index)
+            labels.append(indexes[root] + 1)
+
+        for i, start, end, index in runs:
+            connected_array[i][start:end] = [labels[index]] * (end-start)
+
+    for node, shared in border_edges:
+        index = indexes[find(node)]
+        regions.perimeter[index] = regions.perimeter[index] - 2*shared
+
+    regions.finish()
+
+    return connected_array, regions
+
+# The stages main runs from the greyscale image to the connected components, computeThresholdMaskFused, the closing
+# and labelRegions, with the image cut into bands of rows that a pool of worker processes goes through side by side.
+# Gives exactly the label image and RegionTable of the stages run one after the other on the whole image.
+# grey_rows is a list of greyscale rows. workers=1, the default, runs the bands one by one in this process, and
+# None uses every core; how that scales has not been timed on a multicore machine yet, and the bands go to the
+# worker processes as pickled lists of rows, so it is only used when asked for. pool is a ProcessPoolExecutor of
+# that many workers to use instead of starting one, for callers that run this many times. band_count sets the
+# number of bands, by default TILES_PER_WORKER for each worker and at most TILE_BAND_ROWS rows in each. grey_range
+# is the (min, max) greyscale that the first stretch takes to 0 and 255, the image's own when None.
+# The steps needing the whole image are reduces over what the bands give back: the greyscale range for the first
+# stretch, the largest variance for the second stretch, and joining components touching across band borders.
+# Bands overlap by halo rows: radius for the standard deviation windows, and twice the closing's reach for the
+# closing, as the rows a dilation gets wrong at a cut edge spread that far again in the erosion
+def computeRegionsTiled(grey_rows, image_width, image_height, threshold_value=150, radius=2, closing_radius=1,
+                        closing_iterations=4, connectivity=4, workers=1, band_count=None, grey_range=None, pool=None):
+
+    size = 2*radius + 1
+    if image_width < size or image_height < size or threshold_value <= 0:
+        # nothing worth sharing out, the mask is all black or all white
+        mask = computeThresholdMaskFused(grey_rows, image_width, image_height, threshold_value, radius)
+        return mask.close(closing_radius, closing_iterations).labelRegions(connectivity)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if band_count is None:
+        band_count = max(workers*TILES_PER_WORKER, -(-image_height // TILE_BAND_ROWS))
+    bands = tileBands(image_height, band_count)
+    band_starts = [start for start, end in bands]
+
+    own_pool = concurrent.futures.ProcessPoolExecutor(workers) if pool is None and workers > 1 else None
+    with (own_pool or contextlib.nullcontext(pool)) as pool:
+        tile_map = pool.map if pool else map
+
+        if grey_range is None:
+            ranges = list(tile_map(tileGreyRange, [grey_rows[start:end] for start, end in bands]))
+            grey_min = min(low for low, high in ranges)
+            grey_max = max(high for low, high in ranges)
+        else:
+            (grey_min, grey_max) = grey_range
+
+        # each band's windows are centred on its own rows, and reach radius rows into the bands next to it
+        halo_bands = [(max(0, start-radius), min(image_height, end+radius)) for start, end in bands]
+        results = list(tile_map(tileVarianceCandidates, [grey_rows[start:end] for start, end in halo_bands],
+                                [start for start, end in halo_bands], itertools.repeat(grey_min),
+                                itertools.repeat(grey_max), itertools.repeat(image_width), itertools.repeat(radius),
+                                itertools.repeat(thresholdKeepRatio(threshold_value))))
+
+        # the largest of the bands' largest variances is the image's; each band kept its candidates against a
+        # smaller or equal largest, so none that could pass is missing
+        largest_variance = max(largest for largest, band_candidates in results)
+        candidates = {}
+        for largest, band_candidates in results:
+            candidates.update(band_candidates)
+        mask = thresholdVarianceCandidates(candidates, largest_variance, threshold_value, image_width, image_height,
+                                           radius)
+
+        halo = 2*closing_radius*closing_iterations
+        halo_bands = [(max(0, start-halo), min(image_height, end+halo)) for start, end in bands]
+        closed = tile_map(tileClosing, [mask.rows[start:end] for start, end in halo_bands],
+                          [start - halo_start for (start, end), (halo_start, halo_end) in zip(bands, halo_bands)],
+                          [halo_end - end for (start, end), (halo_start, halo_end) in zip(bands, halo_bands)],
+                          itertools.repeat(image_width), itertools.repeat(closing_radius),
+                          itertools.repeat(closing_iterations))
+        rows = [bits for band_rows in closed for bits in band_rows]
+
+        band_labels = list(tile_map(labelRowRuns, [rows[start:end] for start, end in bands],
+                                    itertools.repeat(connectivity), band_starts))
+
+    return mergeBandRegions(band_labels, bands, image_width, image_height, connectivity)
 
 def FindPlateCoords(pixel_array, key_value, image_width, image_height):
     left_x = 999999999
@@ -288,6 +953,221 @@ def FindPlateCoordsWithRatio(pixel_array, key_value, label_dictionary, image_wid
 
     return default_first_coords, default_last_coords
 
+# Indexes into region_table of the largest components, largest first (equal areas in label order), at most tries of them.
+# Heapifying is linear in the number of components and each pop is logarithmic, so nothing looks at the image again
+def rankPlateCandidates(region_table, tries=5):
+
+    heap = [(-area, label, index) for index, (label, area) in enumerate(zip(region_table.label, region_table.area))]
+    heapq.heapify(heap)
+
+    ranked = []
+    while heap and len(ranked) < tries:
+        ranked.append(heapq.heappop(heap)[2])
+    return ranked
+
+# Same choice as FindPlateCoordsWithRatio, from the statistics instead of the label image: the first of the tries
+# largest components whose aspect is between min_aspect and max_aspect, or the largest one if none is.
+# Each of criteria is called with a candidate's region dictionary and can turn it down by returning False,
+# e.g. lambda region: region["fill_ratio"] > 0.5
+def FindPlateCoordsFromRegions(region_table, tries=5, min_aspect=2.2, max_aspect=5.5, criteria=()):
+
+    ranked = rankPlateCandidates(region_table, tries)
+    if not ranked:
+        raise ValueError("no connected components to pick a license plate from")
+
+    chosen = ranked[0]
+    for index in ranked:
+        if min_aspect < region_table.aspect[index] < max_aspect and all(criterion(region_table.region(index)) for criterion in criteria):
+            chosen = index
+            break
+
+    return [region_table.min_x[chosen], region_table.max_y[chosen]], [region_table.max_x[chosen], region_table.min_y[chosen]]
+
+# Every component that could be a plate, for frames with more than one vehicle, from the same RegionTable.
+# A candidate needs an aspect between min_aspect and max_aspect, at least min_area pixels and at least
+# min_relative_area times the area of the largest component, at least min_fill_ratio of its bbox white,
+# and to pass each of criteria (called with its region dictionary).
+# Gives a list of region dictionaries, each with its "score", "first_coords" and "last_coords" added, highest score
+# first and at most max_plates of them; score is called with the region dictionary and defaults to the area.
+def FindPlateCandidates(region_table, min_aspect=2.2, max_aspect=5.5, min_area=0, min_relative_area=0.25,
+                        min_fill_ratio=0.1, max_plates=None, criteria=(), score=None):
+
+    if len(region_table) == 0:
+        return []
+    min_area = max(min_area, min_relative_area * max(region_table.area))
+
+    candidates = []
+    for index in range(len(region_table)):
+        if not min_aspect < region_table.aspect[index] < max_aspect:
+            continue
+        if region_table.area[index] < min_area or region_table.fill_ratio[index] < min_fill_ratio:
+            continue
+        region = region_table.region(index)
+        if not all(criterion(region) for criterion in criteria):
+            continue
+
+        region["score"] = score(region) if score else region["area"]
+        region["first_coords"] = [region["min_x"], region["max_y"]]
+        region["last_coords"] = [region["max_x"], region["min_y"]]
+        candidates.append(region)
+
+    if max_plates is None:
+        max_plates = len(candidates)
+
+    # equal scores keep label order
+    return heapq.nsmallest(max_plates, candidates, key=lambda region: (-region["score"], region["label"]))
+
+# Shrinks a greyscale image factor times in each direction, each pixel the rounded mean of a factor x factor block
+# (a smaller one at the right and bottom edges when the size does not divide)
+def downsampleGreyscale(pixel_array, image_width, image_height, factor):
+
+    small_array = []
+    for top in range(0, image_height, factor):
+        block_rows = pixel_array[top:top+factor]
+        column_sums = [sum(column) for column in zip(*block_rows)]
+        row = []
+        for left in range(0, image_width, factor):
+            block_sums = column_sums[left:left+factor]
+            row.append(round(sum(block_sums) / (len(block_rows) * len(block_sums))))
+        small_array.append(row)
+
+    return -(-image_width // factor), -(-image_height // factor), small_array
+
+# Joins (left, top, right, bottom) windows that overlap, right and bottom one past the end, into the window around
+# both until none overlap; gives them in raster order of their top left corners
+def mergeWindows(windows):
+
+    windows = list(windows)
+    merged = True
+    while merged:
+        merged = False
+        for first, second in itertools.combinations(range(len(windows)), 2):
+            (left, top, right, bottom) = windows[first]
+            (other_left, other_top, other_right, other_bottom) = windows[second]
+            if left < other_right and other_left < right and top < other_bottom and other_top < bottom:
+                windows[first] = (min(left, other_left), min(top, other_top), max(right, other_right),
+                                  max(bottom, other_bottom))
+                del windows[second]
+                merged = True
+                break
+
+    return sorted(windows, key=lambda window: (window[1], window[0]))
+
+# Grows the windows that cut off a component that matters, given regions, the RegionTable joined from them: the one
+# FindPlateCoordsFromRegions picks and the plate shaped ones FindPlateCandidates gives. A cut edge changes the
+# deviations and the closing up to halo pixels in, so a component whose bbox comes that close to a side of its
+# window that is not the frame's edge may go on past it; that side moves out by the component's width or height and
+# the halo again. Gives the windows merged, the same list when none had to grow
+def growWindows(windows, regions, halo, image_width, image_height, min_aspect=2.2, max_aspect=5.5):
+
+    ranked = rankPlateCandidates(regions)
+    chosen = [index for index in ranked if min_aspect < regions.aspect[index] < max_aspect][:1] or ranked[:1]
+    plates = FindPlateCandidates(regions, min_aspect, max_aspect)
+    indexes = sorted(set(chosen) | {plate["label"]-1 for plate in plates})
+
+    grown = []
+    for left, top, right, bottom in windows:
+        (new_left, new_top, new_right, new_bottom) = (left, top, right, bottom)
+        for index in indexes:
+            (min_x, min_y, max_x, max_y) = (regions.min_x[index], regions.min_y[index], regions.max_x[index],
+                                            regions.max_y[index])
+            if not (left <= min_x and max_x < right and top <= min_y and max_y < bottom):
+                continue
+            if left > 0 and min_x - left <= halo:
+                new_left = max(0, new_left - (max_x-min_x+1) - halo)
+            if top > 0 and min_y - top <= halo:
+                new_top = max(0, new_top - (max_y-min_y+1) - halo)
+            if right < image_width and right-1 - max_x <= halo:
+                new_right = min(image_width, new_right + (max_x-min_x+1) + halo)
+            if bottom < image_height and bottom-1 - max_y <= halo:
+                new_bottom = min(image_height, new_bottom + (max_y-min_y+1) + halo)
+        grown.append((new_left, new_top, new_right, new_bottom))
+
+    return mergeWindows(grown)
+
+# Coarse to fine detection for high resolution frames. The whole pipeline (computeRegionsTiled) first runs on the
+# frame shrunk factor times, with the standard deviation window and the closing shrunk to match, and its plate shaped
+# components (FindPlateCandidates, at most proposals of them, the largest component if none is) are taken as the
+# places a plate could be. Around each, grown by margin times its size on every side plus the rows and columns the
+# windows and the closing reach, the pipeline runs again at full resolution, and only there. Windows that cut off a
+# component that matters are grown around it and run again (growWindows) until none do, so the boxes come out whole.
+# The first stretch uses the greyscale range of the whole frame, which is one cheap pass; the second stretch uses the
+# largest deviation inside each window. With nothing found at the coarse scale, the window is the whole frame, which
+# gives exactly what computeRegionsTiled gives. With workers > 1 one pool of them serves the coarse pass and every
+# window. Gives the windows, and a RegionTable of the components found in them in the frame's coordinates, labelled
+# window by window
+def computeRegionsPyramid(grey_rows, image_width, image_height, threshold_value=150, radius=2, closing_radius=1,
+                          closing_iterations=4, connectivity=4, factor=4, margin=0.25, proposals=8, workers=1):
+
+    size = 2*radius + 1
+    whole_frame = [(0, 0, image_width, image_height)]
+    if image_width < size*factor or image_height < size*factor or threshold_value <= 0:
+        # too small to shrink, or the mask is all black or all white anyway
+        return whole_frame, computeRegionsTiled(grey_rows, image_width, image_height, threshold_value, radius,
+                                                closing_radius, closing_iterations, connectivity, workers)[1]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with (concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else contextlib.nullcontext()) as pool:
+        (small_width, small_height, small_array) = downsampleGreyscale(grey_rows, image_width, image_height, factor)
+        (coarse_array, coarse_regions) = computeRegionsTiled(small_array, small_width, small_height, threshold_value,
+                                                             max(1, round(radius / factor)), closing_radius,
+                                                             max(1, round(closing_iterations / factor)),
+                                                             connectivity, workers, pool=pool)
+
+        plates = FindPlateCandidates(coarse_regions, min_relative_area=0, max_plates=proposals)
+        indexes = [plate["label"]-1 for plate in plates] or rankPlateCandidates(coarse_regions, 1)
+
+        halo = radius + 2*closing_radius*closing_iterations
+        windows = []
+        for index in indexes:
+            left = coarse_regions.min_x[index] * factor
+            top = coarse_regions.min_y[index] * factor
+            right = min(image_width, (coarse_regions.max_x[index]+1) * factor)
+            bottom = min(image_height, (coarse_regions.max_y[index]+1) * factor)
+            reach_x = int(margin * (right-left)) + halo
+            reach_y = int(margin * (bottom-top)) + halo
+            windows.append((max(0, left-reach_x), max(0, top-reach_y), min(image_width, right+reach_x),
+                            min(image_height, bottom+reach_y)))
+        windows = mergeWindows(windows) or whole_frame
+
+        grey_range = (min(min(row) for row in grey_rows), max(max(row) for row in grey_rows))
+        # windows already run keep their tables while others grow
+        window_regions = {}
+        while True:
+            for left, top, right, bottom in windows:
+                if (left, top, right, bottom) not in window_regions:
+                    window_rows = [row[left:right] for row in grey_rows[top:bottom]]
+                    window_regions[left, top, right, bottom] = computeRegionsTiled(
+                        window_rows, right-left, bottom-top, threshold_value, radius, closing_radius,
+                        closing_iterations, connectivity, workers, grey_range=grey_range, pool=pool)[1]
+
+            regions = joinRegionTables([window_regions[window] for window in windows],
+                                       [(left, top) for left, top, right, bottom in windows])
+            grown = growWindows(windows, regions, halo, image_width, image_height)
+            if grown == windows:
+                return windows, regions
+            windows = grown
+
+# Pick the module that runs the detection stages: "python" is the functions above, the reference,
+# "numpy" is CS373NumpyBackend, which gives the same values over whole arrays.
+# With no name given, numpy is used if it can be imported.
+def selectBackend(backend_name=None):
+
+    if backend_name in (None, "numpy"):
+        try:
+            import CS373NumpyBackend
+            return CS373NumpyBackend
+        except ImportError:
+            if backend_name == "numpy":
+                raise
+
+    elif backend_name != "python":
+        raise ValueError("unknown backend {!r}, expected 'numpy' or 'python'".format(backend_name))
+
+    return sys.modules[__name__]
+
+
 # This is our code skeleton that performs the license plate detection.
 # Feel free to try it on your own images of cars, but keep in mind that with our algorithm developed in this lecture,
 # we won't detect arbitrary or difficult to detect license plates!
@@ -295,6 +1175,40 @@ def main():
 
     command_line_arguments = sys.argv[1:]
 
+    # --backend=numpy or --backend=python can go anywhere on the command line
+    backend_name = None
+    for argument in [argument for argument in command_line_arguments if argument.startswith("--backend=")]:
+        backend_name = argument[len("--backend="):]
+        command_line_arguments.remove(argument)
+
+    stages = selectBackend(backend_name)
+
+    # --radius=N sets the window of the standard deviation to (2N+1) x (2N+1), the default 2 being 5x5
+    # higher resolution cameras need a bigger window to see the plate's lettering as one textured area
+    stddev_radius = 2
+    for argument in [argument for argument in command_line_arguments if argument.startswith("--radius=")]:
+        stddev_radius = int(argument[len("--radius="):])
+        command_line_arguments.remove(argument)
+
+    # --workers=N runs the bands of the image on N cores, --workers=0 on all of them; by default in this process only
+    workers = 1
+    for argument in [argument for argument in command_line_arguments if argument.startswith("--workers=")]:
+        workers = int(argument[len("--workers="):]) or None
+        command_line_arguments.remove(argument)
+
+    # --pyramid=F finds where plates could be on the frame shrunk F times (4 or 8), and only looks there at full
+    # resolution; --pyramid-margin=M grows those places by M times their size on every side
+    pyramid_factor = None
+    pyramid_margin = 0.25
+    for argument in [argument for argument in command_line_arguments if argument.startswith("--pyramid")]:
+        if argument.startswith("--pyramid="):
+            pyramid_factor = int(argument[len("--pyramid="):])
+        elif argument.startswith("--pyramid-margin="):
+            pyramid_margin = float(argument[len("--pyramid-margin="):])
+        else:
+            continue
+        command_line_arguments.remove(argument)
+
     SHOW_DEBUG_FIGURES = True
 
     # this is the default input image filename
@@ -314,58 +1228,62 @@ def main():
         output_filename = Path(command_line_arguments[1])
 
 
-    # we read in the png file, and receive three pixel arrays for red, green and blue components, respectively
-    # each pixel array contains 8 bit integer values between 0 and 255 encoding the color values
-    (image_width, image_height, px_array_r, px_array_g, px_array_b) = readRGBImageToSeparatePixelArrays(input_filename)
+    if SHOW_DEBUG_FIGURES:
+        # setup the plots for intermediate results in a figure
+        fig1, axs1 = pyplot.subplots(2, 2)
+        final_axes = axs1[1, 1]
+    else:
+        # Nothing is shown, only the final image is saved, so only its plot is made, where it sits in the 2x2 figure
+        fig1 = pyplot.figure()
+        final_axes = fig1.add_subplot(2, 2, 4)
 
-    # setup the plots for intermediate results in a figure
-    fig1, axs1 = pyplot.subplots(2, 2)
-    axs1[0, 0].set_title('Input red channel of image')
-    axs1[0, 0].imshow(px_array_r, cmap='gray')
-    axs1[0, 1].set_title('Input green channel of image')
-    axs1[0, 1].imshow(px_array_g, cmap='gray')
-    axs1[1, 0].set_title('Input blue channel of image')
-    axs1[1, 0].imshow(px_array_b, cmap='gray')
+    if SHOW_DEBUG_FIGURES:
+        # we read in the png file, and receive three pixel arrays for red, green and blue components, respectively
+        # each pixel array contains 8 bit integer values between 0 and 255 encoding the color values
+        (image_width, image_height, px_array_r, px_array_g, px_array_b) = stages.readRGBImageToSeparatePixelArrays(input_filename)
+
+        axs1[0, 0].set_title('Input red channel of image')
+        axs1[0, 0].imshow(px_array_r, cmap='gray')
+        axs1[0, 1].set_title('Input green channel of image')
+        axs1[0, 1].imshow(px_array_g, cmap='gray')
+        axs1[1, 0].set_title('Input blue channel of image')
+        axs1[1, 0].imshow(px_array_b, cmap='gray')
+
+        # Removing RGB for greyscale
+        px_array_greyscale = stages.computeRGBToGreyscale(px_array_r, px_array_g, px_array_b, image_width, image_height)
+    else:
+        # Nobody sees the colour channels when running from the command line, so decode straight to greyscale
+        (image_width, image_height, px_array_greyscale) = stages.readGreyscaleImageToPixelArray(input_filename)
 
 
     # STUDENT IMPLEMENTATION here
 
     # All methods/functions I am using are up above the main function. Thank you!
 
-    # Removing RGB for greyscale
-    px_array = computeRGBToGreyscale(px_array_r, px_array_g, px_array_b, image_width, image_height)
-
-    # Scaling to take up full 8 bit scale
-    px_array = scaleTo0And255AndQuantize(px_array, image_width, image_height)
-
-    # Taking standard deviation in a 5x5 range around each pixel (shows more clearly where groupings are, like a license plate)
-    px_array = computeStandardDeviationImage5x5(px_array, image_width, image_height)
-
-    # Scaling to take up full 8 bit scale
-    px_array = scaleTo0And255AndQuantize(px_array, image_width, image_height)
-
-    # Making light pixels white and dark pixels black
-    px_array = computeThresholdGE(px_array, 150, image_width, image_height)
-
-    # Connecting places that are heavy in white/black
-    for i in range(4):
-        px_array = computeDilation8Nbh3x3FlatSE(px_array, image_width, image_height)
-
-    # Eroding weaker odd-out colors
-    for i in range(4):
-        px_array = computeErosion8Nbh3x3FlatSE(px_array, image_width, image_height)
-        
-    # Finding the largest connected image part, most likely the license plate
-    connected_array, label_dictionary = computeConnectedComponentLabeling(px_array, image_width, image_height)
-
-    # Taking the label of the license plate connected pixels
-    number_plate_label = max(label_dictionary, key=label_dictionary.get)
+    # Scaling to take up full 8 bit scale, taking standard deviation in a 5x5 range around each pixel (shows more
+    # clearly where groupings are, like a license plate), scaling that to the full 8 bit scale again, and making
+    # light pixels white and dark pixels black, packed into bits for the black and white stages.
+    # Connecting places that are heavy in white/black, then eroding weaker odd-out colors
+    # the same as 4 dilations and then 4 erosions with a 3x3 square, done as one 9x9 dilation and one 9x9 erosion.
+    # Finding the connected image parts, the largest most likely the license plate.
+    # All done on bands of the image side by side, giving the same as computeThresholdMaskFused, mask.close(1, 4)
+    # and mask.labelRegions() on the whole image
+    if pyramid_factor is None:
+        connected_array, regions = stages.computeRegionsTiled(px_array_greyscale, image_width, image_height, 150,
+                                                              stddev_radius, 1, 4, workers=workers)
+    else:
+        # The same, only inside windows around what the shrunk frame shows
+        windows, regions = stages.computeRegionsPyramid(px_array_greyscale, image_width, image_height, 150,
+                                                        stddev_radius, 1, 4, factor=pyramid_factor,
+                                                        margin=pyramid_margin, workers=workers)
 
-    # Finding the corner co-ordinates of the license plate
-    #first_coords, last_coords = FindPlateCoords(connected_array, number_plate_label, image_width, image_height)
+    # If ratio is off, try the next largest of the top 5 until one is acceptable, otherwise take the largest
+    # (the same choice FindPlateCoordsWithRatio makes, without scanning the labels again)
+    first_coords, last_coords = stages.FindPlateCoordsFromRegions(regions)
 
-    # If ratio is off, loop top 5 until acceptable ratio, otherwise license plate was not able to be found
-    first_coords, last_coords = FindPlateCoordsWithRatio(connected_array, number_plate_label, label_dictionary, image_width, image_height)
+    # Other vehicles' plates in the same frame, from the same labeling
+    other_plates = [plate for plate in stages.FindPlateCandidates(regions)
+                    if [plate["first_coords"], plate["last_coords"]] != [first_coords, last_coords]]
 
     # Outlining the co-ordinates where the license plate is
     bbox_min_x = first_coords[0]
@@ -374,12 +1292,15 @@ def main():
     bbox_max_y = last_coords[1]
 
     # Putting image back to greyscale for the user to see
-    px_array = computeRGBToGreyscale(px_array_r, px_array_g, px_array_b, image_width, image_height)
+    px_array = px_array_greyscale
 
     # EXTENSION METHODS CALLED HERE ================================================
     
     # Saving a smaller image of just number plate
     #CS373Extension.SaveLicensePlateImage(px_array, bbox_min_x, bbox_min_y, bbox_max_x, bbox_max_y)
+
+    # Or, without keeping the frame in memory, decoding only the plate from the file
+    #CS373Extension.SaveLicensePlateImageFromFile(input_filename, bbox_min_x, bbox_min_y, bbox_max_x, bbox_max_y)
     
     # Reducing images file size
     #CS373Extension.CompressImage()
@@ -390,16 +1311,21 @@ def main():
     # EXTENSION METHODS STOP HERE ==================================================
 
     # Draw a bounding box as a rectangle into the input image
-    axs1[1, 1].set_title('Final image of detection')
-    axs1[1, 1].imshow(px_array, cmap='gray')
+    final_axes.set_title('Final image of detection')
+    final_axes.imshow(px_array, cmap='gray')
     rect = Rectangle((bbox_min_x, bbox_min_y), bbox_max_x - bbox_min_x, bbox_max_y - bbox_min_y, linewidth=1,
                      edgecolor='g', facecolor='none')
-    axs1[1, 1].add_patch(rect)
+    final_axes.add_patch(rect)
+    for plate in other_plates:
+        (plate_min_x, plate_min_y), (plate_max_x, plate_max_y) = plate["first_coords"], plate["last_coords"]
+        rect = Rectangle((plate_min_x, plate_min_y), plate_max_x - plate_min_x, plate_max_y - plate_min_y, linewidth=1,
+                         edgecolor='g', facecolor='none')
+        final_axes.add_patch(rect)
 
 
 
     # write the output image into output_filename, using the matplotlib savefig method
-    extent = axs1[1, 1].get_window_extent().transformed(fig1.dpi_scale_trans.inverted())
+    extent = final_axes.get_window_extent().transformed(fig1.dpi_scale_trans.inverted())
     pyplot.savefig(output_filename, bbox_inches=extent, dpi=600)
 
     if SHOW_DEBUG_FIGURES:
@@ -0,0 +1,1007 @@
+import concurrent.futures
+import contextlib
+import itertools
+import math
+import os
+
+import numpy as np
+
+# import our basic, light-weight png reader library
+import imageIO.png
+
+# NUMPY BACKEND FOR THE LICENSE PLATE DETECTION
+# Every stage has the same name and arguments as in CS373LicensePlateDetection.py, and gives the same values,
+# but works on whole numpy arrays at once instead of looping over lists of lists pixel by pixel.
+# The pure python functions stay the reference, runparity.py checks the two against each other.
+
+# this function reads an RGB color png file and returns width, height, as well as pixel arrays for r,g,b
+# the pixel arrays are views into the one decoded buffer
+def readRGBImageToSeparatePixelArrays(input_filename):
+
+    image_reader = imageIO.png.Reader(filename=input_filename)
+    (image_width, image_height, rgb_pixels, rgb_image_info) = image_reader.read_ndarray()
+
+    print("read image width={}, height={}".format(image_width, image_height))
+
+    (pixel_array_r, pixel_array_g, pixel_array_b) = imageIO.png.split_planes(rgb_pixels)[:3]
+
+    return (image_width, image_height, pixel_array_r, pixel_array_g, pixel_array_b)
+
+
+# this function reads a png file straight to greyscale and returns width, height, as well as a single pixel array
+def readGreyscaleImageToPixelArray(input_filename):
+
+    image_reader = imageIO.png.Reader(filename=input_filename)
+    (image_width, image_height, grey_image_rows, grey_image_info) = image_reader.asGrey8(weights=(0.299, 0.587, 0.114), exact=True)
+
+    print("read image width={}, height={}".format(image_width, image_height))
+
+    pixel_array = np.frombuffer(b"".join(grey_image_rows), dtype=np.uint8).reshape(image_height, image_width)
+
+    return (image_width, image_height, pixel_array)
+
+
+# the greyscale rows of a png file as arrays, decoded again on every pass
+class GreyscaleRowsFromFile:
+    def __init__(self, input_filename):
+        self.input_filename = input_filename
+        (self.image_width, self.image_height) = imageIO.png.probe(input_filename)[:2]
+
+    def __iter__(self):
+        image_reader = imageIO.png.Reader(filename=self.input_filename)
+        (image_width, image_height, grey_image_rows, grey_image_info) = image_reader.asGrey8(weights=(0.299, 0.587, 0.114), exact=True)
+        for row in grey_image_rows:
+            yield np.frombuffer(row, dtype=np.uint8)
+
+
+# a useful shortcut method to create an array representation for an image, initialized with a value
+def createInitializedGreyscalePixelArray(image_width, image_height, initValue = 0):
+
+    return np.full((image_height, image_width), initValue)
+
+
+# same sum in the same order as the reference, so the floats round the same way
+def computeRGBToGreyscale(pixel_array_r, pixel_array_g, pixel_array_b, image_width, image_height):
+
+    r = np.asarray(pixel_array_r, dtype=np.float64)
+    g = np.asarray(pixel_array_g, dtype=np.float64)
+    b = np.asarray(pixel_array_b, dtype=np.float64)
+
+    # rint rounds halves to even, like python's round
+    return np.rint(0.299*r + 0.587*g + 0.114*b).astype(np.int64)
+
+
+def scaleTo0And255AndQuantize(pixel_array, image_width, image_height):
+
+    pixel_array = np.asarray(pixel_array)
+    if pixel_array.dtype.kind in "ub":
+        pixel_array = pixel_array.astype(np.int64)
+
+    min = pixel_array.min()
+    max = pixel_array.max()
+
+    range_vals = max-min
+    if range_vals == 0:
+        multiplier = 0
+    else:
+        multiplier = 255/range_vals
+
+    array_greyscale = np.rint((pixel_array-min)*multiplier).astype(np.int64)
+    array_greyscale[array_greyscale == -1] = 0
+
+    return array_greyscale
+
+
+# the mean and the squared differences are added up in the reference's order, offset by offset,
+# so every pixel gets exactly the same float as the nested loops give it
+def computeStandardDeviationImage5x5(pixel_array, image_width, image_height):
+
+    pixel_array = np.asarray(pixel_array, dtype=np.int64)
+    end_result = np.zeros((image_height, image_width))
+
+    if image_height < 5 or image_width < 5:
+        return end_result
+
+    inner_height = image_height-4
+    inner_width = image_width-4
+
+    def window(x, y):
+        return pixel_array[2+x:2+x+inner_height, 2+y:2+y+inner_width]
+
+    pixel_sum = np.zeros((inner_height, inner_width), dtype=np.int64)
+    for x in range(-2, 3):
+        for y in range(-2, 3):
+            pixel_sum = pixel_sum + window(x, y)
+
+    # python's ** is libm's pow, which is not always the same bit as numpy's x*x or sqrt, so the squares and
+    # roots are worked out in python; the image only holds a few different values and window sums, so a table
+    # of (v - mean)**2 for each pair of them is much smaller than the image
+    sums, sum_index = np.unique(pixel_sum, return_inverse=True)
+    values, value_index = np.unique(pixel_array, return_inverse=True)
+    value_index = value_index.reshape(image_height, image_width)
+    squares = np.array([[(value - (1/25) * total)**2 for value in values.tolist()] for total in sums.tolist()])
+    sum_index = sum_index.reshape(inner_height, inner_width)
+
+    variance_sum = np.zeros((inner_height, inner_width))
+    for x in range(-2, 3):
+        for y in range(-2, 3):
+            variance_sum = variance_sum + squares[sum_index, value_index[2+x:2+x+inner_height, 2+y:2+y+inner_width]]
+
+    # numpy's **0.5 is a sqrt, which can be one bit off python's pow, so the root is taken in python,
+    # once for each different variance
+    variance, where = np.unique(variance_sum/25, return_inverse=True)
+    deviation = np.array([value**0.5 for value in variance.tolist()])
+    end_result[2:-2, 2:-2] = deviation[where].reshape(inner_height, inner_width)
+
+    return end_result
+
+
+# the deviations of windows the way computeStandardDeviationImage5x5 works them out, given one row of pixels per
+# window in the reference's order; the squares and roots are taken in python like there, once for each different
+# (sum, pixel) pair and each different variance
+def windowDeviations(windows):
+
+    count = windows.shape[1]
+    sums, sum_index = np.unique(windows.sum(axis=1), return_inverse=True)
+    values, value_index = np.unique(windows, return_inverse=True)
+    pairs, pair_index = np.unique(sum_index.reshape(-1, 1)*len(values) + value_index.reshape(windows.shape),
+                                  return_inverse=True)
+    pair_index = pair_index.reshape(windows.shape)
+
+    sums = sums.tolist()
+    values = values.tolist()
+    squares = np.array([(values[pair % len(values)] - (1/count) * sums[pair // len(values)])**2
+                        for pair in pairs.tolist()])
+
+    variance_sum = np.zeros(len(windows))
+    for k in range(count):
+        variance_sum = variance_sum + squares[pair_index[:, k]]
+
+    variance, where = np.unique(variance_sum/count, return_inverse=True)
+    deviation = np.array([value**0.5 for value in variance.tolist()])
+
+    return deviation[where.reshape(-1)]
+
+
+# same summed-area tables as the python version, built with cumsum; the integer sums and the one division
+# give the same floats, and numpy's sqrt rounds like math.sqrt. Radius 2 is computeStandardDeviationImage5x5,
+# like there
+def computeStandardDeviationImage(pixel_array, image_width, image_height, radius=2):
+
+    if radius == 2:
+        return computeStandardDeviationImage5x5(pixel_array, image_width, image_height)
+
+    pixel_array = np.asarray(pixel_array)
+    if pixel_array.dtype.kind in "ub":
+        pixel_array = pixel_array.astype(np.int64)
+    end_result = np.zeros((image_height, image_width))
+
+    size = 2*radius + 1
+    count = size*size
+
+    if image_height < size or image_width < size:
+        return end_result
+
+    sums = np.zeros((image_height+1, image_width+1), dtype=pixel_array.dtype)
+    sums[1:, 1:] = pixel_array.cumsum(axis=0).cumsum(axis=1)
+    squares = np.zeros((image_height+1, image_width+1), dtype=pixel_array.dtype)
+    squares[1:, 1:] = (pixel_array*pixel_array).cumsum(axis=0).cumsum(axis=1)
+
+    def window(table):
+        return table[size:, size:] - table[size:, :-size] - table[:-size, size:] + table[:-size, :-size]
+
+    pixel_sum = window(sums)
+    square_sum = window(squares)
+
+    end_result[radius:image_height-radius, radius:image_width-radius] = np.sqrt((count*square_sum - pixel_sum*pixel_sum) / (count*count))
+
+    return end_result
+
+
+def computeThresholdGE(pixel_array, threshold_value, image_width, image_height):
+
+    return np.where(np.asarray(pixel_array) >= threshold_value, 255, 0)
+
+
+# any pixel in the 3x3 neighbourhood (outside the image counts as 0) makes a 1
+def computeDilation8Nbh3x3FlatSE(pixel_array, image_width, image_height):
+
+    new_array = np.zeros((image_height+2, image_width+2), dtype=bool)
+    new_array[1:-1, 1:-1] = np.asarray(pixel_array) > 0
+
+    end_array = np.zeros((image_height, image_width), dtype=bool)
+    for x in range(3):
+        for y in range(3):
+            end_array |= new_array[x:x+image_height, y:y+image_width]
+
+    return end_array.astype(np.int64)
+
+
+# all 9 pixels of the 3x3 neighbourhood make a 1, the 1 pixel boundary stays 0
+def computeErosion8Nbh3x3FlatSE(pixel_array, image_width, image_height):
+
+    pixel_array = np.asarray(pixel_array) > 0
+    end_array = np.zeros((image_height, image_width), dtype=np.int64)
+
+    if image_height < 3 or image_width < 3:
+        return end_array
+
+    inner = np.ones((image_height-2, image_width-2), dtype=bool)
+    for x in range(3):
+        for y in range(3):
+            inner &= pixel_array[x:x+image_height-2, y:y+image_width-2]
+
+    end_array[1:-1, 1:-1] = inner
+
+    return end_array
+
+
+# van Herk/Gil-Werman running max (or min) along one axis, for every line at once: the zero padded lines are
+# cut into blocks as long as the window, and each window is the extreme of one block's suffix and the next one's prefix.
+# The prefixes and suffixes are built one block position at a time, each step covering the whole image
+def slidingWindowExtreme(pixel_array, radius, extreme, axis):
+
+    size = 2*radius + 1
+    length = pixel_array.shape[axis]
+    blocks = -(-(length + 2*radius) // size)
+
+    block_shape = list(pixel_array.shape)
+    block_shape[axis:axis+1] = [blocks, size]
+    line_shape = list(pixel_array.shape)
+    line_shape[axis] = blocks*size
+
+    prefix = np.zeros(block_shape, dtype=pixel_array.dtype)
+    np.moveaxis(prefix.reshape(line_shape), axis, 0)[radius:radius+length] = np.moveaxis(pixel_array, axis, 0)
+    suffix = prefix.copy()
+
+    prefix_steps = np.moveaxis(prefix, axis+1, 0)
+    for j in range(1, size):
+        extreme(prefix_steps[j-1], prefix_steps[j], out=prefix_steps[j])
+    suffix_steps = np.moveaxis(suffix, axis+1, 0)
+    for j in range(size-2, -1, -1):
+        extreme(suffix_steps[j+1], suffix_steps[j], out=suffix_steps[j])
+
+    prefix = np.moveaxis(prefix.reshape(line_shape), axis, 0)
+    suffix = np.moveaxis(suffix.reshape(line_shape), axis, 0)
+
+    return np.moveaxis(extreme(suffix[:length], prefix[size-1:size-1+length]), 0, axis)
+
+
+# the same two passes as the python version, over boolean images
+def computeDilationSquare(pixel_array, image_width, image_height, radius=1):
+
+    px_array = np.asarray(pixel_array) > 0
+    px_array = slidingWindowExtreme(px_array, radius, np.logical_or, 1)
+
+    return slidingWindowExtreme(px_array, radius, np.logical_or, 0).astype(np.int64)
+
+
+def computeErosionSquare(pixel_array, image_width, image_height, radius=1):
+
+    px_array = np.asarray(pixel_array) > 0
+    px_array = slidingWindowExtreme(px_array, radius, np.logical_and, 1)
+
+    return slidingWindowExtreme(px_array, radius, np.logical_and, 0).astype(np.int64)
+
+
+def computeClosing(pixel_array, image_width, image_height, radius=1, iterations=4):
+
+    px_array = computeDilationSquare(pixel_array, image_width, image_height, radius*iterations)
+
+    return computeErosionSquare(px_array, image_width, image_height, radius*iterations)
+
+
+# moves the pixels of every row of 64 bit words by shift columns, to the right for a positive shift,
+# carrying bits between neighbouring words and filling with 0
+def shiftWords(words, shift):
+
+    word_shift, bit_shift = divmod(abs(shift), 64)
+    shifted = np.zeros_like(words)
+    if word_shift >= words.shape[1]:
+        return shifted
+
+    if shift > 0:
+        shifted[:, word_shift:] = words[:, :words.shape[1]-word_shift]
+        if bit_shift:
+            carry = np.zeros_like(words)
+            carry[:, 1:] = shifted[:, :-1] >> np.uint64(64-bit_shift)
+            shifted = (shifted << np.uint64(bit_shift)) | carry
+    else:
+        shifted[:, :words.shape[1]-word_shift] = words[:, word_shift:]
+        if bit_shift:
+            carry = np.zeros_like(words)
+            carry[:, :-1] = shifted[:, 1:] << np.uint64(64-bit_shift)
+            shifted = (shifted >> np.uint64(bit_shift)) | carry
+
+    return shifted
+
+
+# the same black and white image type as in CS373LicensePlateDetection.py, with each row packed into
+# 64 bit words, pixel j being bit j % 64 of word j // 64
+class BinaryMask:
+    def __init__(self, words, image_width, image_height):
+        self.words = words
+        self.image_width = image_width
+        self.image_height = image_height
+
+        # bits past the last pixel in the last word of a row stay 0
+        self.last_word = np.uint64((1 << (image_width % 64 or 64)) - 1)
+
+    @classmethod
+    def fromBits(cls, bits, image_width, image_height):
+        word_count = -(-image_width // 64)
+        padded = np.zeros((image_height, word_count*64), dtype=bool)
+        padded[:, :image_width] = bits
+        words = np.packbits(padded, axis=1, bitorder="little").view("<u8")
+        return cls(np.ascontiguousarray(words, dtype=np.uint64), image_width, image_height)
+
+    @classmethod
+    def fromThreshold(cls, pixel_array, threshold_value, image_width, image_height):
+        return cls.fromBits(np.asarray(pixel_array) >= threshold_value, image_width, image_height)
+
+    @classmethod
+    def fromPixelArray(cls, pixel_array, image_width, image_height):
+        return cls.fromBits(np.asarray(pixel_array) > 0, image_width, image_height)
+
+    def toPixelArray(self, white_value=1):
+        bits = np.unpackbits(self.words.view(np.uint8), axis=1, bitorder="little")[:, :self.image_width]
+        return bits.astype(np.int64) * white_value
+
+    # np.bitwise_count is new in NumPy 2.0, older versions count the unpacked bits instead
+    def area(self):
+        if hasattr(np, "bitwise_count"):
+            return int(np.bitwise_count(self.words).sum())
+        return int(np.count_nonzero(np.unpackbits(self.words.view(np.uint8))))
+
+    def spread(self, radius, combine):
+        words = self.words
+        reach = 0
+        while reach < radius:
+            step = min(reach+1, radius-reach)
+            words = combine(combine(words, shiftWords(words, step)), shiftWords(words, -step))
+            if words.shape[1]:
+                words[:, -1] &= self.last_word
+            reach = reach + step
+
+        reach = 0
+        while reach < radius:
+            step = min(reach+1, radius-reach)
+            above = np.zeros_like(words)
+            below = np.zeros_like(words)
+            if step < self.image_height:
+                above[step:] = words[:self.image_height-step]
+                below[:self.image_height-step] = words[step:]
+            words = combine(combine(words, above), below)
+            reach = reach + step
+
+        return BinaryMask(words, self.image_width, self.image_height)
+
+    def dilate(self, radius=1):
+        return self.spread(radius, np.bitwise_or)
+
+    def erode(self, radius=1):
+        return self.spread(radius, np.bitwise_and)
+
+    def close(self, radius=1, iterations=4):
+        return self.dilate(radius*iterations).erode(radius*iterations)
+
+    def labelRegions(self, connectivity=4):
+        return computeConnectedComponentRegions(self.toPixelArray(), self.image_width, self.image_height, connectivity)
+
+
+# rows at a time that the fused mask works on
+FUSED_BAND_ROWS = 64
+
+
+def stretchTable(grey_min, grey_max):
+
+    range_vals = grey_max - grey_min
+    if range_vals == 0:
+        multiplier = 0
+    else:
+        multiplier = 255/range_vals
+
+    return np.rint(np.arange(range_vals+1) * multiplier).astype(np.int64)
+
+
+DEVIATION_TOLERANCE = 1e-9
+
+
+def thresholdKeepRatio(threshold_value):
+
+    return (math.ceil(threshold_value) - 1)**2 / (255*255) * 0.999
+
+
+# the windows of a stack of stretched rows, the first being row first_row of the image, from cumulative sums of the
+# stack; gives the largest variance, counting largest_variance from before, and the row, column, variance and, for
+# radius 2, window pixels (one row of 25 each, none otherwise) of each candidate
+def varianceCandidates(stretched, radius, keep_ratio, first_row=0, largest_variance=0):
+
+    size = 2*radius + 1
+    count = size*size
+    nothing = np.zeros(0, dtype=np.int64)
+
+    if len(stretched) < size:
+        return largest_variance, nothing, nothing, nothing, np.zeros((0, count if radius == 2 else 0), dtype=np.int64)
+
+    image_width = stretched.shape[1]
+    sums = np.zeros((len(stretched)+1, image_width+1), dtype=np.int64)
+    sums[1:, 1:] = stretched.cumsum(axis=0).cumsum(axis=1)
+    squares = np.zeros((len(stretched)+1, image_width+1), dtype=np.int64)
+    squares[1:, 1:] = (stretched*stretched).cumsum(axis=0).cumsum(axis=1)
+
+    def window(table):
+        return table[size:, size:] - table[size:, :-size] - table[:-size, size:] + table[:-size, :-size]
+
+    pixel_sum = window(sums)
+    variances = count*window(squares) - pixel_sum*pixel_sum
+
+    largest_variance = max(largest_variance, int(variances.max()))
+    kept = (variances >= keep_ratio * largest_variance) & (variances > 0)
+    (rows, columns) = np.nonzero(kept)
+    if radius == 2:
+        windows = np.stack([stretched[rows+x, columns+y] for x in range(size) for y in range(size)], axis=1)
+    else:
+        windows = np.zeros((len(rows), 0), dtype=np.int64)
+
+    return largest_variance, rows + first_row + radius, columns + radius, variances[kept], windows
+
+
+# the deviations are the square roots of the exact variances, and for radius 2 windowDeviations works out the 5x5
+# ones where they could change anything, like in the python version
+def thresholdVarianceCandidates(candidate_rows, candidate_columns, candidate_variances, candidate_windows,
+                                largest_variance, threshold_value, image_width, image_height, radius=2):
+
+    count = (2*radius + 1)**2
+
+    bits = np.zeros((image_height, image_width), dtype=bool)
+    largest_deviation = math.sqrt(largest_variance / (count*count))
+    if largest_deviation == 0:
+        return BinaryMask.fromBits(bits, image_width, image_height)
+
+    deviations = np.sqrt(candidate_variances / (count*count))
+    if radius == 2:
+        near_largest = deviations >= largest_deviation * (1 - DEVIATION_TOLERANCE)
+        largest_deviation = windowDeviations(candidate_windows[near_largest]).max()
+    multiplier = 255/largest_deviation
+
+    stretched = deviations * multiplier
+    if radius == 2:
+        tipping = np.abs(stretched - (math.ceil(threshold_value) - 0.5)) <= 255 * DEVIATION_TOLERANCE
+        stretched[tipping] = windowDeviations(candidate_windows[tipping]) * multiplier
+    white = np.rint(stretched) >= threshold_value
+    bits[candidate_rows[white], candidate_columns[white]] = True
+
+    return BinaryMask.fromBits(bits, image_width, image_height)
+
+
+# the same two passes as the python version, a band of rows at a time: each band is stacked under the last
+# 2*radius stretched rows of the one before, and its windows' sums come from cumulative sums of that stack
+def computeThresholdMaskFused(grey_rows, image_width, image_height, threshold_value=150, radius=2):
+
+    size = 2*radius + 1
+    empty_mask = BinaryMask.fromBits(np.zeros((image_height, image_width), dtype=bool), image_width, image_height)
+
+    if image_width == 0 or image_height == 0:
+        return empty_mask
+    if threshold_value <= 0:
+        return BinaryMask.fromBits(np.ones((image_height, image_width), dtype=bool), image_width, image_height)
+    if image_width < size or image_height < size:
+        return empty_mask
+
+    grey_min = 256
+    grey_max = -1
+    for row in grey_rows:
+        row = np.asarray(row)
+        grey_min = min(grey_min, int(row.min()))
+        grey_max = max(grey_max, int(row.max()))
+
+    stretch = stretchTable(grey_min, grey_max)
+    keep_ratio = thresholdKeepRatio(threshold_value)
+
+    halo = np.zeros((0, image_width), dtype=np.int64)
+    largest_variance = 0
+    kept_rows = []
+    kept_columns = []
+    kept_variances = []
+    kept_windows = []
+
+    rows = iter(grey_rows)
+    band_start = 0
+    while True:
+        band = list(itertools.islice(rows, FUSED_BAND_ROWS))
+        if not band:
+            break
+        stretched = np.vstack([halo, stretch[np.asarray(band, dtype=np.int64) - grey_min]])
+        # the first row of the stack is this row of the image
+        stack_start = band_start - len(halo)
+        band_start = band_start + len(band)
+        halo = stretched[-(size-1):] if size > 1 else stretched[:0]
+
+        (largest_variance, band_rows, band_columns, band_variances, band_windows) = varianceCandidates(
+            stretched, radius, keep_ratio, stack_start, largest_variance)
+        kept_rows.append(band_rows)
+        kept_columns.append(band_columns)
+        kept_variances.append(band_variances)
+        kept_windows.append(band_windows)
+
+    return thresholdVarianceCandidates(np.concatenate(kept_rows), np.concatenate(kept_columns),
+                                       np.concatenate(kept_variances), np.concatenate(kept_windows),
+                                       largest_variance, threshold_value, image_width, image_height, radius)
+
+
+# the same statistics table as in CS373LicensePlateDetection.py, with one array per statistic
+class RegionTable:
+    COLUMNS = ("label", "area", "min_x", "min_y", "max_x", "max_y", "centroid_x", "centroid_y", "perimeter",
+               "fill_ratio", "aspect")
+
+    def __init__(self, **columns):
+        for name in self.COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.label)
+
+    def region(self, index):
+        return {name: getattr(self, name)[index].item() for name in self.COLUMNS}
+
+    def columns(self):
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    def areaDictionary(self):
+        return dict(zip(self.label.tolist(), self.area.tolist()))
+
+
+def joinRegionTables(tables, offsets):
+
+    columns = {}
+    for name in RegionTable.COLUMNS:
+        moved = []
+        for table, (column_offset, row_offset) in zip(tables, offsets):
+            column = getattr(table, name)
+            if name in ("min_x", "max_x", "centroid_x"):
+                column = column + column_offset
+            elif name in ("min_y", "max_y", "centroid_y"):
+                column = column + row_offset
+            moved.append(column)
+        columns[name] = np.concatenate(moved)
+    columns["label"] = np.arange(1, len(columns["area"])+1)
+
+    return RegionTable(**columns)
+
+
+# the runs of white pixels of each row, in raster order: their rows, first columns and columns just past their ends
+def rowRuns(across):
+
+    (image_height, image_width) = across.shape
+    padded = np.zeros((image_height, image_width+2), dtype=np.int8)
+    padded[:, 1:-1] = across
+    steps = np.diff(padded, axis=1).ravel()
+    (rows, starts) = np.divmod(np.flatnonzero(steps == 1), image_width+1)
+    ends = np.flatnonzero(steps == -1) % (image_width+1)
+
+    return rows, starts, ends
+
+
+# the runs labelling of the python version's labelRowRuns, on whole arrays: every pair of runs in neighbouring rows
+# that touch (share a column, or a corner for connectivity 8) is found at once with searchsorted, and joinPairs
+# does the union-find over the runs, so the nodes are runs rather than pixels. The root of a component is its first
+# run in raster order, so ranking the roots gives the labels.
+# Gives the label image, and the statistics of each label that the bands of an image can add together: area, bbox,
+# sums of the x and y of the pixels, and perimeter, with rows numbered from first_row
+def labelRowRuns(across, connectivity=4, first_row=0):
+
+    if connectivity not in (4, 8):
+        raise ValueError("connectivity must be 4 or 8, not {!r}".format(connectivity))
+    reach = 1 if connectivity == 8 else 0
+
+    (image_height, image_width) = across.shape
+    (rows, starts, ends) = rowRuns(across)
+    lengths = ends - starts
+
+    # for each run, the runs of the row above from the first ending after it starts (less reach) to the last
+    # starting before it ends (plus reach); row*stride + column keeps the runs of different rows apart
+    stride = image_width + 2
+    above_row = (rows - 1) * stride
+    first_above = np.searchsorted(rows*stride + ends, above_row + starts - reach, side="right")
+    past_above = np.searchsorted(rows*stride + starts, above_row + ends + reach, side="left")
+    touching = np.maximum(past_above - first_above, 0)
+    below = np.repeat(np.arange(len(rows)), touching)
+    above = np.arange(len(below)) - np.repeat(np.cumsum(touching) - touching - first_above, touching)
+
+    parent = joinPairs(np.arange(len(rows)), above, below)
+    roots, labels = np.unique(parent, return_inverse=True)
+    count = len(roots)
+
+    connected_array = np.zeros(image_width * image_height, dtype=np.int64)
+    connected_array[np.flatnonzero(across)] = np.repeat(labels + 1, lengths)
+
+    # white pixels in a run directly below a white pixel of the run above, and side by side within a run, are the
+    # edges the perimeter does not count
+    shared = np.maximum(np.minimum(ends[below], ends[above]) - np.maximum(starts[below], starts[above]), 0)
+    neighbours = np.bincount(labels[below], weights=shared, minlength=count) + \
+        np.bincount(labels, weights=lengths-1, minlength=count)
+
+    rows = rows + first_row
+    areas = np.bincount(labels, weights=lengths, minlength=count).astype(np.int64)
+    min_x = np.full(count, image_width, dtype=np.int64)
+    np.minimum.at(min_x, labels, starts)
+    max_x = np.zeros(count, dtype=np.int64)
+    np.maximum.at(max_x, labels, ends-1)
+    max_y = np.zeros(count, dtype=np.int64)
+    np.maximum.at(max_y, labels, rows)
+
+    totals = {"area": areas, "min_x": min_x, "min_y": rows[roots], "max_x": max_x, "max_y": max_y,
+              "x_total": np.bincount(labels, weights=(starts+ends-1)*lengths/2, minlength=count),
+              "y_total": np.bincount(labels, weights=rows*lengths, minlength=count),
+              "perimeter": 4*areas - 2*neighbours.astype(np.int64)}
+
+    return connected_array.reshape(image_height, image_width), totals
+
+
+# union-find over the pairs of nodes, the smaller root always winning; gives every node's root
+def joinPairs(parent, first, second):
+
+    while True:
+        root_first = parent[first]
+        root_second = parent[second]
+        differ = root_first != root_second
+        if not differ.any():
+            break
+        low = np.minimum(root_first[differ], root_second[differ])
+        high = np.maximum(root_first[differ], root_second[differ])
+        np.minimum.at(parent, high, low)
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+    return parent
+
+
+def regionTableFromTotals(totals):
+
+    areas = totals["area"]
+    widths = totals["max_x"] - totals["min_x"]
+    heights = totals["max_y"] - totals["min_y"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        aspects = np.where(heights > 0, widths / heights, np.inf)
+
+    return RegionTable(label=np.arange(1, len(areas)+1), area=areas, min_x=totals["min_x"], min_y=totals["min_y"],
+                       max_x=totals["max_x"], max_y=totals["max_y"], centroid_x=totals["x_total"] / areas,
+                       centroid_y=totals["y_total"] / areas, perimeter=totals["perimeter"],
+                       fill_ratio=areas / ((widths+1) * (heights+1)), aspect=aspects)
+
+
+def computeConnectedComponentRegions(pixel_array, image_width, image_height, connectivity=4):
+
+    across = np.asarray(pixel_array).reshape(image_height, image_width) != 0
+    connected_array, totals = labelRowRuns(across, connectivity)
+
+    return connected_array, regionTableFromTotals(totals)
+
+
+def computeConnectedComponentLabeling(pixel_array, image_width, image_height):
+
+    connected_array, regions = computeConnectedComponentRegions(pixel_array, image_width, image_height)
+
+    return connected_array, regions.areaDictionary()
+
+
+TILES_PER_WORKER = 2
+TILE_BAND_ROWS = 128
+
+
+def tileBands(image_height, band_count):
+
+    band_count = max(1, min(band_count, image_height))
+
+    return [(image_height*band // band_count, image_height*(band+1) // band_count) for band in range(band_count)]
+
+
+# the same bands, halos and reduces as the python version, in a pool of threads rather than processes: numpy lets
+# go of the interpreter lock in its loops, and the bands are slices of the one image instead of copies sent around
+def computeRegionsTiled(grey_rows, image_width, image_height, threshold_value=150, radius=2, closing_radius=1,
+                        closing_iterations=4, connectivity=4, workers=1, band_count=None, grey_range=None, pool=None):
+
+    size = 2*radius + 1
+    if image_width < size or image_height < size or threshold_value <= 0:
+        mask = computeThresholdMaskFused(grey_rows, image_width, image_height, threshold_value, radius)
+        return mask.close(closing_radius, closing_iterations).labelRegions(connectivity)
+
+    if connectivity not in (4, 8):
+        raise ValueError("connectivity must be 4 or 8, not {!r}".format(connectivity))
+
+    grey = np.asarray(grey_rows, dtype=np.int64)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if band_count is None:
+        band_count = max(workers*TILES_PER_WORKER, -(-image_height // TILE_BAND_ROWS))
+    bands = tileBands(image_height, band_count)
+
+    def greyRange(band):
+        (start, end) = band
+        return int(grey[start:end].min()), int(grey[start:end].max())
+
+    def bandVariances(band):
+        (start, end) = (max(0, band[0]-radius), min(image_height, band[1]+radius))
+        return varianceCandidates(stretch[grey[start:end] - grey_min], radius, keep_ratio, start)
+
+    def bandClosing(band):
+        (start, end) = (max(0, band[0]-halo), min(image_height, band[1]+halo))
+        closed = BinaryMask(mask.words[start:end], image_width, end-start).close(closing_radius, closing_iterations)
+        return closed.words[band[0]-start:band[1]-start]
+
+    def bandLabels(band):
+        (start, end) = band
+        across = BinaryMask(words[start:end], image_width, end-start).toPixelArray() != 0
+        return labelRowRuns(across, connectivity, start)
+
+    def bandRelabel(band_number):
+        (start, end) = bands[band_number]
+        lookup = np.concatenate(([0], final[offsets[band_number]:offsets[band_number+1]] + 1))
+        connected_array[start:end] = lookup[band_labels[band_number][0]]
+
+    own_pool = concurrent.futures.ThreadPoolExecutor(workers) if pool is None and workers > 1 else None
+    with (own_pool or contextlib.nullcontext(pool)) as pool:
+        tile_map = pool.map if pool else map
+
+        if grey_range is None:
+            ranges = list(tile_map(greyRange, bands))
+            grey_min = min(low for low, high in ranges)
+            grey_max = max(high for low, high in ranges)
+        else:
+            (grey_min, grey_max) = grey_range
+        stretch = stretchTable(grey_min, grey_max)
+        keep_ratio = thresholdKeepRatio(threshold_value)
+
+        results = list(tile_map(bandVariances, bands))
+        mask = thresholdVarianceCandidates(np.concatenate([result[1] for result in results]),
+                                           np.concatenate([result[2] for result in results]),
+                                           np.concatenate([result[3] for result in results]),
+                                           np.concatenate([result[4] for result in results]),
+                                           max(result[0] for result in results), threshold_value,
+                                           image_width, image_height, radius)
+
+        halo = 2*closing_radius*closing_iterations
+        words = np.vstack(list(tile_map(bandClosing, bands)))
+
+        band_labels = list(tile_map(bandLabels, bands))
+
+        # components touching across a border, as pairs of (band offset + label - 1)
+        offsets = np.cumsum([0] + [len(totals["area"]) for labels, totals in band_labels])
+        first = []
+        second = []
+        border_pairs = []
+        for band in range(len(bands)-1):
+            upper = band_labels[band][0][-1]
+            lower = band_labels[band+1][0][0]
+            pairs = [(upper, lower)]
+            if connectivity == 8:
+                pairs.append((upper[:-1], lower[1:]))
+                pairs.append((upper[1:], lower[:-1]))
+            for pair_number, (upper_labels, lower_labels) in enumerate(pairs):
+                both = (upper_labels > 0) & (lower_labels > 0)
+                first.append(upper_labels[both] - 1 + offsets[band])
+                second.append(lower_labels[both] - 1 + offsets[band+1])
+                if pair_number == 0:
+                    border_pairs.append(second[-1])
+        nothing = np.zeros(0, dtype=np.int64)
+        parent = joinPairs(np.arange(offsets[-1]), np.concatenate(first or [nothing]),
+                           np.concatenate(second or [nothing]))
+        # the roots keep the order of the bands and of the labels in them, which is raster order
+        roots, final = np.unique(parent, return_inverse=True)
+        count = len(roots)
+
+        totals = {}
+        for name, combine in [("area", np.add), ("min_x", np.minimum), ("min_y", np.minimum), ("max_x", np.maximum),
+                              ("max_y", np.maximum), ("x_total", np.add), ("y_total", np.add), ("perimeter", np.add)]:
+            parts = np.concatenate([band_totals[name] for labels, band_totals in band_labels])
+            # sums start from 0, bboxes from the root's own part
+            column = np.zeros(count, dtype=parts.dtype) if combine is np.add else parts[roots]
+            combine.at(column, final, parts)
+            totals[name] = column
+        # pixels on either side of a border, counted as outside edges by both parts
+        np.subtract.at(totals["perimeter"], final[np.concatenate(border_pairs or [nothing])], 2)
+
+        connected_array = np.zeros((image_height, image_width), dtype=np.int64)
+        list(tile_map(bandRelabel, range(len(bands))))
+
+    return connected_array, regionTableFromTotals(totals)
+
+
+# largest first, equal areas in label order, like the heap in the python version
+def rankPlateCandidates(region_table, tries=5):
+
+    return np.lexsort((region_table.label, -region_table.area))[:tries].tolist()
+
+
+def FindPlateCoordsFromRegions(region_table, tries=5, min_aspect=2.2, max_aspect=5.5, criteria=()):
+
+    ranked = rankPlateCandidates(region_table, tries)
+    if not ranked:
+        raise ValueError("no connected components to pick a license plate from")
+
+    chosen = ranked[0]
+    for index in ranked:
+        if min_aspect < region_table.aspect[index] < max_aspect and all(criterion(region_table.region(index)) for criterion in criteria):
+            chosen = index
+            break
+
+    region = region_table.region(chosen)
+    return [region["min_x"], region["max_y"]], [region["max_x"], region["min_y"]]
+
+
+# the size and shape rules are checked on whole columns, only the candidates left become dictionaries
+def FindPlateCandidates(region_table, min_aspect=2.2, max_aspect=5.5, min_area=0, min_relative_area=0.25,
+                        min_fill_ratio=0.1, max_plates=None, criteria=(), score=None):
+
+    if len(region_table) == 0:
+        return []
+    min_area = max(min_area, min_relative_area * region_table.area.max())
+
+    plausible = ((region_table.aspect > min_aspect) & (region_table.aspect < max_aspect)
+                 & (region_table.area >= min_area) & (region_table.fill_ratio >= min_fill_ratio))
+
+    candidates = []
+    for index in np.flatnonzero(plausible).tolist():
+        region = region_table.region(index)
+        if not all(criterion(region) for criterion in criteria):
+            continue
+
+        region["score"] = score(region) if score else region["area"]
+        region["first_coords"] = [region["min_x"], region["max_y"]]
+        region["last_coords"] = [region["max_x"], region["min_y"]]
+        candidates.append(region)
+
+    candidates.sort(key=lambda region: (-region["score"], region["label"]))
+
+    return candidates[:max_plates]
+
+
+# block means as the python version: sums of the blocks over counts of their pixels, rounded half to even
+def downsampleGreyscale(pixel_array, image_width, image_height, factor):
+
+    pixel_array = np.asarray(pixel_array, dtype=np.int64).reshape(image_height, image_width)
+    small_width = -(-image_width // factor)
+    small_height = -(-image_height // factor)
+
+    padded = np.zeros((small_height*factor, small_width*factor), dtype=np.int64)
+    padded[:image_height, :image_width] = pixel_array
+    block_sums = padded.reshape(small_height, factor, small_width, factor).sum(axis=(1, 3))
+    row_counts = np.minimum(factor, image_height - np.arange(small_height)*factor)
+    column_counts = np.minimum(factor, image_width - np.arange(small_width)*factor)
+
+    return small_width, small_height, np.rint(block_sums / np.outer(row_counts, column_counts)).astype(np.int64)
+
+
+def mergeWindows(windows):
+
+    windows = list(windows)
+    merged = True
+    while merged:
+        merged = False
+        for first, second in itertools.combinations(range(len(windows)), 2):
+            (left, top, right, bottom) = windows[first]
+            (other_left, other_top, other_right, other_bottom) = windows[second]
+            if left < other_right and other_left < right and top < other_bottom and other_top < bottom:
+                windows[first] = (min(left, other_left), min(top, other_top), max(right, other_right),
+                                  max(bottom, other_bottom))
+                del windows[second]
+                merged = True
+                break
+
+    return sorted(windows, key=lambda window: (window[1], window[0]))
+
+
+def growWindows(windows, regions, halo, image_width, image_height, min_aspect=2.2, max_aspect=5.5):
+
+    ranked = rankPlateCandidates(regions)
+    chosen = [index for index in ranked if min_aspect < regions.aspect[index] < max_aspect][:1] or ranked[:1]
+    plates = FindPlateCandidates(regions, min_aspect, max_aspect)
+    indexes = sorted(set(chosen) | {plate["label"]-1 for plate in plates})
+
+    grown = []
+    for left, top, right, bottom in windows:
+        (new_left, new_top, new_right, new_bottom) = (left, top, right, bottom)
+        for index in indexes:
+            (min_x, min_y, max_x, max_y) = (int(regions.min_x[index]), int(regions.min_y[index]),
+                                            int(regions.max_x[index]), int(regions.max_y[index]))
+            if not (left <= min_x and max_x < right and top <= min_y and max_y < bottom):
+                continue
+            if left > 0 and min_x - left <= halo:
+                new_left = max(0, new_left - (max_x-min_x+1) - halo)
+            if top > 0 and min_y - top <= halo:
+                new_top = max(0, new_top - (max_y-min_y+1) - halo)
+            if right < image_width and right-1 - max_x <= halo:
+                new_right = min(image_width, new_right + (max_x-min_x+1) + halo)
+            if bottom < image_height and bottom-1 - max_y <= halo:
+                new_bottom = min(image_height, new_bottom + (max_y-min_y+1) + halo)
+        grown.append((new_left, new_top, new_right, new_bottom))
+
+    return mergeWindows(grown)
+
+
+# one pool of threads for the coarse pass and every window, as in the python version
+def computeRegionsPyramid(grey_rows, image_width, image_height, threshold_value=150, radius=2, closing_radius=1,
+                          closing_iterations=4, connectivity=4, factor=4, margin=0.25, proposals=8, workers=1):
+
+    size = 2*radius + 1
+    whole_frame = [(0, 0, image_width, image_height)]
+    if image_width < size*factor or image_height < size*factor or threshold_value <= 0:
+        return whole_frame, computeRegionsTiled(grey_rows, image_width, image_height, threshold_value, radius,
+                                                closing_radius, closing_iterations, connectivity, workers)[1]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    grey = np.asarray(grey_rows, dtype=np.int64)
+    with (concurrent.futures.ThreadPoolExecutor(workers) if workers > 1 else contextlib.nullcontext()) as pool:
+        (small_width, small_height, small_array) = downsampleGreyscale(grey, image_width, image_height, factor)
+        (coarse_array, coarse_regions) = computeRegionsTiled(small_array, small_width, small_height, threshold_value,
+                                                             max(1, round(radius / factor)), closing_radius,
+                                                             max(1, round(closing_iterations / factor)),
+                                                             connectivity, workers, pool=pool)
+
+        plates = FindPlateCandidates(coarse_regions, min_relative_area=0, max_plates=proposals)
+        indexes = [plate["label"]-1 for plate in plates] or rankPlateCandidates(coarse_regions, 1)
+
+        halo = radius + 2*closing_radius*closing_iterations
+        windows = []
+        for index in indexes:
+            left = int(coarse_regions.min_x[index]) * factor
+            top = int(coarse_regions.min_y[index]) * factor
+            right = min(image_width, (int(coarse_regions.max_x[index])+1) * factor)
+            bottom = min(image_height, (int(coarse_regions.max_y[index])+1) * factor)
+            reach_x = int(margin * (right-left)) + halo
+            reach_y = int(margin * (bottom-top)) + halo
+            windows.append((max(0, left-reach_x), max(0, top-reach_y), min(image_width, right+reach_x),
+                            min(image_height, bottom+reach_y)))
+        windows = mergeWindows(windows) or whole_frame
+
+        grey_range = (int(grey.min()), int(grey.max()))
+        window_regions = {}
+        while True:
+            for left, top, right, bottom in windows:
+                if (left, top, right, bottom) not in window_regions:
+                    window_regions[left, top, right, bottom] = computeRegionsTiled(
+                        grey[top:bottom, left:right], right-left, bottom-top, threshold_value, radius, closing_radius,
+                        closing_iterations, connectivity, workers, grey_range=grey_range, pool=pool)[1]
+
+            regions = joinRegionTables([window_regions[window] for window in windows],
+                                       [(left, top) for left, top, right, bottom in windows])
+            grown = growWindows(windows, regions, halo, image_width, image_height)
+            if grown == windows:
+                return windows, regions
+            windows = grown
+
+
+def FindPlateCoords(pixel_array, key_value, image_width, image_height):
+
+    rows, columns = np.nonzero(np.asarray(pixel_array) == key_value)
+
+    if len(rows) == 0:
+        return [999999999, -999999999], [-999999999, 999999999]
+
+    return [int(columns.min()), int(rows.max())], [int(columns.max()), int(rows.min())]
+
+
+def FindPlateCoordsWithRatio(pixel_array, key_value, label_dictionary, image_width, image_height):
+
+    default_first_coords, default_last_coords = FindPlateCoords(pixel_array, key_value, image_width, image_height)
+
+    for i in range(5):
+        first_coords, last_coords = FindPlateCoords(pixel_array, key_value, image_width, image_height)
+
+        x_distance = last_coords[0] - first_coords[0]
+        y_distance = first_coords[1] - last_coords[1]
+
+        if (x_distance/y_distance < 5.5 and x_distance/y_distance > 2.2):
+            return first_coords, last_coords
+
+        else:
+            label_dictionary[key_value] = 0
+            key_value = max(label_dictionary, key=label_dictionary.get)
+
+    return default_first_coords, default_last_coords
@@ -174,22 +174,35 @@ from __future__ import print_function
 __version__ = "0.0.20"
 
 import collections
+import concurrent.futures
+import fnmatch
 import io   # For io.BytesIO
 import itertools
 import math
+import mmap
 # http://www.python.org/doc/2.4.4/lib/module-operator.html
 import operator
+import os
+import queue
 import re
 import struct
 import sys
+import threading
 # http://www.python.org/doc/2.4.4/lib/module-warnings.html
 import warnings
 import zlib
 
 from array import array
 
+# NumPy is optional; it only provides faster kernels, never behaviour.
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-__all__ = ['Image', 'Reader', 'Writer', 'write_chunks', 'from_array']
+
+__all__ = ['Image', 'Reader', 'Writer', 'write_chunks', 'from_array',
+           'from_ndarray', 'probe', 'probe_directory']
 
 
 # The PNG signature.
@@ -227,6 +240,15 @@ def adam7_generate(width, height):
 # Models the 'pHYs' chunk (used by the Reader)
 Resolution = collections.namedtuple('_Resolution', 'x y unit_is_meter')
 
+# The result of :func:`probe`.
+Probe = collections.namedtuple(
+    '_Probe', 'width height bitdepth color_type interlace idat_bytes')
+
+# Buffer size used by :func:`probe` when it opens a file.
+# Enough for the signature, IHDR, a full PLTE and a few small chunks,
+# so that usually a single read reaches the first IDAT chunk.
+PROBE_BUFFER_SIZE = 4096
+
 
 def group(s, n):
     return list(zip(* [iter(s)] * n))
@@ -373,7 +395,9 @@ class Writer:
                  chunk_limit=2**20,
                  x_pixels_per_unit=None,
                  y_pixels_per_unit=None,
-                 unit_is_meter=False):
+                 unit_is_meter=False,
+                 workers=1,
+                 filter_type=0):
         """
         Create a PNG encoder object.
 
@@ -414,6 +438,12 @@ class Writer:
         unit_is_meter
           `True` to indicate that the unit (for the `pHYs`
           chunk) is metre.
+        workers
+          Number of threads compressing the image data;
+          0 means one for each CPU.
+        filter_type
+          PNG filter type for each scanline:
+          0 (None) to 4 (Paeth), or ``'adaptive'``.
 
         The image size (in pixels) can be specified either by using the
         `width` and `height` arguments, or with the single `size`
@@ -522,6 +552,23 @@ class Writer:
         compressing the image.
         In order to avoid using large amounts of memory,
         multiple ``IDAT`` chunks may be created.
+
+        When `workers` is more than 1,
+        the image data is split into blocks of about
+        :data:`DEFLATE_BLOCK_SIZE` bytes, which are compressed
+        concurrently by that many threads (see :func:`parallel_deflate`),
+        and each block is written as an ``IDAT`` chunk.
+        The result is a single ordinary zlib stream,
+        and usually only very slightly larger.
+
+        The `filter_type` argument selects the PNG filter
+        applied to each scanline before compression;
+        ``'adaptive'`` picks, for each scanline, the filter whose output
+        has the minimum sum of absolute differences (the values read as
+        signed bytes), the heuristic recommended by the PNG specification.
+        Filtering usually makes photographic images a lot smaller.
+        It only applies to straightlaced images;
+        interlaced images always use filter type 0 (None).
         """
 
         # At the moment the `planes` argument is ignored;
@@ -535,6 +582,14 @@ class Writer:
 
         if not is_natural(width) or not is_natural(height):
             raise ProtocolError("width and height must be integers")
+        if filter_type not in (0, 1, 2, 3, 4, 'adaptive'):
+            raise ProtocolError(
+                "filter_type must be 0 to 4 or 'adaptive', not %r"
+                % (filter_type,))
+        if not is_natural(workers) or workers < 0:
+            raise ProtocolError("workers must be a non-negative integer")
+        if workers == 0:
+            workers = os.cpu_count() or 1
         if width <= 0 or height <= 0:
             raise ProtocolError("width and height must be greater than zero")
         # http://www.w3.org/TR/PNG/#7Integers-and-byte-order
@@ -605,6 +660,8 @@ class Writer:
         self.bitdepth = int(bitdepth)
         self.compression = compression
         self.chunk_limit = chunk_limit
+        self.workers = workers
+        self.filter_type = filter_type
         self.interlace = bool(interlace)
         self.palette = palette
         self.x_pixels_per_unit = x_pixels_per_unit
@@ -637,8 +694,13 @@ class Writer:
         .. note ::
 
           Interlacing requires the entire image to be in working memory.
+
+        A NumPy array is written with :meth:`write_ndarray`.
         """
 
+        if numpy is not None and isinstance(rows, numpy.ndarray):
+            return self.write_ndarray(outfile, rows)
+
         # Values per row
         vpr = self.width * self.planes
 
@@ -721,6 +783,9 @@ class Writer:
         presented in the order that they appear in the file.
         """
 
+        if self.workers > 1:
+            return self.write_packed_parallel(outfile, rows)
+
         self.write_preamble(outfile)
 
         # http://www.w3.org/TR/PNG/#11IDAT
@@ -733,16 +798,8 @@ class Writer:
         # it's compressed when sufficiently large.
         data = bytearray()
 
-        for i, row in enumerate(rows):
-            # Add "None" filter type.
-            # Currently, it's essential that this filter type be used
-            # for every scanline as
-            # we do not mark the first row of a reduced pass image;
-            # that means we could accidentally compute
-            # the wrong filtered scanline if we used
-            # "up", "average", or "paeth" on such a line.
-            data.append(0)
-            data.extend(row)
+        for i, line in enumerate(self.filter_rows(rows)):
+            data.extend(line)
             if len(data) > self.chunk_limit:
                 compressed = compressor.compress(data)
                 if len(compressed):
@@ -757,6 +814,116 @@ class Writer:
         write_chunk(outfile, b'IEND')
         return i + 1
 
+    def filter_rows(self, rows):
+        """
+        Yield each packed row in `rows` as a filtered scanline:
+        a filter type byte followed by the filtered bytes,
+        according to `filter_type`.
+        `rows` may be a 2-dimensional NumPy ``uint8`` array of packed rows.
+        """
+
+        if self.interlace or self.filter_type == 0:
+            # Add "None" filter type.
+            # Currently, it's essential that this filter type be used
+            # for every scanline of an interlaced image, as
+            # we do not mark the first row of a reduced pass image;
+            # that means we could accidentally compute
+            # the wrong filtered scanline if we used
+            # "up", "average", or "paeth" on such a line.
+            for row in rows:
+                line = bytearray(1)
+                line.extend(row)
+                yield line
+            return
+
+        # http://www.w3.org/TR/PNG/#9Filter-types
+        # The filter unit, the number of bytes in a complete pixel
+        # (1 for bit depths less than 8).
+        filter_unit = max(1, self.bitdepth * self.planes // 8)
+        row_bytes = int(math.ceil(self.width * self.bitdepth *
+                                  self.planes / 8.0))
+        if numpy is None:
+            previous = bytearray(row_bytes)
+            for row in rows:
+                row = bytearray(row)
+                yield filter_scanline(
+                    self.filter_type, row, previous, filter_unit)
+                previous = row
+            return
+
+        if isinstance(rows, numpy.ndarray):
+            blocks = (rows[i: i + FILTER_BLOCK_ROWS]
+                      for i in range(0, len(rows), FILTER_BLOCK_ROWS))
+        else:
+            def blocks():
+                for block in group_rows(rows, FILTER_BLOCK_ROWS):
+                    yield numpy.frombuffer(block, numpy.uint8).reshape(
+                        -1, row_bytes)
+            blocks = blocks()
+        previous = numpy.zeros(row_bytes, numpy.uint8)
+        for block in blocks:
+            for line in filter_block(
+                    self.filter_type, block, previous, filter_unit):
+                yield line
+            previous = block[-1]
+
+    def write_ndarray(self, outfile, a):
+        """
+        Write a NumPy array `a` as a PNG image to `outfile`.
+        `a` has shape (`height`, `width`, `planes`) or
+        (`height`, `width` * `planes`),
+        and its values are filtered and compressed straight from
+        the array, without converting each row to a Python sequence.
+        That needs ``uint8`` values and a bit depth of 8,
+        or ``uint16`` values and a bit depth of 16
+        (and no interlacing or rescaling);
+        other arrays are written row by row with :meth:`write`.
+        """
+
+        vpr = self.width * self.planes
+        if a.size != self.height * vpr:
+            raise ProtocolError(
+                "array of shape %s does not match size %dx%d (%d planes)"
+                % (a.shape, self.width, self.height, self.planes))
+        a = a.reshape(self.height, vpr)
+        if (self.interlace or self.rescale or a.dtype.kind != 'u' or
+                a.dtype.itemsize * 8 != self.bitdepth):
+            return self.write(outfile, iter(a))
+        # PNG samples are big-endian.
+        a = numpy.ascontiguousarray(a, a.dtype.newbyteorder('>'))
+        return self.write_packed(outfile, a.view(numpy.uint8))
+
+    def write_packed_parallel(self, outfile, rows):
+        """
+        Write PNG file to `outfile`, as :meth:`write_packed` does,
+        but compressing blocks of rows in `workers` threads.
+        """
+
+        self.write_preamble(outfile)
+
+        count = [0]
+
+        def blocks():
+            data = bytearray()
+            for line in self.filter_rows(rows):
+                count[0] += 1
+                data.extend(line)
+                if len(data) >= DEFLATE_BLOCK_SIZE:
+                    yield data
+                    data = bytearray()
+            if data:
+                yield data
+
+        # http://www.w3.org/TR/PNG/#11IDAT
+        level = self.compression
+        if level is None:
+            level = -1
+        for compressed in parallel_deflate(blocks(), level, self.workers):
+            write_chunk(outfile, b'IDAT', compressed)
+        # http://www.w3.org/TR/PNG/#11IEND
+        write_chunk(outfile, b'IEND')
+        return count[0]
+
     def write_preamble(self, outfile):
         # http://www.w3.org/TR/PNG/#5PNG-file-signature
         outfile.write(signature)
@@ -892,6 +1059,78 @@ class Writer:
                 yield row
 
 
+# The size of the (uncompressed) blocks that
+# a Writer with `workers` compresses in parallel;
+# the same as pigz uses.
+DEFLATE_BLOCK_SIZE = 2**17
+
+# The size of the deflate window;
+# each block is primed with this much of the data before it.
+DEFLATE_WINDOW = 2**15
+
+
+def parallel_deflate(blocks, level=-1, workers=None):
+    """
+    Compress the sequence of byte strings `blocks` as a single zlib stream,
+    compressing the blocks concurrently in `workers` threads
+    (``zlib`` releases the GIL while it works).
+    Yields the compressed data for each block in order;
+    the first is prefixed with the zlib header,
+    and the last followed by the Adler-32 checksum.
+
+    As in pigz, each block is compressed as raw deflate data
+    primed with the last :data:`DEFLATE_WINDOW` bytes of
+    the block before it (so matches may reach back into it),
+    and ended with a sync flush (so the next block starts on a byte);
+    only the last block is finished.
+    Only a few blocks are in flight at once, so memory use is bounded.
+    """
+
+    # http://www.ietf.org/rfc/rfc1950.txt
+    # CMF: deflate with a 32K window; FLG: the compression level.
+    cmf = 0x78
+    flevel = 2 if level < 0 else (0, 0, 1, 1, 1, 1, 2, 3, 3, 3)[level]
+    flg = flevel << 6
+    flg += (31 - (cmf * 256 + flg) % 31) % 31
+    header = struct.pack('BB', cmf, flg)
+
+    def compress(data, dictionary, last):
+        if dictionary:
+            compressor = zlib.compressobj(
+                level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(
+                level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        flush = (zlib.Z_SYNC_FLUSH, zlib.Z_FINISH)[last]
+        return compressor.compress(data) + compressor.flush(flush)
+
+    workers = workers or os.cpu_count() or 1
+    checksum = zlib.adler32(b'')
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        blocks = iter(blocks)
+        dictionary = b''
+        data = next(blocks, b'')
+        while data is not None:
+            following = next(blocks, None)
+            checksum = zlib.adler32(data, checksum)
+            pending.append(executor.submit(
+                compress, data, dictionary, following is None))
+            dictionary = (dictionary +
+                          bytes(data[-DEFLATE_WINDOW:]))[-DEFLATE_WINDOW:]
+            data = following
+            # Collect finished blocks, in order,
+            # keeping a couple of blocks per worker in flight.
+            while pending and (len(pending) > 2 * workers or data is None):
+                compressed = pending.popleft().result()
+                if header:
+                    compressed = header + compressed
+                    header = b''
+                if data is None and not pending:
+                    compressed += struct.pack('!I', checksum & 0xffffffff)
+                yield compressed
+
+
 def write_chunk(outfile, tag, data=b''):
     """
     Write a PNG chunk to the output file, including length and
@@ -1249,6 +1488,57 @@ def from_array(a, mode=None, info={}):
 fromarray = from_array
 
 
+def from_ndarray(a, mode=None, info={}):
+    """
+    Create a PNG :class:`Image` object from a NumPy array,
+    of shape (`height`, `width`) or (`height`, `width`, `planes`),
+    holding ``uint8`` or ``uint16`` values
+    (a bit depth of 8 or 16).
+    Saving or writing the image goes through :meth:`Writer.write_ndarray`,
+    so the rows are never converted one by one.
+
+    *mode* is as for :func:`from_array`, but without a bit depth;
+    by default it is derived from the number of planes
+    (``'L'``, ``'LA'``, ``'RGB'``, or ``'RGBA'``).
+    A 2-dimensional array with a *mode* of more than one plane
+    has the planes of each pixel next to each other in a row.
+    Other entries in *info* are passed to the :class:`Writer`
+    (for example ``filter_type``).
+    """
+
+    if a.ndim not in (2, 3):
+        raise ProtocolError(
+            "array should have 2 or 3 dimensions, not %d" % a.ndim)
+    if a.dtype.kind != 'u' or a.dtype.itemsize not in (1, 2):
+        raise ProtocolError(
+            "array should hold uint8 or uint16 values, not %s" % a.dtype)
+    if a.ndim == 3:
+        planes = a.shape[2]
+    elif mode:
+        planes = len(mode)
+    else:
+        planes = 1
+    if mode is None:
+        mode = ('L', 'LA', 'RGB', 'RGBA')[planes - 1] if planes <= 4 else ''
+    if not re.match('^(LA?|RGBA?)$', mode) or len(mode) != planes:
+        raise ProtocolError(
+            "mode %r does not match an array with %d planes" % (mode, planes))
+    if a.ndim == 2 and a.shape[1] % planes:
+        raise ProtocolError(
+            "array width %d is not a multiple of %d planes"
+            % (a.shape[1], planes))
+    height = a.shape[0]
+    width = a.shape[1] // (1, planes)[a.ndim == 2]
+
+    info = dict(info)
+    info.update(width=width, height=height,
+                greyscale='L' in mode, alpha='A' in mode,
+                bitdepth=8 * a.dtype.itemsize)
+    info.pop('size', None)
+    info.pop('planes', None)
+    return Image(a, info)
+
+
 class Image:
     """A PNG image.  You can create an :class:`Image` object from
     an array of pixels by calling :meth:`png.from_array`.  It can be
@@ -1296,12 +1586,158 @@ class Image:
         w.write(file, self.rows)
 
 
+# The choices for the `verify_crc` argument of :class:`Reader`.
+verify_crc_modes = ('always', 'headers-only', 'deferred', 'never')
+
+
+def check_checksum(type, data, checksum):
+    """
+    Compare the `checksum` (4 bytes, from the file) of
+    a chunk of `type` holding `data` with its CRC.
+    Returns ``None`` when they match, and an error message otherwise.
+    """
+
+    verify = zlib.crc32(type)
+    verify = zlib.crc32(data, verify)
+    verify = struct.pack('!I', verify)
+    if checksum == verify:
+        return None
+    (a, ) = struct.unpack('!I', checksum)
+    (b, ) = struct.unpack('!I', verify)
+    return ("Checksum error in %s chunk: 0x%08X != 0x%08X."
+            % (type.decode('ascii'), a, b))
+
+
+def report_checksum(message, lenient):
+    """
+    Report a checksum failure `message`
+    (from :func:`check_checksum`; ``None`` is no failure),
+    as a warning if `lenient` evaluates to `True`,
+    otherwise as a :class:`ChunkError`.
+    """
+
+    if message is None:
+        return
+    if lenient:
+        warnings.warn(message, RuntimeWarning)
+    else:
+        raise ChunkError(message)
+
+
+class _DeferredChecksums:
+    """
+    Checks chunk checksums in a background thread.
+    ``zlib.crc32`` releases the GIL for large buffers,
+    so this overlaps with decompression in the reading thread.
+    The thread only runs while there are chunks queued,
+    so a decode that is abandoned does not leave one behind.
+    """
+
+    def __init__(self):
+        self.queue = collections.deque()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.messages = []
+
+    def add(self, type, data, checksum):
+        """Queue the chunk for checking."""
+
+        with self.lock:
+            self.queue.append((type, data, checksum))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.thread = None
+                    return
+                item = self.queue.popleft()
+            message = check_checksum(*item)
+            if message is not None:
+                self.messages.append(message)
+
+    def finish(self):
+        """
+        Wait for all queued chunks to be checked;
+        returns the list of error messages (normally empty).
+        """
+
+        with self.lock:
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+        return self.messages
+
+
+# Types that a Reader reads in place, rather than through a file.
+buffer_types = (bytes, bytearray, memoryview, mmap.mmap)
+
+
+class _BufferFile:
+    """
+    A read-only file over a buffer (``bytes``, ``mmap``, ...)
+    whose :meth:`read` returns ``memoryview`` slices of the buffer,
+    so reading never copies the data.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.view = memoryview(buffer).cast('B')
+        self.pos = 0
+
+    def read(self, n=-1):
+        start = self.pos
+        if n is None or n < 0:
+            self.pos = len(self.view)
+        else:
+            self.pos = min(start + n, len(self.view))
+        return self.view[start: self.pos]
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0,
+                io.SEEK_CUR: self.pos,
+                io.SEEK_END: len(self.view)}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self.view.release()
+
+
+def open_mapped(filename):
+    """
+    Open the file `filename` for reading by a :class:`Reader`.
+    Regular files are memory mapped and returned as a :class:`_BufferFile`;
+    anything that cannot be mapped (an empty file, a pipe)
+    is returned as an ordinary binary file.
+    """
+
+    file = open(filename, "rb")
+    try:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        return file
+    # The map holds its own reference to the file.
+    file.close()
+    return _BufferFile(mapped)
+
+
 class Reader:
     """
     Pure Python PNG decoder in pure Python.
     """
 
-    def __init__(self, _guess=None, filename=None, file=None, bytes=None):
+    def __init__(self, _guess=None, filename=None, file=None, bytes=None,
+                 unfilter=None, verify_crc='always', pipeline=False):
         """
         The constructor expects exactly one keyword argument.
         If you supply a positional argument instead,
@@ -1315,6 +1751,38 @@ class Reader:
         bytes
           ``bytes`` or ``bytearray`` with PNG data.
 
+        The optional `unfilter` argument selects the scanline
+        unfiltering engine by name (a key of :data:`unfilter_backends`),
+        see :func:`get_unfilter_backend`.
+        The default picks ``'numpy'`` when NumPy is installed and
+        ``'python'`` otherwise; both produce identical bytes.
+
+        The optional `verify_crc` argument says which chunk checksums
+        are checked (one of :data:`verify_crc_modes`):
+
+        ``'always'``
+          every chunk, as it is read (the default);
+        ``'headers-only'``
+          every chunk except ``IDAT``;
+        ``'deferred'``
+          as ``'always'``, but ``IDAT`` checksums are computed
+          by a background thread, while decoding carries on;
+          any failure is reported when the ``IEND`` chunk is read,
+          at the end of the decode
+          (so not by a decode that stops early, like :meth:`read_region`);
+        ``'never'``
+          no chunks; only for trusted input,
+          such as files written moments ago by this program.
+
+        If the optional `pipeline` argument evaluates to `True`,
+        chunks are read and inflated by a separate thread
+        (see :func:`pipelined`),
+        overlapping with unfiltering and conversion in the caller's thread;
+        zlib releases the GIL while it inflates,
+        so this helps on machines with more than one core.
+        It may be an ``int``, the number of decompressed blocks
+        that may be queued ahead of the caller
+        (``True`` is :data:`PIPELINE_DEPTH`).
         """
         keywords_supplied = (
             (_guess is not None) +
@@ -1332,19 +1800,33 @@ class Reader:
         # past the 4 bytes that specify the chunk type).
         # See preamble method for how this is used.
         self.atchunk = None
+        self.unfilter = get_unfilter_backend(unfilter)
+        if verify_crc not in verify_crc_modes:
+            raise ProtocolError(
+                "unknown verify_crc %r, choose from %s"
+                % (verify_crc, ', '.join(verify_crc_modes)))
+        self.verify_crc = verify_crc
+        # The _DeferredChecksums for verify_crc='deferred'.
+        self.deferred = None
+        if pipeline is True:
+            pipeline = PIPELINE_DEPTH
+        # None, like False, means no pipeline.
+        self.pipeline = int(pipeline or 0)
 
         if _guess is not None:
-            if isarray(_guess):
+            if isarray(_guess) or isinstance(_guess, buffer_types):
                 bytes = _guess
             elif isinstance(_guess, str):
                 filename = _guess
             elif hasattr(_guess, 'read'):
                 file = _guess
 
+        # Bytes and (where possible) files are read in place,
+        # through a _BufferFile; see chunk.
         if bytes is not None:
-            self.file = io.BytesIO(bytes)
+            self.file = _BufferFile(bytes)
         elif filename is not None:
-            self.file = open(filename, "rb")
+            self.file = open_mapped(filename)
         elif file is not None:
             self.file = file
         else:
@@ -1356,7 +1838,9 @@ class Reader:
         returns a (*type*, *data*) tuple.
         *type* is the chunk's type as a byte string
         (all PNG chunk types are 4 bytes long).
-        *data* is the chunk's data content, as a byte string.
+        *data* is the chunk's data content, as a byte string;
+        except that ``IDAT`` data read from bytes or a mapped file
+        is a ``memoryview`` of the input.
 
         If the optional `lenient` argument evaluates to `True`,
         checksum failures will raise warnings rather than exceptions.
@@ -1372,6 +1856,7 @@ class Reader:
         length, type = self.atchunk
         self.atchunk = None
 
+        # For a _BufferFile this is a memoryview of the input, not a copy.
         data = self.file.read(length)
         if len(data) != length:
             raise ChunkError(
@@ -1380,18 +1865,22 @@ class Reader:
         checksum = self.file.read(4)
         if len(checksum) != 4:
             raise ChunkError('Chunk %s too short for checksum.' % type)
-        verify = zlib.crc32(type)
-        verify = zlib.crc32(data, verify)
-        verify = struct.pack('!I', verify)
-        if checksum != verify:
-            (a, ) = struct.unpack('!I', checksum)
-            (b, ) = struct.unpack('!I', verify)
-            message = ("Checksum error in %s chunk: 0x%08X != 0x%08X."
-                       % (type.decode('ascii'), a, b))
-            if lenient:
-                warnings.warn(message, RuntimeWarning)
-            else:
-                raise ChunkError(message)
+        if type == b'IDAT' and self.verify_crc != 'always':
+            if self.verify_crc == 'deferred':
+                if self.deferred is None:
+                    self.deferred = _DeferredChecksums()
+                self.deferred.add(type, data, bytes(checksum))
+        elif self.verify_crc != 'never':
+            report_checksum(check_checksum(type, data, checksum), lenient)
+        if type == b'IEND' and self.deferred is not None:
+            messages = self.deferred.finish()
+            self.deferred = None
+            for message in messages:
+                report_checksum(message, lenient)
+        if type != b'IDAT':
+            # Only IDAT data (which goes straight to zlib)
+            # is left as a view; the rest are small, and kept.
+            data = bytes(data)
         return type, data
 
     def chunks(self):
@@ -1424,43 +1913,24 @@ class Reader:
         the result will be returned as a fresh sequence of bytes.
         """
 
-        # :todo: Would it be better to update scanline in place?
-        result = scanline
-
-        if filter_type == 0:
-            return result
+        return self.unfilter.undo_filter(
+            self._filter_unit(), filter_type, scanline, previous)
 
-        if filter_type not in (1, 2, 3, 4):
-            raise FormatError(
-                'Invalid PNG Filter Type.  '
-                'See http://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters .')
+    def _filter_unit(self):
+        """
+        The filter unit.  The stride from one pixel to the corresponding
+        byte from the previous pixel.  Normally this is the pixel
+        size in bytes, but when this is smaller than 1, the previous
+        byte is used instead.
+        """
 
-        # Filter unit.  The stride from one pixel to the corresponding
-        # byte from the previous pixel.  Normally this is the pixel
-        # size in bytes, but when this is smaller than 1, the previous
-        # byte is used instead.
-        fu = max(1, self.psize)
+        return max(1, self.psize)
 
-        # For the first line of a pass, synthesize a dummy previous
-        # line.  An alternative approach would be to observe that on the
-        # first line 'up' is the same as 'null', 'paeth' is the same
-        # as 'sub', with only 'average' requiring any special case.
-        if not previous:
-            previous = bytearray([0] * len(scanline))
-
-        # Call appropriate filter algorithm.  Note that 0 has already
-        # been dealt with.
-        fn = (None,
-              undo_filter_sub,
-              undo_filter_up,
-              undo_filter_average,
-              undo_filter_paeth)[filter_type]
-        fn(fu, scanline, previous, result)
-        return result
-
-    def _deinterlace(self, raw):
+    def _deinterlace(self, byte_blocks):
         """
         Read raw pixel data, undo filters, deinterlace, and flatten.
+        `byte_blocks` should be an iterable that yields the raw
+        (decompressed) bytes in blocks of arbitrary size.
         Return a single array of values.
         """
 
@@ -1473,40 +1943,103 @@ class Reader:
         # (well, not quite), so the entire output array must be in memory.
         # Make a result array, and make it big enough.
         if self.bitdepth > 8:
-            a = array('H', [0] * vpi)
+            a = array('H', bytes(2 * vpi))
         else:
-            a = bytearray([0] * vpi)
-        source_offset = 0
+            a = bytearray(vpi)
+        if numpy is not None:
+            grid = ndarray_view(a, (self.height, self.width, self.planes))
 
-        for lines in adam7_generate(self.width, self.height):
+        blocks = iter(byte_blocks)
+        # What is left of the last block of raw data.
+        leftover = [memoryview(b'')]
+
+        def take(n):
+            """
+            The next `n` bytes of raw data, as a ``memoryview``.
+            When they are all in the current block of raw data
+            that is a slice of it; only a request that straddles
+            two blocks is copied.
+            """
+            some_bytes = leftover[0]
+            if len(some_bytes) >= n:
+                leftover[0] = some_bytes[n:]
+                return some_bytes[:n]
+            view = memoryview(bytearray(n))
+            fill = 0
+            while True:
+                k = min(n - fill, len(some_bytes))
+                view[fill: fill + k] = some_bytes[:k]
+                fill += k
+                if fill == n:
+                    leftover[0] = some_bytes[k:]
+                    return view
+                some_bytes = next(blocks, None)
+                if some_bytes is None:
+                    # :file:format Not enough data for all the passes.
+                    raise FormatError(
+                        'Wrong size for decompressed IDAT chunk.')
+                some_bytes = memoryview(some_bytes)
+
+        fu = self._filter_unit()
+        block_rows = self.unfilter.block_rows
+        for xstart, ystart, xstep, ystep in adam7:
+            # Pixels per row and rows (of the reduced pass image)
+            ppr = (self.width - xstart + xstep - 1) // xstep
+            rows = (self.height - ystart + ystep - 1) // ystep
+            if ppr <= 0 or rows <= 0:
+                # Empty passes have no data at all.
+                continue
+            # Row size in bytes for this pass.
+            row_size = int(math.ceil(self.psize * ppr))
+            ppv = ppr * self.planes
+
+            # Unfilter the pass a block of rows at a time,
+            # straight from the decompressed data,
+            # and put each block of rows in its place in the output;
+            # the pass as a whole is never held anywhere.
             # The previous (reconstructed) scanline.
             # `None` at the beginning of a pass
             # to indicate that there is no previous line.
             recon = None
-            for x, y, xstep in lines:
-                # Pixels per row (reduced pass image)
-                ppr = int(math.ceil((self.width - x) / float(xstep)))
-                # Row size in bytes for this pass.
-                row_size = int(math.ceil(self.psize * ppr))
-
-                filter_type = raw[source_offset]
-                source_offset += 1
-                scanline = raw[source_offset: source_offset + row_size]
-                source_offset += row_size
-                recon = self.undo_filter(filter_type, scanline, recon)
+            for i in range(0, rows, block_rows):
+                n = min(block_rows, rows - i)
+                block = self.unfilter.undo_filter_block(
+                    fu, row_size, take(n * (row_size + 1)), recon)
+                recon = block[-row_size:]
+
                 # Convert so that there is one element per pixel value
-                flat = self._bytes_to_values(recon, width=ppr)
-                if xstep == 1:
-                    assert x == 0
-                    offset = y * vpr
-                    a[offset: offset + vpr] = flat
+                if self.bitdepth == 8:
+                    flat = block
+                elif self.bitdepth == 16:
+                    flat = array('H', block)
+                    if sys.byteorder == 'little':
+                        flat.byteswap()
                 else:
-                    offset = y * vpr + x * self.planes
-                    end_offset = (y + 1) * vpr
-                    skip = self.planes * xstep
-                    for i in range(self.planes):
-                        a[offset + i: end_offset: skip] = \
-                            flat[i:: self.planes]
+                    flat = bytearray()
+                    for j in range(0, len(block), row_size):
+                        flat.extend(self._bytes_to_values(
+                            block[j: j + row_size], width=ppr))
+
+                y = ystart + i * ystep
+                if numpy is not None:
+                    # Scatter the block with one strided assignment.
+                    grid[y: y + n * ystep: ystep, xstart::xstep] = \
+                        ndarray_view(flat, (n, ppr, self.planes))
+                    continue
+                for r in range(n):
+                    row = flat[r * ppv: (r + 1) * ppv]
+                    if xstep == 1:
+                        assert xstart == 0
+                        offset = y * vpr
+                        a[offset: offset + vpr] = row
+                    else:
+                        offset = y * vpr + xstart * self.planes
+                        end_offset = (y + 1) * vpr
+                        skip = self.planes * xstep
+                        for k in range(self.planes):
+                            a[offset + k: end_offset: skip] = \
+                                row[k:: self.planes]
+                    y += ystep
 
         return a
 
@@ -1530,21 +2063,17 @@ class Reader:
         if self.bitdepth == 8:
             return bytearray(bs)
         if self.bitdepth == 16:
-            return array('H',
-                         struct.unpack('!%dH' % (len(bs) // 2), bs))
+            values = array('H')
+            values.frombytes(bs)
+            # PNG samples are big-endian.
+            if sys.byteorder == 'little':
+                values.byteswap()
+            return values
 
         assert self.bitdepth < 8
         if width is None:
             width = self.width
-        # Samples per byte
-        spb = 8 // self.bitdepth
-        out = bytearray()
-        mask = 2**self.bitdepth - 1
-        shifts = [self.bitdepth * i
-                  for i in reversed(list(range(spb)))]
-        for o in bs:
-            out.extend([mask & (o >> i) for i in shifts])
-        return out[:width]
+        return unpack_samples(bs, self.bitdepth, width)
 
     def _iter_straight_packed(self, byte_blocks):
         """Iterator that undoes the effect of filtering;
@@ -1556,24 +2085,54 @@ class Reader:
 
         # length of row, in bytes
         rb = self.row_bytes
-        a = bytearray()
+        fu = self._filter_unit()
         # The previous (reconstructed) scanline.
         # None indicates first line of image.
         recon = None
-        for some_bytes in byte_blocks:
-            a.extend(some_bytes)
-            while len(a) >= rb + 1:
-                filter_type = a[0]
-                scanline = a[1: rb + 1]
-                del a[: rb + 1]
-                recon = self.undo_filter(filter_type, scanline, recon)
+        for raw in self._iter_filtered_blocks(byte_blocks):
+            rows = self.unfilter.undo_filter_block(fu, rb, raw, recon)
+            for i in range(0, len(rows), rb):
+                recon = rows[i: i + rb]
                 yield recon
-        if len(a) != 0:
+
+    def _iter_filtered_blocks(self, byte_blocks):
+        """
+        Iterator that regroups the decompressed image data into
+        blocks of whole (still filtered) scanlines,
+        each scanline preceded by its filter type byte.
+        Assumes input is straightlaced.
+        Blocks hold the number of rows the unfilter engine prefers to
+        see at once (except the last);
+        each is a ``memoryview`` that is only valid until
+        the next one is requested.
+        """
+
+        # length of row, in bytes, with filter type byte
+        stride = self.row_bytes + 1
+        # Rows are collected in a fixed size buffer;
+        # when it is full they are handed on, and it is refilled
+        # from the start.
+        # Memory use depends on the row size, not the image size.
+        block = bytearray(self.unfilter.block_rows * stride)
+        view = memoryview(block)
+        fill = 0
+        for some_bytes in byte_blocks:
+            some_bytes = memoryview(some_bytes)
+            while some_bytes:
+                n = min(len(block) - fill, len(some_bytes))
+                view[fill: fill + n] = some_bytes[:n]
+                some_bytes = some_bytes[n:]
+                fill += n
+                if fill == len(block):
+                    yield view
+                    fill = 0
+        if fill % stride != 0:
             # :file:format We get here with a file format error:
             # when the available bytes (after decompressing) do not
             # pack into exact rows.
             raise FormatError('Wrong size for decompressed IDAT chunk.')
-        assert len(a) == 0
+        if fill:
+            yield view[:fill]
 
     def validate_signature(self):
         """
@@ -1583,7 +2142,7 @@ class Reader:
 
         if self.signature:
             return
-        self.signature = self.file.read(8)
+        self.signature = bytes(self.file.read(8))
         if self.signature != signature:
             raise FormatError("PNG file has invalid signature.")
 
@@ -1774,6 +2333,56 @@ class Reader:
             struct.unpack(fmt, data)
         self.unit_is_meter = bool(unit)
 
+    def _iter_idat(self, lenient=False):
+        """Iterator that yields all the ``IDAT`` chunks as strings."""
+
+        while True:
+            type, data = self.chunk(lenient=lenient)
+            if type == b'IEND':
+                # http://www.w3.org/TR/PNG/#11IEND
+                break
+            if type != b'IDAT':
+                continue
+            # type == b'IDAT'
+            # http://www.w3.org/TR/PNG/#11IDAT
+            if self.colormap and not self.plte:
+                warnings.warn("PLTE chunk is required before IDAT chunk")
+            yield data
+
+    def _iter_raw(self, lenient=False):
+        """
+        Iterator that yields the decompressed image data
+        (filtered scanlines) in blocks;
+        inflated in a separate thread when `pipeline` is set.
+        """
+
+        raw = decompress(self._iter_idat(lenient=lenient))
+        if self.pipeline:
+            raw = pipelined(raw, self.pipeline)
+        return raw
+
+    def _info(self):
+        """
+        The *info* dictionary returned by :meth:`read` and friends.
+        The preamble must have been read.
+        """
+
+        info = dict()
+        for attr in 'greyscale alpha planes bitdepth interlace'.split():
+            info[attr] = getattr(self, attr)
+        info['size'] = (self.width, self.height)
+        for attr in 'gamma transparent background'.split():
+            a = getattr(self, attr, None)
+            if a is not None:
+                info[attr] = a
+        if getattr(self, 'x_pixels_per_unit', None):
+            info['physical'] = Resolution(self.x_pixels_per_unit,
+                                          self.y_pixels_per_unit,
+                                          self.unit_is_meter)
+        if self.plte:
+            info['palette'] = self.palette()
+        return info
+
     def read(self, lenient=False):
         """
         Read the PNG file and decode it.
@@ -1788,34 +2397,18 @@ class Reader:
         checksum failures will raise warnings rather than exceptions.
         """
 
-        def iteridat():
-            """Iterator that yields all the ``IDAT`` chunks as strings."""
-            while True:
-                type, data = self.chunk(lenient=lenient)
-                if type == b'IEND':
-                    # http://www.w3.org/TR/PNG/#11IEND
-                    break
-                if type != b'IDAT':
-                    continue
-                # type == b'IDAT'
-                # http://www.w3.org/TR/PNG/#11IDAT
-                if self.colormap and not self.plte:
-                    warnings.warn("PLTE chunk is required before IDAT chunk")
-                yield data
-
         self.preamble(lenient=lenient)
-        raw = decompress(iteridat())
+        raw = self._iter_raw(lenient=lenient)
 
         if self.interlace:
             def rows_from_interlace():
                 """Yield each row from an interlaced PNG."""
                 # It's important that this iterator doesn't read
                 # IDAT chunks until it yields the first row.
-                bs = bytearray(itertools.chain(*raw))
                 arraycode = 'BH'[self.bitdepth > 8]
                 # Like :meth:`group` but
                 # producing an array.array object for each row.
-                values = self._deinterlace(bs)
+                values = self._deinterlace(raw)
                 vpr = self.width * self.planes
                 for i in range(0, len(values), vpr):
                     row = array(arraycode, values[i:i+vpr])
@@ -1823,20 +2416,7 @@ class Reader:
             rows = rows_from_interlace()
         else:
             rows = self._iter_bytes_to_values(self._iter_straight_packed(raw))
-        info = dict()
-        for attr in 'greyscale alpha planes bitdepth interlace'.split():
-            info[attr] = getattr(self, attr)
-        info['size'] = (self.width, self.height)
-        for attr in 'gamma transparent background'.split():
-            a = getattr(self, attr, None)
-            if a is not None:
-                info[attr] = a
-        if getattr(self, 'x_pixels_per_unit', None):
-            info['physical'] = Resolution(self.x_pixels_per_unit,
-                                          self.y_pixels_per_unit,
-                                          self.unit_is_meter)
-        if self.plte:
-            info['palette'] = self.palette()
+        info = self._info()
         return self.width, self.height, rows, info
 
     def read_flat(self):
@@ -1857,6 +2437,248 @@ class Reader:
         pixel = array(arraycode, itertools.chain(*pixel))
         return x, y, pixel, info
 
+    def read_ndarray(self, lenient=False):
+        """
+        Read the PNG file and decode it into one contiguous buffer.
+        Returns (*width*, *height*, *pixels*, *info*).
+
+        *pixels* has shape ``(height, width, planes)``, with values
+        as for :meth:`read` (so palette indexes for a colour mapped
+        image, see :meth:`asDirect`).
+        When NumPy is installed it is a ``numpy.ndarray``,
+        otherwise a ``memoryview``;
+        the item type is unsigned 8-bit (``uint8``, ``'B'``) or,
+        for 16-bit images, unsigned 16-bit in native byte order.
+        Unfiltered scanlines are copied straight into the buffer;
+        no per-row or per-pixel Python objects are created.
+        Use :func:`split_planes` to get at the channels.
+
+        If the optional `lenient` argument evaluates to True,
+        checksum failures will raise warnings rather than exceptions.
+        """
+
+        self.preamble(lenient=lenient)
+        raw = self._iter_raw(lenient=lenient)
+        typecode = 'BH'[self.bitdepth > 8]
+
+        if self.interlace:
+            values = self._deinterlace(raw)
+        elif self.bitdepth < 8:
+            values = bytearray()
+            y = 0
+            for row in self._iter_straight_packed(raw):
+                values.extend(self._bytes_to_values(row))
+                y += 1
+            self._check_row_count(y)
+        else:
+            rb = self.row_bytes
+            values = array(typecode, bytes(self.height * rb))
+            target = memoryview(values).cast('B')
+            y = 0
+            for row in self._iter_straight_packed(raw):
+                if y == self.height:
+                    break
+                target[y * rb: (y + 1) * rb] = row
+                y += 1
+            target.release()
+            self._check_row_count(y)
+            # PNG samples are big-endian.
+            if self.bitdepth == 16 and sys.byteorder == 'little':
+                values.byteswap()
+
+        shape = (self.height, self.width, self.planes)
+        return self.width, self.height, ndarray_view(values, shape), \
+            self._info()
+
+    def read_region(self, x0, y0, x1, y1, lenient=False):
+        """
+        Read and decode only a rectangle of the PNG image:
+        columns `x0` up to (but not including) `x1`,
+        rows `y0` up to (but not including) `y1`.
+        Returns (*width*, *height*, *rows*, *info*),
+        where *width* and *height* are those of the rectangle,
+        *rows* is a list of rows (each a sequence of values,
+        as for :meth:`read`) and
+        ``info['size']`` is the size of the rectangle.
+
+        Only straightlaced (not interlaced) images are supported.
+        The compressed data before row `y0` still has to be inflated,
+        but nothing after row `y1` is read.
+        Rows before `y0` are only unfiltered when a later row
+        depends on them:
+        scanlines with filter type "None" or "Sub" do not refer to
+        the previous scanline, so anything above one of those
+        is skipped.
+
+        If the optional `lenient` argument evaluates to True,
+        checksum failures will raise warnings rather than exceptions.
+        """
+
+        self.preamble(lenient=lenient)
+        if self.interlace:
+            raise ProtocolError("read_region needs a straightlaced image")
+        if not (0 <= x0 < x1 <= self.width and
+                0 <= y0 < y1 <= self.height):
+            raise ProtocolError(
+                "region (%d, %d)-(%d, %d) is not inside a %dx%d image" %
+                (x0, y0, x1, y1, self.width, self.height))
+
+        rb = self.row_bytes
+        stride = rb + 1
+        fu = self._filter_unit()
+        block_rows = self.unfilter.block_rows
+        raw = self._iter_raw(lenient=lenient)
+
+        # Filtered scanlines (with filter type bytes) not yet unfiltered:
+        # the rows above `y0` that a later row may depend on,
+        # then the rows of the region.
+        pending = bytearray()
+        recon = None
+        y = 0
+        for block in self._iter_filtered_blocks(raw):
+            for i in range(0, len(block), stride):
+                if y < y0:
+                    if block[i] in (0, 1):
+                        # Independent of the rows above it.
+                        del pending[:]
+                        recon = None
+                    pending.extend(block[i: i + stride])
+                    if len(pending) == max(block_rows, 32) * stride:
+                        rows = self.unfilter.undo_filter_block(
+                            fu, rb, pending, recon)
+                        recon = rows[-rb:]
+                        del pending[:]
+                elif y == y0:
+                    if pending:
+                        rows = self.unfilter.undo_filter_block(
+                            fu, rb, pending, recon)
+                        recon = rows[-rb:]
+                    pending = bytearray(block[i: i + stride])
+                else:
+                    pending.extend(block[i: i + stride])
+                y += 1
+                if y == y1:
+                    break
+            if y == y1:
+                break
+        if y != y1:
+            # :file:format Not enough image data for the region.
+            raise FormatError(
+                'Image data has %d rows, expected at least %d.' % (y, y1))
+        packed = self.unfilter.undo_filter_block(fu, rb, pending, recon)
+
+        rows = []
+        if self.bitdepth >= 8:
+            # Whole bytes per pixel; select the columns first.
+            start = x0 * self.psize
+            stop = x1 * self.psize
+            for i in range(0, len(packed), rb):
+                rows.append(
+                    self._bytes_to_values(packed[i + start: i + stop]))
+        else:
+            for i in range(0, len(packed), rb):
+                rows.append(self._bytes_to_values(packed[i: i + rb])[x0:x1])
+
+        info = self._info()
+        info['size'] = (x1 - x0, y1 - y0)
+        return x1 - x0, y1 - y0, rows, info
+
+    def read_scaled(self, factor, method="nearest", lenient=False):
+        """
+        Read the PNG file and decode a reduced resolution version:
+        1/`factor` of the width and height, rounded up.
+        Returns (*width*, *height*, *pixels*, *info*) where
+        *width* and *height* are those of the reduced image and
+        *pixels* is a single buffer as for :meth:`read_ndarray`.
+
+        `method` is ``"nearest"``, to take every `factor`-th pixel of
+        every `factor`-th row (starting with the first), or
+        ``"box"``, to average each `factor` by `factor` block
+        (rounding half up;
+        blocks cut off by the right or bottom edge average the pixels
+        they do have).
+        Every row still has to be unfiltered,
+        but ``"nearest"`` only converts the rows it keeps.
+        ``"box"`` is not available for colour mapped images,
+        because palette indexes cannot be averaged.
+
+        If the optional `lenient` argument evaluates to True,
+        checksum failures will raise warnings rather than exceptions.
+        """
+
+        if not is_natural(factor) or factor < 1:
+            raise ProtocolError("factor must be a positive integer")
+        factor = int(factor)
+        if method not in ("nearest", "box"):
+            raise ProtocolError(
+                "method should be 'nearest' or 'box', not %r" % (method,))
+        self.preamble(lenient=lenient)
+        if method == "box" and self.colormap:
+            raise ProtocolError(
+                "cannot box average palette indexes, see asDirect")
+
+        planes = self.planes
+        width = (self.width + factor - 1) // factor
+        height = (self.height + factor - 1) // factor
+        vpr = width * planes
+        # Same type as the rows of values, so slices can be assigned.
+        if self.bitdepth > 8:
+            def newarray(values):
+                return array('H', values)
+        else:
+            newarray = bytearray
+        values = newarray([0]) * (height * vpr)
+
+        raw = self._iter_raw(lenient=lenient)
+        if self.interlace:
+            flat = self._deinterlace(raw)
+            full_vpr = self.width * planes
+            packed_rows = (flat[i: i + full_vpr]
+                           for i in range(0, len(flat), full_vpr))
+
+            def to_values(row):
+                return row
+        else:
+            packed_rows = self._iter_straight_packed(raw)
+            to_values = self._bytes_to_values
+
+        y = 0
+        if method == "nearest":
+            for y, packed in enumerate(packed_rows, 1):
+                if (y - 1) % factor:
+                    continue
+                row = to_values(packed)
+                offset = (y - 1) // factor * vpr
+                for i in range(planes):
+                    values[offset + i: offset + vpr: planes] = \
+                        row[i:: factor * planes]
+        else:
+            block = []
+            for y, packed in enumerate(packed_rows, 1):
+                block.append(to_values(packed))
+                if len(block) == factor or y == self.height:
+                    offset = (y - 1) // factor * vpr
+                    values[offset: offset + vpr] = newarray(
+                        box_average(block, self.width, planes, factor))
+                    block = []
+        self._check_row_count(y)
+
+        info = self._info()
+        info['size'] = (width, height)
+        return width, height, \
+            ndarray_view(values, (height, width, planes)), info
+
+    def _check_row_count(self, rows):
+        """
+        Raise an exception unless `rows` (the number of rows
+        decoded) matches the image height.
+        """
+
+        if rows != self.height:
+            # :file:format Not enough image data for all the rows.
+            raise FormatError(
+                'Image data has %d rows, expected %d.' % (rows, self.height))
+
     def palette(self, alpha='natural'):
         """
         Returns a palette that is a sequence of 3-tuples or 4-tuples,
@@ -1943,20 +2765,22 @@ class Reader:
             info['bitdepth'] = 8
             info['planes'] = 3 + bool(self.trns)
             plte = self.palette()
+            # One translate table for each channel, and
+            # the indexes that are in the palette.
+            tables = [bytes(bytearray(c)).ljust(256, b'\0')
+                      for c in zip(*plte)]
+            known = bytes(bytearray(range(len(plte))))
 
             def iterpal(pixels):
                 for row in pixels:
-                    row = [plte[x] for x in row]
-                    yield array('B', itertools.chain(*row))
+                    row = as_bytes(row)
+                    if len(plte) < 256 and row.translate(None, known):
+                        raise FormatError(
+                            "Palette index out of range (palette has %d "
+                            "entries)." % len(plte))
+                    yield interleave_tables(row, tables)
             pixels = iterpal(pixels)
         elif self.trns:
-            # It would be nice if there was some reasonable way
-            # of doing this without generating a whole load of
-            # intermediate tuples.  But tuples does seem like the
-            # easiest way, with no other way clearly much simpler or
-            # much faster.  (Actually, the L to LA conversion could
-            # perhaps go faster (all those 1-tuples!), but I still
-            # wonder whether the code proliferation is worth it)
             it = self.transparent
             maxval = 2 ** info['bitdepth'] - 1
             planes = info['planes']
@@ -1966,18 +2790,8 @@ class Reader:
 
             def itertrns(pixels):
                 for row in pixels:
-                    # For each row we group it into pixels, then form a
-                    # characterisation vector that says whether each
-                    # pixel is opaque or not.  Then we convert
-                    # True/False to 0/maxval (by multiplication),
-                    # and add it as the extra channel.
-                    row = group(row, planes)
-                    opa = map(it.__ne__, row)
-                    opa = map(maxval.__mul__, opa)
-                    opa = list(zip(opa))    # convert to 1-tuples
-                    yield array(
-                        typecode,
-                        itertools.chain(*map(operator.add, row, opa)))
+                    yield add_transparent_alpha(
+                        row, planes, it, maxval, typecode)
             pixels = itertrns(pixels)
         targetbitdepth = None
         if self.sbit:
@@ -1990,11 +2804,14 @@ class Reader:
                 raise Error('sBIT chunk %r has a 0-entry' % sbit)
         if targetbitdepth:
             shift = info['bitdepth'] - targetbitdepth
+            lookup = value_lookup(
+                [v >> shift for v in range(2 ** info['bitdepth'])],
+                'BH'[targetbitdepth > 8])
             info['bitdepth'] = targetbitdepth
 
             def itershift(pixels):
                 for row in pixels:
-                    yield [p >> shift for p in row]
+                    yield lookup(row)
             pixels = itershift(pixels)
         return x, y, pixels, info
 
@@ -2006,10 +2823,13 @@ class Reader:
         targetmaxval = 2**targetbitdepth - 1
         factor = float(targetmaxval) / float(maxval)
         info['bitdepth'] = targetbitdepth
+        lookup = value_lookup(
+            [int(round(x * factor)) for x in range(maxval + 1)],
+            'BH'[targetbitdepth > 8])
 
         def iterscale():
             for row in pixels:
-                yield [int(round(x * factor)) for x in row]
+                yield lookup(row)
         if maxval == targetmaxval:
             return width, height, pixels, info
         else:
@@ -2050,6 +2870,73 @@ class Reader:
 
         return self._as_rescale(self.asRGBA, 8)
 
+    def asGrey8(self, weights=(0.299, 0.587, 0.114), exact=False):
+        """
+        Return the image data as greyscale pixels with 8-bits per sample.
+        Colour images are converted to luminance, using the
+        R, G, B `weights` in integer fixed-point arithmetic:
+        ``(wr*R + wg*G + wb*B + 0.5) >> 16`` with each weight
+        scaled by 2**16.
+        The default weights are those of ITU-R BT.601.
+        If `exact` is true the weights are applied in floating point
+        instead, giving exactly ``round(wr*R + wg*G + wb*B)``
+        (rounding halves to even) for every pixel;
+        this is slower, and only needed to match that formula.
+
+        Each scanline is converted as soon as it is unfiltered,
+        so full resolution colour planes are never held in memory.
+        Colour mapped images are converted through a table built
+        from the palette.
+        Values are first rescaled to 8-bit as for :meth:`asRGB8`.
+        An alpha channel (or a ``tRNS`` chunk) is ignored.
+
+        This function returns a 4-tuple:
+        (*width*, *height*, *rows*, *info*).
+        *rows* is a sequence of ``bytearray`` rows,
+        one value per pixel;
+        *info* reflects the returned pixels, so
+        ``info['greyscale']`` is ``True`` and ``info['planes']`` is 1.
+        """
+
+        fixed = fixed_point_weights(weights)
+        if exact:
+            def convert(row, planes):
+                return luminance_row_exact(row, planes, weights)
+        else:
+            def convert(row, planes):
+                return luminance_row(row, planes, fixed)
+        self.preamble()
+
+        if self.colormap:
+            width, height, pixels, info = self.read()
+            # Palette index to luminance.
+            table = convert(bytes(self.plte), 3)
+            table.extend([0] * (256 - len(table)))
+            info['colormap'] = False
+            info['bitdepth'] = 8
+            del info['palette']
+
+            def iterlum():
+                for row in pixels:
+                    yield row.translate(table)
+        else:
+            width, height, pixels, info = self._as_rescale(self.asDirect, 8)
+            planes = info['planes']
+            greyscale = info['greyscale']
+
+            def iterlum():
+                for row in pixels:
+                    if greyscale:
+                        yield bytearray(row[0::planes])
+                    else:
+                        yield convert(row, planes)
+        info['greyscale'] = True
+        info['alpha'] = False
+        info['planes'] = 1
+        info.pop('transparent', None)
+        info.pop('background', None)
+        return width, height, iterlum(), info
+
     def asRGB(self):
         """
         Return image as RGB pixels.
@@ -2146,23 +3033,421 @@ class Reader:
         return width, height, convert(), info
 
 
-def decompress(data_blocks):
+def probe(path_or_bytes, lenient=False):
+    """
+    Read the header of a PNG image, without decompressing any pixels.
+    `path_or_bytes` is a filename, a file-like object,
+    or ``bytes`` (or ``bytearray``) with PNG data.
+
+    Returns a :class:`Probe` named tuple of
+    (`width`, `height`, `bitdepth`, `color_type`, `interlace`,
+    `idat_bytes`);
+    `idat_bytes` is the total length of the (compressed) data
+    in the ``IDAT`` chunks.
+
+    Only the chunks before the first ``IDAT`` chunk are read
+    (and processed as by :meth:`Reader.preamble`,
+    so ``IHDR`` is validated);
+    the ``IDAT`` chunks are skipped over by seeking,
+    only their lengths are read.
+    A filename is opened with a buffer of :data:`PROBE_BUFFER_SIZE`,
+    so a typical file costs one small read,
+    plus one for each ``IDAT`` chunk header beyond that buffer.
+
+    If the optional `lenient` argument evaluates to `True`,
+    checksum failures will raise warnings rather than exceptions.
+    """
+
+    if isinstance(path_or_bytes, buffer_types):
+        return _probe_reader(Reader(bytes=path_or_bytes), lenient)
+    if hasattr(path_or_bytes, 'read'):
+        return _probe_reader(Reader(file=path_or_bytes), lenient)
+    # A buffered read of the header is cheaper than mapping the file.
+    with open(path_or_bytes, 'rb', buffering=PROBE_BUFFER_SIZE) as file:
+        return _probe_reader(Reader(file=file), lenient)
+
+
+def _probe_reader(reader, lenient):
+    """
+    Probe the PNG image read by `reader`, see :func:`probe`.
+    """
+
+    reader.preamble(lenient=lenient)
+    file = reader.file
+    seekable = getattr(file, 'seekable', lambda: False)()
+    idat_bytes = 0
+    # http://www.w3.org/TR/PNG/#5ChunkOrdering
+    # Multiple IDAT chunks shall be consecutive.
+    while reader.atchunk and reader.atchunk[1] == b'IDAT':
+        length = reader.atchunk[0]
+        idat_bytes += length
+        # Skip the data and the checksum.
+        if seekable:
+            file.seek(length + 4, io.SEEK_CUR)
+        else:
+            file.read(length + 4)
+        reader.atchunk = reader._chunk_len_type()
+    return Probe(reader.width, reader.height, reader.bitdepth,
+                 reader.color_type, reader.interlace, idat_bytes)
+
+
+def probe_directory(directory, pattern='*.png', lenient=False):
+    """
+    :func:`probe` each file in `directory` whose name matches `pattern`
+    (a shell-style wildcard, see :mod:`fnmatch`).
+    Returns a ``dict`` that maps each filename (joined to `directory`)
+    to its :class:`Probe`, in sorted filename order.
+
+    Any error in a file is raised,
+    with the file's name in the exception's message.
+    """
+
+    result = dict()
+    names = sorted(entry.name for entry in os.scandir(directory)
+                   if entry.is_file() and fnmatch.fnmatch(entry.name, pattern))
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            result[path] = probe(path, lenient=lenient)
+        except Error as e:
+            raise type(e)(path + ': ' + ' '.join(map(str, e.args))) from e
+    return result
+
+
+def fixed_point_weights(weights):
+    """
+    Convert a triple of (R, G, B) luminance `weights` to
+    integers scaled by 2**16, as used by :func:`luminance_row`.
+    """
+
+    if len(weights) != 3:
+        raise ProtocolError("weights should be an (R, G, B) triple")
+    fixed = tuple(int(round(w * 2 ** 16)) for w in weights)
+    # Keeping the sum in range means every result fits in a byte.
+    if min(fixed) < 0 or sum(fixed) > 2 ** 16:
+        raise ProtocolError(
+            "weights %r should be non-negative and sum to at most 1"
+            % (weights,))
+    return fixed
+
+
+def luminance_row(row, planes, fixed):
+    """
+    Convert a row of 8-bit colour values to luminance.
+    `planes` is 3 (RGB) or 4 (RGBA, alpha is ignored);
+    `fixed` is a triple of weights from :func:`fixed_point_weights`.
+    Returns a ``bytearray`` with one value per pixel.
+    """
+
+    wr, wg, wb = fixed
+    if numpy is not None:
+        pixels = numpy.frombuffer(row, numpy.uint8).reshape(-1, planes)
+        pixels = pixels.astype(numpy.uint32)
+        lum = (pixels[:, 0] * wr + pixels[:, 1] * wg + pixels[:, 2] * wb +
+               2 ** 15) >> 16
+        return bytearray(lum.astype(numpy.uint8).tobytes())
+    # Tables of each channel's contribution, rounding folded into red.
+    tr = [v * wr + 2 ** 15 for v in range(256)]
+    tg = [v * wg for v in range(256)]
+    tb = [v * wb for v in range(256)]
+    return bytearray(
+        (tr[r] + tg[g] + tb[b]) >> 16
+        for r, g, b in zip(row[0::planes], row[1::planes], row[2::planes]))
+
+
+def luminance_row_exact(row, planes, weights):
+    """
+    Convert a row of 8-bit colour values to luminance as
+    ``round(wr*R + wg*G + wb*B)``, in floating point
+    and summed in that order, rounding halves to even.
+    `planes` is 3 (RGB) or 4 (RGBA, alpha is ignored);
+    `weights` is the (R, G, B) triple, checked by
+    :func:`fixed_point_weights`.
+    Returns a ``bytearray`` with one value per pixel.
+    """
+
+    wr, wg, wb = weights
+    if numpy is not None:
+        pixels = numpy.frombuffer(row, numpy.uint8).reshape(-1, planes)
+        pixels = pixels.astype(numpy.float64)
+        # numpy.rint rounds halves to even, as round() does.
+        lum = numpy.rint(wr * pixels[:, 0] + wg * pixels[:, 1] +
+                         wb * pixels[:, 2])
+        return bytearray(lum.astype(numpy.uint8).tobytes())
+    tr = [wr * v for v in range(256)]
+    tg = [wg * v for v in range(256)]
+    tb = [wb * v for v in range(256)]
+    return bytearray(
+        round(tr[r] + tg[g] + tb[b])
+        for r, g, b in zip(row[0::planes], row[1::planes], row[2::planes]))
+
+
+def as_bytes(row):
+    """
+    `row` (a sequence of 8-bit values) as a ``bytes`` or ``bytearray``,
+    which is `row` itself when it is one already.
+    """
+
+    if isinstance(row, (bytes, bytearray)):
+        return row
+    return bytearray(row)
+
+
+# Translate tables for :func:`unpack_samples`, by bit depth:
+# one for each sample position in a byte, most significant first.
+sample_tables = {
+    bitdepth: [bytes(bytearray((b >> shift) & (2 ** bitdepth - 1)
+                               for b in range(256)))
+               for shift in range(8 - bitdepth, -1, -bitdepth)]
+    for bitdepth in (1, 2, 4)}
+
+
+def unpack_samples(bs, bitdepth, width):
+    """
+    Unpack the bytes `bs` of a row of `bitdepth` (1, 2, or 4) bit
+    samples into a ``bytearray`` of `width` values, one per byte.
+    """
+
+    return interleave_tables(as_bytes(bs), sample_tables[bitdepth])[:width]
+
+
+def interleave_tables(row, tables):
+    """
+    Map each byte of `row` (``bytes`` or ``bytearray``)
+    through every one of `tables` (translate tables, of 256 bytes),
+    and interleave the results:
+    returns a ``bytearray`` of ``len(tables)`` values for each byte.
+    """
+
+    n = len(tables)
+    result = bytearray(len(row) * n)
+    for i, table in enumerate(tables):
+        result[i::n] = row.translate(table)
+    return result
+
+
+def value_lookup(table, typecode):
+    """
+    Returns a function that maps each value of a row through
+    the list `table`, returning the results as an array of `typecode`
+    (a ``bytearray`` for ``'B'``).
+    """
+
+    if len(table) <= 256 and typecode == 'B':
+        translate = bytes(bytearray(table + [0] * (256 - len(table))))
+        return lambda row: as_bytes(row).translate(translate)
+    if numpy is not None:
+        lut = numpy.array(table, numpy.dtype(typecode))
+
+        def lookup(row):
+            result = lut[numpy.frombuffer(
+                row, numpy.dtype(row_typecode(row)))].tobytes()
+            if typecode == 'B':
+                return bytearray(result)
+            return array(typecode, result)
+        return lookup
+    if typecode == 'B':
+        return lambda row: bytearray(map(table.__getitem__, row))
+    return lambda row: array(typecode, map(table.__getitem__, row))
+
+
+def row_typecode(row):
+    """The array typecode for the values of `row`: ``'B'`` or ``'H'``."""
+
+    return getattr(row, 'typecode', 'B')
+
+
+def add_transparent_alpha(row, planes, transparent, maxval, typecode):
+    """
+    Add an alpha channel to a `row` of values with `planes` channels:
+    each pixel equal to the `transparent` colour
+    (a tuple, as from a ``tRNS`` chunk) gets 0, the rest `maxval`.
+    Returns an array of `typecode` (a ``bytearray`` for ``'B'``).
+    """
+
+    n = len(row) // planes
+    if typecode == 'B':
+        result = bytearray([maxval]) * (n * (planes + 1))
+    else:
+        result = array(typecode, [maxval]) * (n * (planes + 1))
+    for i in range(planes):
+        result[i::planes + 1] = row[i::planes]
+    if numpy is not None:
+        pixels = numpy.frombuffer(row, numpy.dtype(row_typecode(row)))
+        opaque = (pixels.reshape(n, planes) != transparent).any(axis=1)
+        alpha = opaque.astype(numpy.dtype(typecode)) * maxval
+        result[planes::planes + 1] = array(typecode, alpha.tobytes())
+        return result
+    # Find each transparent pixel as a run of bytes, on a pixel boundary.
+    data = array(row_typecode(row), row).tobytes()
+    pixel = array(row_typecode(row), transparent).tobytes()
+    i = data.find(pixel)
+    while i >= 0:
+        if i % len(pixel) == 0:
+            result[(i // len(pixel)) * (planes + 1) + planes] = 0
+        i = data.find(pixel, i + 1)
+    return result
+
+
+def box_average(rows, width, planes, factor):
+    """
+    Average a band of (up to `factor`) `rows` of values in
+    blocks of `factor` pixels across, rounding half up.
+    The last block is narrower when `factor` does not divide `width`.
+    Returns one reduced row, as a sequence of integers.
+    """
+
+    n = len(rows)
+    reduced = (width + factor - 1) // factor
+    # Pixels in the last, possibly partial, block.
+    last = width - (reduced - 1) * factor
+    if numpy is not None:
+        band = numpy.array(rows, numpy.uint32).reshape(n, width, planes)
+        padded = numpy.zeros((reduced * factor, planes), numpy.uint32)
+        padded[:width] = band.sum(axis=0)
+        sums = padded.reshape(reduced, factor, planes).sum(axis=1)
+        counts = numpy.full((reduced, 1), n * factor, numpy.uint32)
+        counts[-1] = n * last
+        return ((sums + counts // 2) // counts).ravel().tolist()
+
+    columns = list(rows[0])
+    for row in rows[1:]:
+        columns = list(map(operator.add, columns, row))
+    sums = [0] * (reduced * planes)
+    for k in range(factor):
+        for i in range(planes):
+            part = columns[k * planes + i:: factor * planes]
+            sums[i: len(part) * planes: planes] = map(
+                operator.add, sums[i: len(part) * planes: planes], part)
+    count = n * factor
+    result = [(s + count // 2) // count for s in sums[:-planes]]
+    count = n * last
+    result.extend((s + count // 2) // count for s in sums[-planes:])
+    return result
+
+
+def ndarray_view(values, shape):
+    """
+    View the flat array of `values` (a ``bytearray`` or ``array``)
+    with the given `shape`, without copying.
+    Returns a ``numpy.ndarray`` when NumPy is installed,
+    otherwise a ``memoryview``.
+    """
+
+    if numpy is not None:
+        dtype = (numpy.uint8, numpy.uint16)[getattr(values, 'itemsize', 1) > 1]
+        return numpy.frombuffer(values, dtype).reshape(shape)
+    view = memoryview(values)
+    return view.cast('B').cast(view.format, shape)
+
+
+def split_planes(pixels):
+    """
+    Split `pixels`, as returned by :meth:`Reader.read_ndarray`,
+    into its channels.
+    Returns a tuple with one zero-copy view per channel.
+
+    For a ``numpy.ndarray`` each channel is a strided
+    ``(height, width)`` array.
+    A ``memoryview`` cannot be sliced in more than one dimension,
+    so for those each channel is a flat, strided ``memoryview`` of
+    ``height * width`` values, in row-major order.
+    """
+
+    planes = pixels.shape[-1]
+    if numpy is not None and isinstance(pixels, numpy.ndarray):
+        return tuple(pixels[..., i] for i in range(planes))
+    flat = pixels.cast('B').cast(pixels.format)
+    return tuple(flat[i::planes] for i in range(planes))
+
+
+def decompress(data_blocks, max_length=2**16):
     """
     `data_blocks` should be an iterable that
     yields the compressed data (from the ``IDAT`` chunks).
-    This yields decompressed byte strings.
+    This yields decompressed byte strings,
+    each no longer than `max_length` bytes,
+    so a single large ``IDAT`` chunk is inflated a piece at a time.
     """
 
-    # Currently, with no max_length parameter to decompress,
-    # this routine will do one yield per IDAT chunk: Not very
-    # incremental.
     d = zlib.decompressobj()
-    # Each IDAT chunk is passed to the decompressor, then any
-    # remaining state is decompressed out.
+    # Each IDAT chunk is passed to the decompressor,
+    # as views of at most `step` bytes;
+    # input that would produce more than `max_length` bytes is
+    # kept back by zlib (in `unconsumed_tail`, a copy) for the next step,
+    # so limiting the input also limits how much is copied.
+    step = max(1, max_length // 4)
     for data in data_blocks:
-        # :todo: add a max_length argument here to limit output size.
-        yield bytearray(d.decompress(data))
-    yield bytearray(d.flush())
+        view = memoryview(data)
+        for i in range(0, len(view), step):
+            piece = view[i: i + step]
+            while piece:
+                out = d.decompress(piece, max_length)
+                piece = d.unconsumed_tail
+                if out:
+                    yield out
+    # Drain any output zlib is still holding on to.
+    while True:
+        out = d.decompress(b'', max_length)
+        if not out:
+            break
+        yield out
+    out = d.flush()
+    if out:
+        yield out
+
+
+# The number of decompressed blocks that a pipelined Reader
+# may queue ahead of its consumer (about 64 KiB each).
+PIPELINE_DEPTH = 8
+
+
+def pipelined(iterable, depth=PIPELINE_DEPTH):
+    """
+    Iterate over `iterable` in a separate thread,
+    yielding the same items in the same order.
+    At most `depth` items are queued ahead of the consumer;
+    the thread blocks when the queue is full (backpressure).
+
+    An exception raised by `iterable` is raised here,
+    in the consumer, after the items that preceded it.
+    If the consumer stops early (the generator is closed),
+    the thread stops at its next item.
+    """
+
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put((False, item))
+        except BaseException as e:
+            items.put((True, e))
+        else:
+            items.put((True, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            done, item = items.get()
+            if done:
+                break
+            yield item
+        if item is not None:
+            raise item
+    finally:
+        stop.set()
+        # Make room, so that a blocked producer can see `stop`.
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        thread.join()
 
 
 def check_bitdepth_colortype(bitdepth, colortype):
@@ -2267,6 +3552,357 @@ def undo_filter_paeth(filter_unit, scanline, previous, result):
         ai += 1
 
 
+class PythonUnfilter:
+    """
+    The reference scanline unfiltering engine.
+    Each scanline is reconstructed one byte at a time by
+    the ``undo_filter_*`` functions.
+    This is the fallback when NumPy is not available,
+    and it defines the bytes every other engine must produce.
+    """
+
+    name = 'python'
+
+    # Rows handed to :meth:`undo_filter_block` at a time.
+    # Nothing is gained by batching here.
+    block_rows = 1
+
+    def undo_filter(self, filter_unit, filter_type, scanline, previous):
+        """
+        Undo the filter for one scanline, see :meth:`Reader.undo_filter`.
+        `scanline` may be updated in place;
+        the reconstructed scanline is returned.
+        """
+
+        # :todo: Would it be better to update scanline in place?
+        result = scanline
+
+        if filter_type == 0:
+            return result
+
+        check_filter_type(filter_type)
+
+        # For the first line of a pass, synthesize a dummy previous
+        # line.  An alternative approach would be to observe that on the
+        # first line 'up' is the same as 'null', 'paeth' is the same
+        # as 'sub', with only 'average' requiring any special case.
+        if not previous:
+            previous = bytearray([0] * len(scanline))
+
+        # Call appropriate filter algorithm.  Note that 0 has already
+        # been dealt with.
+        fn = (None,
+              undo_filter_sub,
+              undo_filter_up,
+              undo_filter_average,
+              undo_filter_paeth)[filter_type]
+        fn(filter_unit, scanline, previous, result)
+        return result
+
+    def undo_filter_block(self, filter_unit, row_bytes, raw, previous):
+        """
+        Undo the filters for a block of consecutive scanlines.
+        `raw` holds the scanlines exactly as they are in the
+        decompressed stream: each is `row_bytes` long and
+        is preceded by its filter type byte.
+        `previous` is the reconstructed scanline before the block,
+        or ``None`` at the start of the image or pass.
+
+        Returns a ``bytearray`` with the reconstructed scanlines
+        back to back (and without filter type bytes).
+        """
+
+        out = bytearray()
+        for i in range(0, len(raw), row_bytes + 1):
+            previous = self.undo_filter(
+                filter_unit, raw[i],
+                bytearray(raw[i + 1: i + 1 + row_bytes]), previous)
+            out.extend(previous)
+        return out
+
+
+class NumpyUnfilter(PythonUnfilter):
+    """
+    Scanline unfiltering engine using NumPy array operations.
+
+    On a single scanline "None", "Sub" and "Up" are array
+    operations: Sub is a running sum (modulo 256) in each of the
+    `filter_unit` byte lanes, Up is a single addition.
+    "Average" and "Paeth" depend on the byte just reconstructed
+    to the left, so on a single scanline they fall back to
+    the reference loops.
+
+    Blocks of scanlines are unfiltered along anti-diagonals instead:
+    pixel (y, x) depends only on (y, x-1), (y-1, x) and (y-1, x-1),
+    so every pixel of a diagonal ``y + x == t`` can be reconstructed
+    at once from diagonals ``t-1`` and ``t-2``.
+    The block is stored skewed (row `r` shifted right by `r` pixels)
+    so that each diagonal is a contiguous slice,
+    and a block of `k` rows of `w` pixels takes ``w + k`` array steps
+    no matter which filter types it uses.
+    """
+
+    name = 'numpy'
+
+    block_rows = 256
+
+    def undo_filter(self, filter_unit, filter_type, scanline, previous):
+        if filter_type == 2 and previous:
+            x = numpy.frombuffer(scanline, numpy.uint8)
+            b = numpy.frombuffer(previous, numpy.uint8)
+            return bytearray((x + b).tobytes())
+        # With no previous line, Up is None and Paeth is Sub.
+        if filter_type == 2:
+            return scanline
+        if filter_type == 1 or (filter_type == 4 and not previous):
+            x = numpy.frombuffer(scanline, numpy.uint8)
+            x = x.reshape(-1, filter_unit)
+            return bytearray(
+                numpy.cumsum(x, axis=0, dtype=numpy.uint8).tobytes())
+        return super().undo_filter(
+            filter_unit, filter_type, scanline, previous)
+
+    def undo_filter_block(self, filter_unit, row_bytes, raw, previous):
+        raw = numpy.frombuffer(raw, numpy.uint8).reshape(-1, row_bytes + 1)
+        filter_types = raw[:, 0]
+        for filter_type in set(filter_types.tolist()):
+            check_filter_type(filter_type)
+        if not (filter_types >= 2).any():
+            # Only None and Sub: no row depends on the one above,
+            # so all the Sub rows are running sums at once.
+            scanlines = raw[:, 1:].reshape(len(raw), -1, filter_unit)
+            sums = numpy.cumsum(scanlines, axis=1, dtype=numpy.uint8)
+            sub = (filter_types == 1)[:, numpy.newaxis, numpy.newaxis]
+            return bytearray(numpy.where(sub, sums, scanlines).tobytes())
+        if not (filter_types >= 3).any():
+            # Only None, Sub and Up: cheap enough one row at a time.
+            return super().undo_filter_block(
+                filter_unit, row_bytes, bytearray(raw), previous)
+
+        k = len(raw)
+        w = row_bytes // filter_unit
+        lanes = (k, w, filter_unit)
+        # Skewed working buffers, indexed [diagonal, row, lane].
+        # Row 0 is `previous`, row r is scanline r - 1 of the block;
+        # pixel x of row r is stored at diagonal r + x + 1.
+        # Diagonal r of row r is never written, so it supplies
+        # the zero bytes to the left of the first pixel.
+        shape = (w + k + 1, k + 1, filter_unit)
+        recon = numpy.zeros(shape, numpy.int16)
+        filtered = numpy.zeros(shape, numpy.int16)
+        if previous:
+            recon[1: w + 1, 0] = numpy.frombuffer(
+                previous, numpy.uint8).reshape(w, filter_unit)
+        scanlines = raw[:, 1:].reshape(lanes)
+        for r in range(1, k + 1):
+            filtered[r + 1: r + 1 + w, r] = scanlines[r - 1]
+
+        # Masks selecting the rows of each filter type,
+        # (rows, 1) so that they broadcast over the lanes.
+        types = numpy.concatenate(([0], filter_types))[:, numpy.newaxis]
+        present = set(filter_types.tolist())
+        masks = [(t, types == t) for t in (0, 1, 2, 3) if t in present]
+
+        for t in range(2, w + k + 1):
+            lo = max(1, t - w)
+            hi = min(k, t - 1) + 1
+            a = recon[t - 1, lo:hi]
+            b = recon[t - 1, lo - 1:hi - 1]
+            c = recon[t - 2, lo - 1:hi - 1]
+            pred = paeth_predictor(a, b, c) if 4 in present else a
+            for filter_type, mask in masks:
+                if filter_type == 0:
+                    value = 0
+                elif filter_type == 1:
+                    value = a
+                elif filter_type == 2:
+                    value = b
+                else:
+                    value = (a + b) >> 1
+                pred = numpy.where(mask[lo:hi], value, pred)
+            recon[t, lo:hi] = (filtered[t, lo:hi] + pred) & 0xff
+
+        out = numpy.empty(lanes, numpy.uint8)
+        for r in range(1, k + 1):
+            out[r - 1] = recon[r + 1: r + 1 + w, r]
+        return bytearray(out.tobytes())
+
+
+def paeth_predictor(a, b, c):
+    """
+    The Paeth predictor for arrays of
+    left (`a`), above (`b`) and upper left (`c`) values.
+    """
+
+    # With p = a + b - c: p - a is b - c, p - b is a - c,
+    # and p - c is their sum.
+    pb_ = a - c
+    pa_ = b - c
+    pa = numpy.abs(pa_)
+    pb = numpy.abs(pb_)
+    pc = numpy.abs(pa_ + pb_)
+    return numpy.where((pa <= pb) & (pa <= pc), a,
+                       numpy.where(pb <= pc, b, c))
+
+
+# The number of rows that :func:`filter_block` filters at once,
+# when a Writer is filtering with NumPy.
+FILTER_BLOCK_ROWS = 64
+
+
+def group_rows(rows, n):
+    """
+    Join the rows (each a sequence of bytes) in `rows`
+    into ``bytearray`` blocks of (at most) `n` rows.
+    """
+
+    block = bytearray()
+    k = 0
+    for row in rows:
+        block.extend(row)
+        k += 1
+        if k == n:
+            yield block
+            block = bytearray()
+            k = 0
+    if k:
+        yield block
+
+
+def filter_scanline(filter_type, line, previous, filter_unit):
+    """
+    Apply a scanline filter to `line` (a ``bytearray``),
+    with `previous` the line above (all zeros for the first line).
+    `filter_type` is 0 to 4, or ``'adaptive'`` to pick the filter
+    that gives the minimum sum of absolute differences.
+    Returns a ``bytearray``: the filter type byte, then the filtered line.
+    """
+
+    if filter_type == 'adaptive':
+        candidates = [filter_scanline(t, line, previous, filter_unit)
+                      for t in range(5)]
+        return min(candidates, key=lambda c: sum(
+            v if v < 128 else 256 - v for v in itertools.islice(c, 1, None)))
+
+    result = bytearray(1 + len(line))
+    result[0] = filter_type
+    fu = filter_unit
+    for i, x in enumerate(line):
+        a = line[i - fu] if i >= fu else 0
+        b = previous[i]
+        c = previous[i - fu] if i >= fu else 0
+        if filter_type == 0:
+            pr = 0
+        elif filter_type == 1:
+            pr = a
+        elif filter_type == 2:
+            pr = b
+        elif filter_type == 3:
+            pr = (a + b) >> 1
+        else:
+            p = a + b - c
+            pa = abs(p - a)
+            pb = abs(p - b)
+            pc = abs(p - c)
+            if pa <= pb and pa <= pc:
+                pr = a
+            elif pb <= pc:
+                pr = b
+            else:
+                pr = c
+        result[i + 1] = (x - pr) & 0xff
+    return result
+
+
+def filter_block(filter_type, block, previous, filter_unit):
+    """
+    Apply a scanline filter to each row of `block`,
+    a 2-dimensional NumPy ``uint8`` array,
+    with `previous` the row above the block
+    (all zeros for the first row of the image).
+    `filter_type` is as for :func:`filter_scanline`;
+    every row is filtered with every filter at once.
+    Returns a ``uint8`` array with one extra column:
+    the filter type byte of each row, then the filtered row.
+    """
+
+    fu = filter_unit
+    x = block.astype(numpy.int16)
+    b = numpy.empty_like(x)
+    b[0] = previous
+    b[1:] = x[:-1]
+    a = numpy.zeros_like(x)
+    a[:, fu:] = x[:, :-fu]
+    c = numpy.zeros_like(x)
+    c[:, fu:] = b[:, :-fu]
+
+    types = range(5) if filter_type == 'adaptive' else [filter_type]
+    predictors = {0: 0, 1: a, 2: b, 3: (a + b) >> 1}
+    filtered = numpy.empty((len(types),) + x.shape, numpy.uint8)
+    costs = numpy.empty((len(types), x.shape[0]), numpy.int64)
+    for k, t in enumerate(types):
+        if t == 4:
+            prediction = paeth_predictor(a, b, c)
+        else:
+            prediction = predictors[t]
+        filtered[k] = (x - prediction) & 0xff
+        if filter_type == 'adaptive':
+            costs[k] = absolute_difference[filtered[k]].sum(axis=1)
+
+    result = numpy.empty((x.shape[0], x.shape[1] + 1), numpy.uint8)
+    if filter_type == 'adaptive':
+        # The first of the cheapest, so ties favour simpler filters.
+        choice = costs.argmin(axis=0)
+        result[:, 0] = choice
+        result[:, 1:] = filtered[choice, numpy.arange(x.shape[0])]
+    else:
+        result[:, 0] = filter_type
+        result[:, 1:] = filtered[0]
+    return result
+
+
+# The absolute value of each byte, read as a signed byte;
+# the cost that adaptive filtering minimises.
+if numpy is not None:
+    absolute_difference = numpy.array(
+        [min(v, 256 - v) for v in range(256)], numpy.uint8)
+
+
+# Scanline unfiltering engines by name.
+unfilter_backends = {
+    'python': PythonUnfilter,
+    'numpy': NumpyUnfilter,
+}
+
+
+def get_unfilter_backend(name=None):
+    """
+    Return a scanline unfiltering engine.
+    `name` is a key of :data:`unfilter_backends`;
+    ``None`` (or ``'auto'``) picks ``'numpy'`` when NumPy is
+    installed and ``'python'`` otherwise.
+    """
+
+    if name in (None, 'auto'):
+        name = ('python', 'numpy')[numpy is not None]
+    if name not in unfilter_backends:
+        raise ProtocolError(
+            "unknown unfilter backend %r, choose from %s"
+            % (name, ', '.join(sorted(unfilter_backends))))
+    if name == 'numpy' and numpy is None:
+        raise ProtocolError("unfilter backend 'numpy' requires NumPy")
+    return unfilter_backends[name]()
+
+
+def check_filter_type(filter_type):
+    """Raise an exception if `filter_type` is not a PNG filter type."""
+
+    if filter_type not in (0, 1, 2, 3, 4):
+        raise FormatError(
+            'Invalid PNG Filter Type.  '
+            'See http://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters .')
+
+
 def convert_la_to_rgba(row, result):
     for i in range(3):
         result[i::4] = row[0::2]
@@ -2325,15 +3961,51 @@ def cli_open(path):
     return open(path, "rb")
 
 
+def print_info(paths):
+    """
+    Print the header and the chunks of each PNG file in `paths`.
+    """
+
+    for path in paths:
+        info = probe(path)
+        print("%s: %dx%d, bitdepth %d, colour type %d, %s" %
+              (path, info.width, info.height, info.bitdepth,
+               info.color_type,
+               ('straightlaced', 'interlaced')[info.interlace]))
+        # Consecutive chunks of the same type are counted together.
+        with cli_open(path) as file:
+            runs = itertools.groupby(Reader(file=file).chunks(),
+                                     operator.itemgetter(0))
+            for type, chunks in runs:
+                sizes = [len(data) for _, data in chunks]
+                print("  %s %10d bytes%s" %
+                      (type.decode('ascii'), sum(sizes),
+                       " in %d chunks" % len(sizes) if sizes[1:] else ""))
+    return 0
+
+
 def main(argv):
     """
     Run command line PNG.
+    ``bench`` times each phase of decoding
+    (see :func:`imageIO.pngbench.main_phases`);
+    ``info`` prints the header and chunks of PNG files.
+    Returns the exit status.
     """
-    print("What should the command line tool do?", file=sys.stderr)
+
+    if argv[1:2] == ['bench']:
+        from imageIO import pngbench
+        return pngbench.main_phases(argv[2:])
+    if argv[1:2] == ['info'] and argv[2:]:
+        return print_info(argv[2:])
+    print("usage: python -m imageIO.png bench [options] [file ...]\n"
+          "       python -m imageIO.png info file ...", file=sys.stderr)
+    return 2
 
 
 if __name__ == '__main__':
     try:
-        main(sys.argv)
+        sys.exit(main(sys.argv))
     except Error as e:
         print(e, file=sys.stderr)
+        sys.exit(1)
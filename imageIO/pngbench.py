@@ -0,0 +1,531 @@
+"""
+Benchmarks for the :mod:`imageIO.png` codec.
+
+Run ``python -m imageIO.pngbench streaming`` to decode synthetic images
+of increasing height, but the same width, in fresh processes.
+The peak resident set size of each process is reported;
+a row by row decode should use the same memory for all of them,
+since only the row size is the same.
+
+Run ``python -m imageIO.pngbench interlace`` to compare decoding
+the same synthetic image straightlaced and Adam7 interlaced.
+
+Run ``python -m imageIO.pngbench crc`` to compare decoding
+the same synthetic image with each ``verify_crc`` mode of the Reader.
+
+Run ``python -m imageIO.pngbench pipeline`` to compare decoding
+the same synthetic image with and without a pipelined Reader.
+
+Run ``python -m imageIO.pngbench deflate`` to compare encoding
+a synthetic image with a growing number of Writer ``workers``.
+
+Run ``python -m imageIO.pngbench phases`` (or ``python -m imageIO.png bench``)
+to time each phase of decoding, separately,
+on the bundled number plate images and on synthetic images;
+``--save`` writes the times to a JSON baseline, and
+``--baseline`` compares with one, failing on a regression.
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from imageIO import png
+
+
+# Width of the synthetic images; about 50 megapixels is 8192 x 6104.
+WIDTH = 8192
+
+# A peak RSS more than this factor above that of the smallest image
+# means memory use is growing with the image size.
+RSS_GROWTH_LIMIT = 1.25
+
+# A phase that takes more than this factor longer than in the baseline
+# is a regression.
+REGRESSION_THRESHOLD = 1.25
+
+# Phases quicker than this (in the baseline and now) are too noisy
+# to be compared with the baseline.
+MIN_SECONDS = 0.002
+
+# The bundled sample images, in the directory above this package.
+SAMPLES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'numberplate[1-9].png')
+
+# Names of the filter types, for the unfilter phases.
+FILTER_NAMES = ('none', 'sub', 'up', 'average', 'paeth')
+
+
+def write_synthetic(path, width, height, planes=3, compression=1,
+                    interlace=False, workers=1, filter_type=0):
+    """
+    Write a synthetic 8-bit PNG of `width` by `height` pixels to `path`.
+    Rows are a diagonal gradient, generated on the fly
+    so that writing does not need the whole image in memory either
+    (unless `interlace` is true).
+    """
+
+    vpr = width * planes
+    pattern = bytearray(i & 0xff for i in range(vpr + 256))
+
+    def rows():
+        for y in range(height):
+            yield pattern[y & 0xff: (y & 0xff) + vpr]
+
+    writer = png.Writer(width, height, greyscale=(planes == 1),
+                        alpha=(planes in (2, 4)), compression=compression,
+                        interlace=interlace, workers=workers,
+                        filter_type=filter_type)
+    with open(path, 'wb') as out:
+        writer.write(out, rows())
+
+
+def best_of(repeat, function, *args, **kwargs):
+    """
+    Call `function` `repeat` times; return the shortest time, in seconds.
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def read_ndarray(path, **kwargs):
+    """Decode `path` with :meth:`png.Reader.read_ndarray`."""
+
+    return png.Reader(filename=path, **kwargs).read_ndarray()
+
+
+def peak_rss():
+    """Peak resident set size of this process, in bytes."""
+
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    if sys.platform != 'darwin':
+        rss *= 1024
+    return rss
+
+
+def decode_rows(path):
+    """
+    Decode the PNG at `path` one row at a time, discarding the rows.
+    Returns the number of rows decoded.
+    """
+
+    width, height, rows, info = png.Reader(filename=path).read()
+    n = 0
+    for row in rows:
+        n += 1
+    return n
+
+
+def child_decode(path):
+    """
+    Decode `path` in a fresh Python process.
+    Returns (*seconds*, *peak_rss*) measured by the child.
+    """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'imageIO.pngbench', '_decode', path],
+        cwd=root)
+    seconds, rss = output.split()
+    return float(seconds), int(rss)
+
+
+def bench_streaming(megapixels=(5, 50), width=WIDTH):
+    """
+    Decode synthetic images of each size in `megapixels` row by row,
+    each in its own process, and print time and peak RSS.
+    Returns ``True`` when peak RSS stayed within
+    :data:`RSS_GROWTH_LIMIT` of the smallest image's.
+    """
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mp in megapixels:
+            height = max(1, int(mp * 1e6) // width)
+            path = os.path.join(tmp, 'synthetic-%dmp.png' % mp)
+            write_synthetic(path, width, height)
+            seconds, rss = child_decode(path)
+            size = width * height * 3
+            results.append(rss)
+            print("%5.1f MP  %7.1f MB raw  %6.2f s  %7.1f MB/s  "
+                  "peak RSS %6.1f MB" %
+                  (width * height / 1e6, size / 1e6, seconds,
+                   size / 1e6 / seconds, rss / 1e6))
+    growth = max(results) / float(min(results))
+    flat = growth <= RSS_GROWTH_LIMIT
+    print("peak RSS growth x%.2f (limit x%.2f): %s" %
+          (growth, RSS_GROWTH_LIMIT, ('GROWING', 'flat')[flat]))
+    return flat
+
+
+def bench_interlace(megapixels=4, width=2048, repeat=3):
+    """
+    Decode the same synthetic image, straightlaced and interlaced,
+    into a single buffer with :meth:`png.Reader.read_ndarray`,
+    and print the best time of `repeat` runs for each.
+    Returns the interlaced / straightlaced time ratio.
+    """
+
+    height = max(1, int(megapixels * 1e6) // width)
+    size = width * height * 3
+    times = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for interlace in (False, True):
+            path = os.path.join(tmp, 'synthetic-%d.png' % interlace)
+            write_synthetic(path, width, height, interlace=interlace)
+            best = best_of(repeat, read_ndarray, path)
+            times[interlace] = best
+            print("%-13s %5.1f MP  %6.3f s  %7.1f MB/s" %
+                  (('straightlaced', 'interlaced')[interlace],
+                   width * height / 1e6, best, size / 1e6 / best))
+    ratio = times[True] / times[False]
+    print("interlaced / straightlaced: x%.2f" % ratio)
+    return ratio
+
+
+def bench_crc(megapixels=20, width=WIDTH, repeat=3):
+    """
+    Decode a synthetic image with :meth:`png.Reader.read_ndarray`
+    once for each of :data:`png.verify_crc_modes`,
+    and print the best time of `repeat` runs for each.
+    Returns a ``dict`` mapping each mode to its time.
+    """
+
+    height = max(1, int(megapixels * 1e6) // width)
+    size = width * height * 3
+    times = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.png')
+        write_synthetic(path, width, height)
+        for mode in png.verify_crc_modes:
+            best = best_of(repeat, read_ndarray, path, verify_crc=mode)
+            times[mode] = best
+            print("%-13s %5.1f MP  %6.3f s  %7.1f MB/s  x%.2f" %
+                  (mode, width * height / 1e6, best, size / 1e6 / best,
+                   best / times['always']))
+    return times
+
+
+def bench_pipeline(megapixels=20, width=WIDTH, repeat=3):
+    """
+    Decode a synthetic image with :meth:`png.Reader.read_ndarray`,
+    without and with ``pipeline``,
+    and print the best time of `repeat` runs for each.
+    Returns the pipelined / lockstep time ratio.
+    """
+
+    height = max(1, int(megapixels * 1e6) // width)
+    size = width * height * 3
+    times = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.png')
+        # Default compression, so that inflating takes a fair share.
+        write_synthetic(path, width, height, compression=None)
+        for pipeline in (False, True):
+            best = best_of(repeat, read_ndarray, path, pipeline=pipeline)
+            times[pipeline] = best
+            print("%-9s %5.1f MP  %6.3f s  %7.1f MB/s" %
+                  (('lockstep', 'pipeline')[pipeline],
+                   width * height / 1e6, best, size / 1e6 / best))
+    ratio = times[True] / times[False]
+    print("pipeline / lockstep: x%.2f (%d CPUs)" % (ratio, os.cpu_count()))
+    return ratio
+
+
+def bench_deflate(megapixels=20, width=WIDTH, workers=None):
+    """
+    Encode a synthetic image with each number of Writer `workers`
+    (default: 1, 2, 4, ... up to the number of CPUs),
+    and print the time and file size for each.
+    Returns a ``dict`` mapping each number of workers to its time.
+    """
+
+    if workers is None:
+        cpus = os.cpu_count() or 1
+        workers = [1]
+        while workers[-1] < cpus:
+            workers.append(min(2 * workers[-1], cpus))
+    height = max(1, int(megapixels * 1e6) // width)
+    size = width * height * 3
+    times = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.png')
+        for n in workers:
+            # Default compression, the usual setting.
+            best = best_of(1, write_synthetic, path, width, height,
+                           compression=None, workers=n)
+            times[n] = best
+            print("%2d workers  %5.1f MP  %6.3f s  %7.1f MB/s  "
+                  "%7.1f MB  x%.2f" %
+                  (n, width * height / 1e6, best, size / 1e6 / best,
+                   os.path.getsize(path) / 1e6, times[workers[0]] / best))
+    return times
+
+
+def time_phases(data, repeat=3):
+    """
+    Time each phase of decoding the PNG image `data` (bytes), separately.
+    Returns a list of (*phase*, *seconds*, *megabytes*) triples,
+    the best of `repeat` runs for each phase;
+    *megabytes* is the amount of data the phase works through.
+    """
+
+    reader = png.Reader(bytes=data)
+    reader.preamble()
+    idat = [bytes(chunk) for chunk in reader._iter_idat()]
+    raw = list(png.decompress(idat))
+    image_bytes = reader.height * reader.row_bytes / 1e6
+
+    def fresh():
+        fresh_reader = png.Reader(bytes=data)
+        fresh_reader.preamble()
+        return fresh_reader
+
+    def parse():
+        for chunk in png.Reader(bytes=data).chunks():
+            pass
+
+    phases = [
+        ('parse', best_of(repeat, parse), len(data) / 1e6),
+        ('inflate', best_of(repeat, lambda: list(png.decompress(idat))),
+         sum(map(len, raw)) / 1e6),
+    ]
+
+    if reader.interlace:
+        phases.append(('deinterlace', best_of(
+            repeat, lambda: fresh()._deinterlace(iter(raw))), image_bytes))
+    else:
+        phases.append(('unfilter', best_of(
+            repeat, lambda: list(fresh()._iter_straight_packed(iter(raw)))),
+            image_bytes))
+        packed = [bytes(row)
+                  for row in fresh()._iter_straight_packed(iter(raw))]
+        phases.extend(time_filter_types(reader, raw, repeat))
+        phases.append(('convert', best_of(
+            repeat, lambda: list(fresh()._iter_bytes_to_values(packed))),
+            image_bytes))
+
+    phases.append(('decode', best_of(
+        repeat, lambda: png.Reader(bytes=data).read_ndarray()), image_bytes))
+    return phases
+
+
+def time_filter_types(reader, raw, repeat):
+    """
+    Time unfiltering the scanlines of each filter type, separately.
+    `raw` is the decompressed data of the straightlaced image
+    read by `reader`.
+    The scanlines of each type are unfiltered as if they were adjacent,
+    in blocks as :meth:`png.Reader.read` does,
+    so only the time taken is meaningful.
+    Returns (*phase*, *seconds*, *megabytes*) triples,
+    for the filter types that the image uses.
+    """
+
+    joined = b''.join(raw)
+    row_bytes = reader.row_bytes
+    stride = row_bytes + 1
+    by_type = {}
+    for y in range(reader.height):
+        line = joined[y * stride: (y + 1) * stride]
+        by_type.setdefault(line[0], bytearray()).extend(line)
+
+    fu = reader._filter_unit()
+    unfilter = reader.unfilter
+    step = unfilter.block_rows * stride
+
+    def undo(lines):
+        previous = None
+        for i in range(0, len(lines), step):
+            block = unfilter.undo_filter_block(
+                fu, row_bytes, bytearray(lines[i: i + step]), previous)
+            previous = block[-row_bytes:]
+
+    phases = []
+    for filter_type, lines in sorted(by_type.items()):
+        seconds = best_of(repeat, undo, lines)
+        phases.append(('unfilter-' + FILTER_NAMES[filter_type], seconds,
+                       len(lines) // stride * row_bytes / 1e6))
+    return phases
+
+
+def peak_memory(data):
+    """
+    The peak memory allocated while decoding the PNG image `data`
+    with :meth:`png.Reader.read_ndarray`, in bytes,
+    as traced by :mod:`tracemalloc`.
+    """
+
+    tracemalloc.start()
+    try:
+        png.Reader(bytes=data).read_ndarray()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_phases(paths, repeat=3):
+    """
+    Time the decoding phases (see :func:`time_phases`) of
+    each PNG file in `paths`, and print them.
+    Returns a ``dict`` mapping each file's name to
+    a ``dict`` of phase times, in seconds.
+    """
+
+    results = {}
+    for path in paths:
+        name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        info = png.probe(data)
+        print("%s  %dx%d  bitdepth %d  colour type %d%s" %
+              (name, info.width, info.height, info.bitdepth,
+               info.color_type, ('', '  interlaced')[info.interlace]))
+        times = results[name] = {}
+        for phase, seconds, megabytes in time_phases(data, repeat):
+            times[phase] = seconds
+            print("  %-17s %8.4f s  %8.1f MB/s" %
+                  (phase, seconds, megabytes / max(seconds, 1e-9)))
+        peak = peak_memory(data)
+        print("  %-17s %8.1f MB" % ('peak memory', peak / 1e6))
+    print("peak RSS %.1f MB" % (peak_rss() / 1e6))
+    return results
+
+
+def compare_baseline(baseline, results, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare phase times in `results` with those in `baseline`
+    (both as returned by :func:`bench_phases`).
+    Returns a list of (*name*, *phase*, *before*, *now*) for
+    each phase that is more than `threshold` times slower;
+    phases under :data:`MIN_SECONDS` are not compared.
+    """
+
+    regressions = []
+    for name, times in sorted(results.items()):
+        for phase, now in sorted(times.items()):
+            before = baseline.get(name, {}).get(phase)
+            if before is None or max(before, now) < MIN_SECONDS:
+                continue
+            if now > before * threshold:
+                regressions.append((name, phase, before, now))
+    return regressions
+
+
+def main_phases(argv):
+    """
+    The ``phases`` benchmark command, see the module documentation.
+    `argv` are the arguments after the command name.
+    Returns the exit status: 1 when a phase regressed.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog='python -m imageIO.png bench',
+        description="Time each phase of PNG decoding.")
+    parser.add_argument(
+        'files', nargs='*',
+        help="PNG files (default: the bundled number plate images)")
+    parser.add_argument(
+        '--megapixels', type=float, default=8,
+        help="size of the synthetic images (0 for none; default 8)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs of each phase; the best is kept")
+    parser.add_argument('--save', metavar='JSON',
+                        help="save the times as a baseline")
+    parser.add_argument('--baseline', metavar='JSON',
+                        help="compare the times with a saved baseline")
+    parser.add_argument(
+        '--threshold', type=float, default=REGRESSION_THRESHOLD,
+        help="slowdown that counts as a regression (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    paths = args.files or sorted(glob.glob(SAMPLES))
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.megapixels:
+            height = max(1, int(args.megapixels * 1e6) // WIDTH)
+            for interlace in (False, True):
+                path = os.path.join(tmp, 'synthetic-%gmp%s.png' % (
+                    args.megapixels, ('', '-interlaced')[interlace]))
+                write_synthetic(path, WIDTH, height, compression=None,
+                                interlace=interlace, filter_type='adaptive')
+                paths.append(path)
+        results = bench_phases(paths, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("saved baseline to %s" % args.save)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(baseline, results, args.threshold)
+        for name, phase, before, now in regressions:
+            print("REGRESSION %s %s: %.4f s -> %.4f s (x%.2f)" %
+                  (name, phase, before, now, now / before))
+        if regressions:
+            return 1
+        print("no phase regressed more than x%.2f" % args.threshold)
+    return 0
+
+
+def main(argv):
+    """
+    Run the benchmarks named on the command line.
+    """
+
+    if len(argv) == 3 and argv[1] == '_decode':
+        # Internal: the child process of :func:`child_decode`.
+        start = time.perf_counter()
+        decode_rows(argv[2])
+        print(time.perf_counter() - start, peak_rss())
+        return 0
+    if argv[1:2] == ['phases']:
+        return main_phases(argv[2:])
+    if argv[1:2] == ['streaming']:
+        megapixels = [float(mp) for mp in argv[2:]] or [5, 50]
+        return 0 if bench_streaming(megapixels) else 1
+    if argv[1:2] == ['interlace']:
+        megapixels = float(argv[2]) if len(argv) > 2 else 4
+        bench_interlace(megapixels)
+        return 0
+    if argv[1:2] == ['crc']:
+        megapixels = float(argv[2]) if len(argv) > 2 else 20
+        bench_crc(megapixels)
+        return 0
+    if argv[1:2] == ['pipeline']:
+        megapixels = float(argv[2]) if len(argv) > 2 else 20
+        bench_pipeline(megapixels)
+        return 0
+    if argv[1:2] == ['deflate']:
+        megapixels = float(argv[2]) if len(argv) > 2 else 20
+        workers = [int(n) for n in argv[3:]] or None
+        bench_deflate(megapixels, workers=workers)
+        return 0
+    print("usage: python -m imageIO.pngbench phases [options] [file ...]\n"
+          "       python -m imageIO.pngbench streaming [megapixels ...]\n"
+          "       python -m imageIO.pngbench interlace [megapixels]\n"
+          "       python -m imageIO.pngbench crc [megapixels]\n"
+          "       python -m imageIO.pngbench pipeline [megapixels]\n"
+          "       python -m imageIO.pngbench deflate"
+          " [megapixels [workers ...]]",
+          file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
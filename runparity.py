@@ -0,0 +1,378 @@
+import copy
+import io
+import random
+import sys
+
+import CS373LicensePlateDetection
+import CS373NumpyBackend
+from imageIO import png
+
+# Runs the detection stages of both backends on the nine sample images and checks every stage gives the same values.
+# Prints the first stage that differs for each image, and exits with 1 if any image did not match.
+# python runparity.py --random[=N] runs N (200 by default) seeded random images through the stages instead, with
+# random thresholds, standard deviation radii 0 to 4, closings, band counts and pyramid factors.
+# python runparity.py --png decodes 16-bit PNGs with an sBIT chunk through every as* converter of the reader instead.
+
+IMAGES = ["numberplate{}.png".format(i) for i in range(1, 10)]
+
+
+# turns whatever a stage gave back into plain python values, so lists of lists and arrays compare alike
+def toPlain(value):
+
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if hasattr(value, "columns"):
+        return {name: toPlain(column) for name, column in value.columns().items()}
+    if isinstance(value, tuple):
+        return tuple(toPlain(part) for part in value)
+    return value
+
+
+# runs the whole pipeline with one backend, giving back (stage name, result) in order
+def runStages(stages, input_filename):
+
+    (image_width, image_height, px_array_r, px_array_g, px_array_b) = stages.readRGBImageToSeparatePixelArrays(input_filename)
+    yield "red channel", px_array_r
+
+    px_array = stages.computeRGBToGreyscale(px_array_r, px_array_g, px_array_b, image_width, image_height)
+    yield "greyscale", px_array
+    greyscale_array = px_array
+
+    px_array = stages.scaleTo0And255AndQuantize(px_array, image_width, image_height)
+    yield "first stretch", px_array
+
+    yield "standard deviation 5x5", stages.computeStandardDeviationImage5x5(px_array, image_width, image_height)
+
+    px_array = stages.computeStandardDeviationImage(px_array, image_width, image_height)
+    yield "standard deviation", px_array
+
+    px_array = stages.scaleTo0And255AndQuantize(px_array, image_width, image_height)
+    yield "second stretch", px_array
+
+    stretched_array = copy.deepcopy(px_array)
+    px_array = stages.computeThresholdGE(px_array, 150, image_width, image_height)
+    yield "threshold", px_array
+    threshold_array = copy.deepcopy(px_array)
+
+    for i in range(4):
+        px_array = stages.computeDilation8Nbh3x3FlatSE(px_array, image_width, image_height)
+        yield "dilation {}".format(i+1), px_array
+
+    for i in range(4):
+        px_array = stages.computeErosion8Nbh3x3FlatSE(px_array, image_width, image_height)
+        yield "erosion {}".format(i+1), px_array
+
+    closed_array = stages.computeClosing(threshold_array, image_width, image_height, 1, 4)
+    yield "closing", closed_array
+    yield "closing same as erosion 4", toPlain(closed_array) == toPlain(px_array)
+
+    mask = stages.BinaryMask.fromThreshold(stretched_array, 150, image_width, image_height)
+    yield "mask threshold", mask.toPixelArray(255)
+    fused_mask = stages.computeThresholdMaskFused(greyscale_array, image_width, image_height)
+    yield "fused mask", fused_mask.toPixelArray(255)
+    yield "fused mask same as separate stages", toPlain(fused_mask.toPixelArray()) == toPlain(mask.toPixelArray())
+    yield "mask area", mask.area()
+    yield "mask closing", mask.close(1, 4).toPixelArray()
+    yield "mask closing same as erosion 4", toPlain(mask.close(1, 4).toPixelArray()) == toPlain(px_array)
+
+    connected_array, label_dictionary = stages.computeConnectedComponentLabeling(px_array, image_width, image_height)
+    yield "labels", connected_array
+    yield "label sizes", dict(label_dictionary)
+
+    for connectivity in (4, 8):
+        yield "regions {}-connected".format(connectivity), stages.computeConnectedComponentRegions(px_array, image_width, image_height, connectivity)
+    yield "mask regions", mask.close(1, 4).labelRegions()
+    tiled_regions = stages.computeRegionsTiled(greyscale_array, image_width, image_height, workers=2, band_count=7)
+    yield "tiled regions", tiled_regions
+    yield "tiled regions same as whole image", toPlain(tiled_regions) == toPlain(mask.close(1, 4).labelRegions())
+    yield "shrunk by 4", stages.downsampleGreyscale(greyscale_array, image_width, image_height, 4)
+    yield "pyramid regions", stages.computeRegionsPyramid(greyscale_array, image_width, image_height, workers=1)
+
+    number_plate_label = max(label_dictionary, key=label_dictionary.get)
+    plate_box = stages.FindPlateCoordsWithRatio(connected_array, number_plate_label, label_dictionary, image_width, image_height)
+    yield "plate box", plate_box
+
+    connected_array, regions = stages.computeConnectedComponentRegions(px_array, image_width, image_height)
+    yield "plate box from regions", stages.FindPlateCoordsFromRegions(regions)
+    yield "plate box from regions same as rescanning", toPlain(stages.FindPlateCoordsFromRegions(regions)) == toPlain(plate_box)
+    yield "plate candidates", stages.FindPlateCandidates(regions)
+    yield "all plate candidates", stages.FindPlateCandidates(regions, min_relative_area=0, min_fill_ratio=0)
+
+    (image_width, image_height, px_array) = stages.readGreyscaleImageToPixelArray(input_filename)
+    yield "greyscale reader", px_array
+
+
+# a random greyscale image for --random, and the settings to run the stages with, all from the seed. The image is
+# flat blocks of random sizes, one pixel blocks being noise, with a few patches of noise on top of a flat
+# background in half the cases, so there are separate components and plate shaped ones to find
+def randomCase(seed):
+
+    generator = random.Random(seed)
+    image_width = generator.randint(1, 96)
+    image_height = generator.randint(1, 96)
+    block_width = generator.choice([1, 2, 5, 12])
+    block_height = generator.choice([1, 2, 3, 4])
+    blocks = [[generator.randint(0, 255) for j in range(0, image_width, block_width)]
+              for i in range(0, image_height, block_height)]
+    grey_rows = [[blocks[i // block_height][j // block_width] for j in range(image_width)] for i in range(image_height)]
+
+    if generator.random() < 0.5:
+        background = generator.randint(0, 255)
+        patches = [(generator.randrange(image_width), generator.randrange(image_height), generator.randint(1, 30),
+                    generator.randint(1, 10)) for patch in range(generator.randint(0, 4))]
+        grey_rows = [[value if any(left <= j < left+width and top <= i < top+height
+                                   for left, top, width, height in patches) else background
+                      for j, value in enumerate(row)] for i, row in enumerate(grey_rows)]
+
+    settings = {"threshold_value": generator.choice([0, 1, 100, 150, 150, 255]),
+                "radius": generator.randint(0, 4),
+                "closing_radius": generator.choice([0, 1, 1, 2, 4]),
+                "closing_iterations": generator.randint(1, 4),
+                "band_count": generator.randint(1, image_height),
+                "factor": generator.choice([1, 2, 3, 4, 8]),
+                "margin": generator.choice([0, 0.25, 0.5]),
+                "proposals": generator.randint(1, 8),
+                "grey_threshold": generator.randint(1, 255)}
+
+    return image_width, image_height, grey_rows, settings
+
+
+# the stages of runStages on a random case, with its settings, and the checks of shortcuts against the long way round
+def runRandomStages(stages, image_width, image_height, grey_rows, settings):
+
+    threshold_value = settings["threshold_value"]
+    radius = settings["radius"]
+    closing_radius = settings["closing_radius"]
+    closing_iterations = settings["closing_iterations"]
+
+    px_array = stages.scaleTo0And255AndQuantize(copy.deepcopy(grey_rows), image_width, image_height)
+    yield "first stretch", px_array
+    stretched_grey = px_array
+
+    for deviation_radius in range(5):
+        yield "standard deviation radius {}".format(deviation_radius), stages.computeStandardDeviationImage(
+            copy.deepcopy(stretched_grey), image_width, image_height, deviation_radius)
+    yield "standard deviation radius 2 same as 5x5", toPlain(
+        stages.computeStandardDeviationImage(copy.deepcopy(stretched_grey), image_width, image_height, 2)) == toPlain(
+        stages.computeStandardDeviationImage5x5(copy.deepcopy(stretched_grey), image_width, image_height))
+
+    px_array = stages.computeStandardDeviationImage(copy.deepcopy(stretched_grey), image_width, image_height, radius)
+    px_array = stages.scaleTo0And255AndQuantize(px_array, image_width, image_height)
+    yield "second stretch", px_array
+    mask = stages.BinaryMask.fromThreshold(px_array, threshold_value, image_width, image_height)
+    threshold_array = stages.computeThresholdGE(px_array, threshold_value, image_width, image_height)
+    yield "threshold", threshold_array
+
+    fused_mask = stages.computeThresholdMaskFused(copy.deepcopy(grey_rows), image_width, image_height, threshold_value,
+                                                  radius)
+    yield "fused mask", fused_mask.toPixelArray()
+    yield "fused mask same as separate stages", toPlain(fused_mask.toPixelArray()) == toPlain(mask.toPixelArray())
+
+    closed_array = stages.computeClosing(copy.deepcopy(threshold_array), image_width, image_height, closing_radius,
+                                         closing_iterations)
+    yield "closing", closed_array
+    if closing_radius == 1:
+        px_array = copy.deepcopy(threshold_array)
+        for i in range(closing_iterations):
+            px_array = stages.computeDilation8Nbh3x3FlatSE(px_array, image_width, image_height)
+        for i in range(closing_iterations):
+            px_array = stages.computeErosion8Nbh3x3FlatSE(px_array, image_width, image_height)
+        yield "closing same as dilations and erosions", toPlain(closed_array) == toPlain(px_array)
+    closed_mask = mask.close(closing_radius, closing_iterations)
+    yield "mask closing same as closing", toPlain(closed_mask.toPixelArray()) == toPlain(closed_array)
+
+    yield from runLabelStages(stages, closed_array, closed_mask, image_width, image_height, "closing")
+    # the greyscale image thresholded as it is gives label images with many more components
+    grey_mask = stages.BinaryMask.fromThreshold(grey_rows, settings["grey_threshold"], image_width, image_height)
+    yield from runLabelStages(stages, grey_mask.toPixelArray(), grey_mask, image_width, image_height, "greyscale mask")
+
+    for connectivity in (4, 8):
+        tiled_regions = stages.computeRegionsTiled(copy.deepcopy(grey_rows), image_width, image_height, threshold_value,
+                                                   radius, closing_radius, closing_iterations, connectivity,
+                                                   band_count=settings["band_count"])
+        yield "tiled regions {}-connected".format(connectivity), tiled_regions
+        yield "tiled regions {}-connected same as whole image".format(connectivity), toPlain(tiled_regions) == toPlain(
+            fused_mask.close(closing_radius, closing_iterations).labelRegions(connectivity))
+
+        windows, pyramid_regions = stages.computeRegionsPyramid(
+            copy.deepcopy(grey_rows), image_width, image_height, threshold_value, radius, closing_radius,
+            closing_iterations, connectivity, settings["factor"], settings["margin"], settings["proposals"])
+        yield "pyramid {}-connected".format(connectivity), (windows, pyramid_regions)
+        if windows == [(0, 0, image_width, image_height)]:
+            yield "pyramid {}-connected on the whole frame same as tiled".format(connectivity), toPlain(
+                pyramid_regions) == toPlain(tiled_regions[1])
+
+
+# labeling and picking the plate from a black and white label_array (0 and 1) and the same pixels as a BinaryMask
+def runLabelStages(stages, label_array, mask, image_width, image_height, name):
+
+    connected_array, label_dictionary = stages.computeConnectedComponentLabeling(copy.deepcopy(label_array),
+                                                                                 image_width, image_height)
+    yield "{} labels".format(name), connected_array
+    yield "{} label sizes".format(name), dict(label_dictionary)
+
+    for connectivity in (4, 8):
+        (region_array, regions) = stages.computeConnectedComponentRegions(copy.deepcopy(label_array), image_width,
+                                                                          image_height, connectivity)
+        yield "{} regions {}-connected".format(name, connectivity), (region_array, regions)
+        yield "{} mask regions {}-connected same".format(name, connectivity), toPlain(
+            mask.labelRegions(connectivity)) == toPlain((region_array, regions))
+
+    (region_array, regions) = stages.computeConnectedComponentRegions(copy.deepcopy(label_array), image_width,
+                                                                      image_height)
+    yield "{} plate candidates".format(name), stages.FindPlateCandidates(regions)
+    yield "{} all plate candidates".format(name), stages.FindPlateCandidates(regions, min_relative_area=0,
+                                                                             min_fill_ratio=0)
+    if len(regions) > 0:
+        yield "{} plate box from regions".format(name), stages.FindPlateCoordsFromRegions(regions)
+        number_plate_label = max(label_dictionary, key=label_dictionary.get)
+        try:
+            plate_box = stages.FindPlateCoordsWithRatio(connected_array, number_plate_label, dict(label_dictionary),
+                                                        image_width, image_height)
+        except ZeroDivisionError:
+            # the old function divides by the height of a one row component
+            plate_box = None
+        if plate_box is not None:
+            yield "{} plate box from regions same as rescanning".format(name), toPlain(
+                stages.FindPlateCoordsFromRegions(regions)) == toPlain(plate_box)
+
+
+# a random 16-bit PNG for --png, with an sBIT chunk of sbit bits in every plane, and its samples as rows of pixels.
+# Greyscale and RGB images without alpha get a tRNS chunk when transparent is true, the colour of their first pixel
+def sbitImage(seed, planes, sbit, interlace, transparent):
+
+    generator = random.Random(seed)
+    image_width = generator.randint(1, 12)
+    image_height = generator.randint(1, 12)
+    pixel_rows = [[tuple(generator.randrange(2 ** 16) for plane in range(planes)) for j in range(image_width)]
+                  for i in range(image_height)]
+    transparent_colour = pixel_rows[0][0] if transparent else None
+
+    written = io.BytesIO()
+    png.Writer(image_width, image_height, greyscale=planes < 3, alpha=planes in (2, 4), bitdepth=16,
+               interlace=interlace, transparent=transparent_colour).write(
+        written, [[value for pixel in row for value in pixel] for row in pixel_rows])
+    chunks = list(png.Reader(bytes=written.getvalue()).chunks())
+    # sBIT goes before the image data, straight after IHDR will do
+    chunks.insert(1, (b"sBIT", bytes([sbit] * planes)))
+    image = io.BytesIO()
+    png.write_chunks(image, chunks)
+
+    return image.getvalue(), pixel_rows, transparent_colour
+
+
+# what each converter gives for an sbitImage, worked out from its samples as the original pypng reader does: every
+# sample shifted down to sbit bits, tRNS turned into an alpha of 0 or the largest value, asRGB refusing alpha, and
+# the 8-bit converters rescaling with round(value * 255 / largest); asGrey8 with exact=True rounds the luminance
+def expectedConversions(pixel_rows, planes, sbit, transparent_colour):
+
+    shift = 16 - sbit
+    largest = 2 ** sbit - 1
+    factor = float(255) / float(largest)
+    alpha = planes in (2, 4) or transparent_colour is not None
+
+    def shifted(pixel):
+        values = [value >> shift for value in pixel]
+        if transparent_colour is not None:
+            values.append(0 if pixel == transparent_colour else largest)
+        return values
+
+    def toRGBA(values):
+        colour = values[:-1] if alpha else values
+        return (colour * 3 if len(colour) == 1 else colour) + [values[-1] if alpha else largest]
+
+    def rescale(rows):
+        return [[int(round(value * factor)) for value in row] for row in rows]
+
+    direct = [[value for pixel in row for value in shifted(pixel)] for row in pixel_rows]
+    rgba = [[value for pixel in row for value in toRGBA(shifted(pixel))] for row in pixel_rows]
+    rgb = [[value for pixel in row for value in toRGBA(shifted(pixel))[:3]] for row in pixel_rows]
+    grey = [[round(0.299*red + 0.587*green + 0.114*blue) for red, green, blue in zip(row[0::3], row[1::3], row[2::3])]
+            for row in rescale(rgb)]
+
+    return {"asDirect": (direct, sbit),
+            "asRGB": "Error" if alpha else (rgb, sbit),
+            "asRGB8": "Error" if alpha else (rescale(rgb), 8),
+            "asRGBA": (rgba, sbit),
+            "asRGBA8": (rescale(rgba), 8),
+            "asGrey8": (grey, 8)}
+
+
+# runs every converter on an sbitImage, giving back (converter name, (rows, bit depth)) or the name of what it raised
+def runConversions(image):
+
+    for name, convert in [("asDirect", png.Reader.asDirect), ("asRGB", png.Reader.asRGB),
+                          ("asRGB8", png.Reader.asRGB8), ("asRGBA", png.Reader.asRGBA),
+                          ("asRGBA8", png.Reader.asRGBA8),
+                          ("asGrey8", lambda reader: reader.asGrey8(exact=True))]:
+        try:
+            (image_width, image_height, rows, info) = convert(png.Reader(bytes=image))
+            yield name, ([list(row) for row in rows], info["bitdepth"])
+        except png.Error as error:
+            yield name, type(error).__name__
+
+
+# the first stage two runs of the stages differ at, None if they match all the way
+def firstMismatch(reference, candidate):
+
+    for (stage_name, expected), (_, result) in zip(reference, candidate):
+        # stages that check a shortcut against the long way round give True, and have to in both backends
+        if toPlain(expected) != toPlain(result) or expected is False:
+            return stage_name
+    return None
+
+
+def main():
+
+    arguments = sys.argv[1:]
+    failed = []
+
+    if "--png" in arguments:
+        case_count = 0
+        for planes in (1, 2, 3, 4):
+            for sbit in (1, 5, 7, 8):
+                for interlace in (False, True):
+                    for transparent in ((False, True) if planes in (1, 3) else (False,)):
+                        (image, pixel_rows, transparent_colour) = sbitImage(case_count, planes, sbit, interlace,
+                                                                            transparent)
+                        expected = expectedConversions(pixel_rows, planes, sbit, transparent_colour)
+                        case_count = case_count + 1
+                        for name, result in runConversions(image):
+                            if toPlain(result) != toPlain(expected[name]):
+                                print("16-bit PNG with {} planes, sBIT {}{}{}: {} differs".format(
+                                    planes, sbit, ", interlaced" if interlace else "",
+                                    ", tRNS" if transparent else "", name))
+                                failed.append(name)
+        print("{} of {} conversions of {} PNGs match".format(case_count*6 - len(failed), case_count*6, case_count))
+        return 1 if failed else 0
+
+    random_arguments = [argument for argument in arguments if argument.split("=")[0] == "--random"]
+    if random_arguments:
+        case_count = int(random_arguments[-1].split("=", 1)[1]) if "=" in random_arguments[-1] else 200
+        for seed in range(case_count):
+            (image_width, image_height, grey_rows, settings) = randomCase(seed)
+            mismatch = firstMismatch(
+                runRandomStages(CS373LicensePlateDetection, image_width, image_height, grey_rows, settings),
+                runRandomStages(CS373NumpyBackend, image_width, image_height, grey_rows, settings))
+            if mismatch is not None:
+                print("random case {} ({}x{}, {}): backends differ at {}".format(seed, image_width, image_height,
+                                                                                settings, mismatch))
+                failed.append(seed)
+        print("{} of {} random cases match at all stages".format(case_count - len(failed), case_count))
+        return 1 if failed else 0
+
+    for input_filename in arguments or IMAGES:
+        mismatch = firstMismatch(runStages(CS373LicensePlateDetection, input_filename),
+                                 runStages(CS373NumpyBackend, input_filename))
+
+        if mismatch is None:
+            print("{}: all stages match".format(input_filename))
+        else:
+            print("{}: backends differ at {}".format(input_filename, mismatch))
+            failed.append(input_filename)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import sys
+import time
+
+import CS373LicensePlateDetection
+
+# Compares the coarse to fine pyramid detection (computeRegionsPyramid) with the full resolution one
+# (computeRegionsTiled) on the nine sample images: how much the chosen plate boxes overlap, and how long each took.
+# python runpyramid.py [--backend=numpy|python] [--factors=4,8] [--margin=0.25] [--upscale=N]
+# --upscale=N enlarges every frame N times (each pixel an N x N block) to stand in for a higher resolution camera,
+# with the standard deviation window and the closing grown N times as well.
+
+IMAGES = ["numberplate{}.png".format(i) for i in range(1, 10)]
+
+
+# intersection over union of two plate boxes given as first_coords, last_coords ([min_x, max_y], [max_x, min_y])
+def boxOverlap(box, other_box):
+
+    ((min_x, max_y), (max_x, min_y)) = box
+    ((other_min_x, other_max_y), (other_max_x, other_min_y)) = other_box
+    overlap_width = max(0, min(max_x, other_max_x) - max(min_x, other_min_x) + 1)
+    overlap_height = max(0, min(max_y, other_max_y) - max(min_y, other_min_y) + 1)
+    overlap = overlap_width * overlap_height
+    area = (max_x - min_x + 1) * (max_y - min_y + 1)
+    other_area = (other_max_x - other_min_x + 1) * (other_max_y - other_min_y + 1)
+
+    return overlap / (area + other_area - overlap)
+
+
+def main():
+
+    options = {"backend": None, "factors": "4,8", "margin": "0.25", "upscale": "1"}
+    for argument in sys.argv[1:]:
+        name, value = argument[2:].split("=", 1)
+        options[name] = value
+
+    stages = CS373LicensePlateDetection.selectBackend(options["backend"])
+    factors = [int(factor) for factor in options["factors"].split(",")]
+    margin = float(options["margin"])
+    upscale = int(options["upscale"])
+    radius = 2 * upscale
+    closing_iterations = 4 * upscale
+
+    full_time = 0
+    pyramid_times = dict.fromkeys(factors, 0)
+    overlaps = {factor: [] for factor in factors}
+    coverages = {factor: [] for factor in factors}
+
+    for input_filename in IMAGES:
+        (image_width, image_height, px_array) = stages.readGreyscaleImageToPixelArray(input_filename)
+        if upscale > 1:
+            px_array = [[value for value in row for repeat in range(upscale)] for row in px_array for repeat in range(upscale)]
+            image_width = image_width * upscale
+            image_height = image_height * upscale
+            if stages is not CS373LicensePlateDetection:
+                px_array = stages.np.asarray(px_array)
+
+        start = time.perf_counter()
+        connected_array, regions = stages.computeRegionsTiled(px_array, image_width, image_height, 150, radius, 1,
+                                                              closing_iterations)
+        full_box = stages.FindPlateCoordsFromRegions(regions)
+        full_time = full_time + time.perf_counter() - start
+
+        line = "{}: full {}".format(input_filename, full_box)
+        for factor in factors:
+            start = time.perf_counter()
+            windows, regions = stages.computeRegionsPyramid(px_array, image_width, image_height, 150, radius, 1,
+                                                            closing_iterations, factor=factor, margin=margin)
+            pyramid_box = stages.FindPlateCoordsFromRegions(regions)
+            pyramid_times[factor] = pyramid_times[factor] + time.perf_counter() - start
+
+            overlaps[factor].append(boxOverlap(full_box, pyramid_box))
+            coverages[factor].append(sum((right-left) * (bottom-top) for left, top, right, bottom in windows) / (image_width * image_height))
+            line = line + ", 1/{} {} overlap {:.2f}".format(factor, pyramid_box, overlaps[factor][-1])
+        print(line)
+
+    print("full resolution: {:.2f}s".format(full_time))
+    for factor in factors:
+        print("1/{}: {:.2f}s, {:.1f}x faster, {} of {} boxes the same, mean overlap {:.2f}, windows cover {:.0%} of the frame".format(
+            factor, pyramid_times[factor], full_time / pyramid_times[factor],
+            sum(overlap == 1 for overlap in overlaps[factor]), len(IMAGES),
+            sum(overlaps[factor]) / len(IMAGES), sum(coverages[factor]) / len(IMAGES)))
+
+
+if __name__ == "__main__":
+    main()